@@ -0,0 +1,55 @@
+import os
+import re
+import zlib
+from typing import List, Optional
+from sqlalchemy.orm import Session
+
+from models import UserSettings, DEFAULT_ACCOUNT
+
+SCHEDULER_SHARDS = max(1, int(os.getenv("SCHEDULER_SHARDS", "1"))) # Account partitions spread over workers
+ACCOUNT_KEY_RE = re.compile(r"^[a-z0-9][a-z0-9_\-]{0,47}$")
+
+
+class AccountService:
+    """
+    AI funds ("accounts") side by side in one deployment: each has its own settings row,
+    holdings, trade ledger, recommendations and notifications, all keyed by `account`.
+    DEFAULT_ACCOUNT is the original single fund, created on first use like before.
+    """
+
+    def valid_key(self, account: str) -> bool:
+        return bool(ACCOUNT_KEY_RE.match(account or ""))
+
+    def get(self, db: Session, account: str = DEFAULT_ACCOUNT) -> Optional[UserSettings]:
+        return db.query(UserSettings).filter(UserSettings.account == account).first()
+
+    def settings(self, db: Session, account: str = DEFAULT_ACCOUNT) -> UserSettings:
+        """Settings of an account; the default account is created (and committed) on first use."""
+        settings = self.get(db, account)
+        if not settings and account == DEFAULT_ACCOUNT:
+            settings = UserSettings(account=DEFAULT_ACCOUNT)
+            db.add(settings)
+            db.commit()
+            db.refresh(settings)
+        return settings
+
+    def create(self, db: Session, account: str, **values) -> UserSettings:
+        """New account with default settings plus `values`. Caller commits."""
+        settings = UserSettings(account=account, **values)
+        if "ai_cash_balance" not in values and "initial_ai_capital" in values:
+            settings.ai_cash_balance = values["initial_ai_capital"] # Starts fully in cash
+        db.add(settings)
+        return settings
+
+    def list(self, db: Session, autonomous_only: bool = False) -> List[UserSettings]:
+        query = db.query(UserSettings)
+        if autonomous_only:
+            query = query.filter(UserSettings.autonomous_mode == True)
+        return query.order_by(UserSettings.account).all()
+
+    def shard_of(self, account: str, shards: int = SCHEDULER_SHARDS) -> int:
+        """Stable shard for an account (crc32, so every worker agrees without coordination)."""
+        return zlib.crc32((account or DEFAULT_ACCOUNT).encode("utf-8")) % shards
+
+
+accounts = AccountService()
@@ -3,49 +3,61 @@ import os
 import pytz
 from datetime import datetime
 from sqlalchemy.orm import Session
-from typing import List, Dict
+from typing import List, Dict, Optional
 import math
 
 # Updated Imports
-from models import UserSettings, StockUniverse, AIPortfolioItem, AINotification, AITradeHistory, AIRecommendation, StockUniverse
+from models import UserSettings, StockUniverse, AIPortfolioItem, AINotification, AITradeHistory, AIRecommendation, StockUniverse, DEFAULT_ACCOUNT
+from accounts import accounts
 from market_data import market_data
+from market_calendar import market_calendar
+from cycle_profiler import cycle_profiler
+from chat_context import chat_context
+from llm_gateway import llm_gateway
+from screening import candidate_pipeline, stage_budgets, StageBudget, CycleSnapshot, REGIME_QUERY, MODE_HELD, MODE_FULL_MARKET
 # from news_agent import news_agent # Disabled for now to focus on allocation logic
 from portfolio_engine import PortfolioEngine
+from risk_engine import RiskEngine
+from fundamentals_store import fundamentals_store
 
 class AutonomousAgent:
-    def __init__(self, db: Session):
+    def __init__(self, db: Session, account: str = DEFAULT_ACCOUNT):
         self.db = db
+        self.account = account # Every holding/trade/recommendation/notification read or written is this fund's
         # We don't need news_agent for the core allocation engine right now, 
         # but can re-enable for "Regime Detection" later.
 
-    def run_trading_cycle(self):
+    def run_trading_cycle(self, shared: Optional[CycleSnapshot] = None):
         """
         Executes the 'Forever Fund' Daily Allocation Cycle.
         1. Inject Daily Budget (if new day).
         2. Score the Universe (Opportunity Score).
         3. Allocate Capital to Top Ideas.
         4. Execute Buys.
+        Each run is profiled per stage and stored in cycle_metrics. `shared` carries the market
+        snapshot, regime and news sentiment of a scheduler tick that runs several accounts.
         """
+        with cycle_profiler.profile("trading_cycle", self.account) as profile:
+            return self._run_trading_cycle(profile, shared)
+
+    def _run_trading_cycle(self, profile, shared: Optional[CycleSnapshot] = None):
         notifications = []
-        print("[FOREVER FUND] Starting Daily Cycle...")
+        print(f"[FOREVER FUND] Starting Daily Cycle ({self.account})...")
 
         # 1. Get Settings & Check Trading Hours
-        settings = self.db.query(UserSettings).first()
-        if not settings:
-            settings = UserSettings()
-            self.db.add(settings)
-            self.db.commit()
+        with cycle_profiler.stage("settings"):
+            settings = accounts.settings(self.db, self.account)
+            if not settings:
+                print(f"[CYCLE] Unknown account '{self.account}'")
+                profile.status = "SKIPPED"
+                return []
             
-        # Check Trading Hours (PKT)
-        pkt_tz = pytz.timezone('Asia/Karachi')
-        now_pkt = datetime.now(pkt_tz)
-        current_time_str = now_pkt.strftime("%H:%M")
-        
-        start_time = settings.trading_start_time or "09:30"
-        end_time = settings.trading_end_time or "15:30"
-        
-        if not (start_time <= current_time_str <= end_time):
-             print(f"[CYCLE] Skipping: Time {current_time_str} outside {start_time}-{end_time}")
+        # Check Market Calendar (PKT trading hours, weekends, PSX holidays, half-days)
+        market = market_calendar.status(settings)
+        if not market["is_open"]:
+             next_open = market["next_open"].strftime("%Y-%m-%d %H:%M") if market["next_open"] else "unknown"
+             print(f"[CYCLE] Skipping: {market['reason']}. Next open {next_open} PKT")
+             profile.status = "SKIPPED"
              return []
 
         # 2. Daily Budget Injection
@@ -55,87 +67,117 @@ class AutonomousAgent:
         
         if settings.ai_cash_balance < 1000:
             print("[CYCLE] Low Cash (<1000). Waiting for deposit.")
+            profile.status = "SKIPPED"
             return []
 
         # 3. Allocation Engine
-        allocation_plan = self._allocate_capital(settings.ai_cash_balance, settings)
+        allocation_plan = self._allocate_capital(settings.ai_cash_balance, settings, shared)
         
         print(f"[DEBUG] Allocation Plan returned {len(allocation_plan)} items.")
         
         # 4. Execute Plan -> CREATE RECOMMENDATIONS (Approvals Required)
-        for trade in allocation_plan:
-            print(f"[DEBUG] Processing allocation for {trade['symbol']}")
-            self.create_recommendation(
-                trade["symbol"],
-                "BUY",
-                trade["quantity"],
-                trade["price"],
-                f"Forever Fund Allocation: Score {trade['score']} (Tier: {trade['tier']}). {trade.get('news_reason', '')}",
-                notifications
-            )
+        with cycle_profiler.stage("db_writes"):
+            self.create_recommendations([
+                {
+                    "symbol": trade["symbol"],
+                    "action": "BUY",
+                    "quantity": trade["quantity"],
+                    "price": trade["price"],
+                    "reason": f"Forever Fund Allocation: Score {trade['score']} (Tier: {trade['tier']}). {trade.get('news_reason', '')}"
+                }
+                for trade in allocation_plan
+            ], notifications)
             
         return notifications
 
     def create_recommendation(self, symbol, action, quantity, price, reason, notifications):
         """Creates a trade recommendation for user approval."""
-        print(f"[RECOMMENDATION] Proposed {action} {quantity} {symbol} @ {price}")
-        
-        # Check if pending recommendation exists to avoid duplicates
-        existing = self.db.query(AIRecommendation).filter(
-            AIRecommendation.symbol == symbol, 
-            AIRecommendation.action == action,
-            AIRecommendation.status == "PENDING"
-        ).first()
-        
-        if existing:
-            print(f"[RECOMMENDATION] Duplicate found for {symbol}, updating.")
-            # Update quantity/reason if strategy changed mind? 
-            # Better to skip or update only if significant. Let's skip for now.
-            return
-
-        rec = AIRecommendation(
-            symbol=symbol,
-            action=action,
-            quantity=quantity,
-            price=price,
-            reason=reason,
-            status="PENDING"
-        )
-        self.db.add(rec)
-        
-        # Notify
-        msg = f"Proposed {action} of {quantity} {symbol}. Waiting for approval."
-        self._add_notification("Action Required", msg, "ACTION_REQUIRED", notifications)
+        self.create_recommendations([{
+            "symbol": symbol,
+            "action": action,
+            "quantity": quantity,
+            "price": price,
+            "reason": reason
+        }], notifications)
+
+    def create_recommendations(self, trades: List[Dict], notifications) -> List[AIRecommendation]:
+        """
+        Creates recommendations for a whole plan in one transaction.
+        Pending (symbol, action) pairs are preloaded with a single query to skip duplicates.
+        """
+        if not trades:
+            return []
+
+        symbols = {t["symbol"] for t in trades}
+        pending = {
+            (symbol, action)
+            for symbol, action in self.db.query(AIRecommendation.symbol, AIRecommendation.action).filter(
+                AIRecommendation.account == self.account,
+                AIRecommendation.symbol.in_(symbols),
+                AIRecommendation.status == "PENDING"
+            ).all()
+        }
+
+        created = []
+        for trade in trades:
+            key = (trade["symbol"], trade["action"])
+            print(f"[RECOMMENDATION] Proposed {trade['action']} {trade['quantity']} {trade['symbol']} @ {trade['price']}")
+            if key in pending:
+                # Skip rather than update: only re-propose once the pending one is resolved
+                print(f"[RECOMMENDATION] Duplicate found for {trade['symbol']}, skipping.")
+                continue
+            pending.add(key) # Also dedups within the plan itself
+
+            rec = AIRecommendation(
+                account=self.account,
+                symbol=trade["symbol"],
+                action=trade["action"],
+                quantity=trade["quantity"],
+                price=trade["price"],
+                reason=trade.get("reason"),
+                status="PENDING"
+            )
+            self.db.add(rec)
+            created.append(rec)
+
+            # Notify
+            msg = f"Proposed {trade['action']} of {trade['quantity']} {trade['symbol']}. Waiting for approval."
+            self._add_notification("Action Required", msg, "ACTION_REQUIRED", notifications)
+
         self.db.commit()
+        return created
 
-    def _allocate_capital(self, available_cash: float, settings: UserSettings) -> List[Dict]:
+    def _allocate_capital(self, available_cash: float, settings: UserSettings, shared: Optional[CycleSnapshot] = None) -> List[Dict]:
         """
         Core Logic: Distributes cash to the best opportunities in the Universe.
         Includes AI News Sentiment Analysis.
         """
         from news_agent import news_agent
         
-        universe = self.db.query(StockUniverse).filter(StockUniverse.active == True).all()
-        
-        # --- RESTRICTION: Only Recommend Held Stocks ---
-        holdings = self.db.query(AIPortfolioItem).all()
-        held_symbols = {h.symbol for h in holdings}
-        
-        # Filter Universe
-        # We only keep stocks that are currently in the portfolio
-        universe = [s for s in universe if s.symbol in held_symbols]
+        mode = settings.universe_mode or MODE_HELD
+        full_market = mode == MODE_FULL_MARKET
+        budgets = stage_budgets(settings.polling_interval)
+
+        with cycle_profiler.stage("universe_load"):
+            universe = self.db.query(StockUniverse).filter(StockUniverse.active == True).all()
+            holdings = self.db.query(AIPortfolioItem).filter(AIPortfolioItem.account == self.account).all()
+            held_symbols = {h.symbol for h in holdings}
         
-        if not universe:
-            print("[ALLOCATION] Restricted Mode: No held stocks found in Universe. Skipping analysis.")
-            return []
+        # --- RESTRICTION: Only Recommend Held Stocks (default mode) ---
+        if mode == MODE_HELD:
+            universe = [s for s in universe if s.symbol in held_symbols]
+            if not universe:
+                print("[ALLOCATION] Restricted Mode: No held stocks found in Universe. Skipping analysis.")
+                return []
         # -----------------------------------------------
 
-        if not universe:
+        if not universe and not full_market:
             print("[ALLOCATION] Universe is empty!")
             return []
 
         # A. Market Regime Check (Macro)
-        regime_data = news_agent.get_sentiment_score("Pakistan Stock Exchange KSE100 Market Outlook")
+        with cycle_profiler.stage("regime"):
+            regime_data = shared.regime() if shared else news_agent.get_sentiment_score(REGIME_QUERY)
         regime_score = regime_data.get("score", 0.0)
         regime_summary = regime_data.get("summary", "")
         
@@ -149,35 +191,34 @@ class AutonomousAgent:
         else:
             print(f"[REGIME] Neutral Mode ({regime_score})")
 
-        # B. Technical/Fundamental Scoring
-        scored_stocks = []
-        market_summary = market_data.get_market_summary()
-        
-        for stock in universe:
-            market_price = market_data.get_live_price(stock.symbol)
-            if market_price <= 0: continue
-            
-            score_details = self._calculate_opportunity_score(stock, market_price, market_summary)
-            score = score_details["total_score"]
-            
-            scored_stocks.append({
-                "symbol": stock.symbol,
-                "tier": stock.tier,
-                "score": score, # Base Score
-                "price": market_price,
-            })
-
-        # C. Filter Top Candidates for Deep AI Analysis
-        # We only check news for the top 7 to save time/tokens
-        scored_stocks.sort(key=lambda x: x["score"], reverse=True)
-        top_candidates = scored_stocks[:7]
+        # B. Stage 1: Bulk snapshot (one upstream call for the whole board)
+        with cycle_profiler.stage("snapshot"):
+            symbols = None if full_market else [s.symbol for s in universe]
+            snapshot = candidate_pipeline.load_snapshot(symbols, StageBudget("snapshot", budgets["snapshot"]), shared)
+
+        # Stage 2: Vectorized Technical/Fundamental Scoring -> shortlist for deep analysis
+        with cycle_profiler.stage("scoring"):
+            top_candidates = candidate_pipeline.score(snapshot, universe, held_symbols, full_market)
         
+        # C. Stage 3: Deep AI Analysis (news + LLM) on the shortlist only, within its budget
         final_candidates = []
+        deep_budget = StageBudget("deep_analysis", budgets["deep_analysis"])
         print(f"\n[AI ANALYSIS] Analyzying news for top {len(top_candidates)} candidates...")
         
+        # One concurrent search per candidate, then one batched sentiment call for all of them
+        with cycle_profiler.stage("candidate_news"), llm_gateway.deadline(deep_budget.remaining()):
+            candidate_symbols = [c["symbol"] for c in top_candidates]
+            news_timeout = max(1, int(deep_budget.remaining()))
+            if shared:
+                sentiments = shared.sentiments(candidate_symbols, news_timeout)
+            else:
+                symbol_news = news_agent.fetch_symbol_news(candidate_symbols, timeout=news_timeout)
+                sentiments = news_agent.get_batch_sentiment(symbol_news)
+        if deep_budget.exceeded():
+            print(f"[AI ANALYSIS] Budget of {budgets['deep_analysis']:.0f}s exceeded by news analysis.")
+        
         for cand in top_candidates:
-            # Fetch Stock Specific News
-            news_data = news_agent.get_sentiment_score(f"{cand['symbol']} stock financial news")
+            news_data = sentiments.get(cand["symbol"], {"score": 0.0, "summary": "No recent news found."})
             n_score = news_data.get("score", 0.0)
             n_reason = news_data.get("summary", "")
             
@@ -238,69 +279,37 @@ class AutonomousAgent:
                     "news_reason": cand["news_reason"]
                 })
                 print(f" -> {cand['symbol']} ({cand['tier']}): {qty} shares @ {cand['price']}")
+
+        # E. Risk limits: stock, sector and single-trade caps checked over the whole plan at once
+        with cycle_profiler.stage("risk_check"):
+            allocations = self._apply_risk_limits(allocations, holdings, settings)
                 
         return allocations
 
-    def _calculate_opportunity_score(self, stock: StockUniverse, current_price: float, market_stats: Dict) -> Dict:
-        """
-        Scoring Engine (0-100)
-        """
-        fundamentals = json.loads(stock.fundamentals_json)
-        
-        # A. Valuation Score (0-30)
-        # Using Fundamentals vs Price
-        val_score = 15 # Default neutral
-        fair_value = fundamentals.get("fair_value", 0)
-        pe_ratio = fundamentals.get("pe", 0) # Target PE? or Current? Assuming static 'fair' PE for now
-        
-        if fair_value > 0:
-            upside = (fair_value - current_price) / current_price
-            # If upside > 20% -> High Score
-            if upside > 0.20: val_score = 30
-            elif upside > 0.10: val_score = 25
-            elif upside > 0: val_score = 20
-            elif upside > -0.10: val_score = 10
-            else: val_score = 5
-        
-        # B. Momentum Score (0-30)
-        # Simplified using simple Moving Average logic or RSI if available.
-        # Since we only have KLines on demand, we'll try to deduce from market_data if possible, 
-        # or use a simplified "Active vs Previous" check if we had history.
-        # For now, let's use a placeholder based on market sentiment for the stock?
-        # Actually, let's fetch KLines for the specific stock to verify trend.
-        mom_score = 15
-        try:
-            # We can't fetch klines for EVERY stock in the loop efficiently without rate limits.
-            # Workaround: Use Daily Change from market_stats if present
-            # Or assume neutral if data missing.
-            pass
-        except:
-            pass
-            
-        # C. Position Context (0-15)
-        # Underweight = Higher Score
-        p_score = 7
-        existing = self.db.query(AIPortfolioItem).filter(AIPortfolioItem.symbol == stock.symbol).first()
-        
-        # Calculate current weight
-        # This is expensive to do for all, so maybe estimate?
-        # Let's Skip complex portfolio weight calc for MVP and prioritize "Don't have it? Buy it"
-        if not existing:
-            p_score = 15 # High priority if missing
-        else:
-            # If we have it, check if we are below target weight?
-            # Requires Total Portfolio Value. 
-            pass
+    def _apply_risk_limits(self, allocations: List[Dict], holdings: List[AIPortfolioItem], settings: UserSettings) -> List[Dict]:
+        """Clips the plan to the RiskEngine caps; trades left with no shares are dropped."""
+        if not allocations:
+            return allocations
+        total_value = (settings.ai_cash_balance or 0.0) + sum(
+            (h.quantity or 0) * (h.current_price or h.avg_cost or 0.0) for h in holdings
+        )
+        engine = RiskEngine(holdings, total_value, sector_of=lambda symbol: (fundamentals_store.get(symbol) or {}).get("sector"))
 
-        # D. Fundamental (0-25)
-        # Static from Universe for now
-        fun_score = 20 # Assume good fundamentals if in Universe
-        
-        total = val_score + mom_score + fun_score + p_score
-        return {"total_score": min(100, total), "val": val_score, "mom": mom_score}
+        checked = []
+        for alloc, verdict in zip(allocations, engine.check_plan(allocations)):
+            if not verdict["allowed"]:
+                print(f"[RISK] {alloc['symbol']}: {verdict['requested_quantity']} -> {verdict['quantity']} shares. {verdict['reason']}")
+            if verdict["quantity"] > 0:
+                checked.append({**alloc, "quantity": verdict["quantity"]})
+        return checked
 
-    def execute_trade(self, symbol, action, quantity, price, reason, notifications, settings, recommendation_id=None):
-        """Executes a trade and logs it definitively."""
+    def execute_trade(self, symbol, action, quantity, price, reason, notifications, settings, recommendation_id=None, commit=True):
+        """
+        Executes a trade and logs it definitively.
+        Returns True on success. With commit=False the changes are only flushed,
+        so a caller can execute several trades in one transaction; the caller then
+        invalidates the chat context after its own commit.
+        """
         
         total_val = quantity * price
         
@@ -308,7 +317,7 @@ class AutonomousAgent:
             # Double check cash
             if settings.ai_cash_balance < total_val:
                 print(f"[EXECUTE] Fail: Insufficient Cash for {symbol}")
-                return
+                return False
 
             print(f"[EXECUTE] Buying {quantity} {symbol} @ {price}")
             
@@ -316,7 +325,7 @@ class AutonomousAgent:
             settings.ai_cash_balance -= total_val
             
             # 2. Update/Create Portfolio Item
-            item = self.db.query(AIPortfolioItem).filter(AIPortfolioItem.symbol == symbol).first()
+            item = self.db.query(AIPortfolioItem).filter(AIPortfolioItem.account == self.account, AIPortfolioItem.symbol == symbol).first()
             if item:
                 # Avg Cost Logic
                 new_cost = item.total_cost + total_val
@@ -327,6 +336,7 @@ class AutonomousAgent:
                 item.current_price = price 
             else:
                 new_item = AIPortfolioItem(
+                    account=self.account,
                     symbol=symbol,
                     quantity=quantity,
                     avg_cost=price,
@@ -339,6 +349,7 @@ class AutonomousAgent:
                 
             # 3. Log Trade History
             history = AITradeHistory(
+                account=self.account,
                 symbol=symbol,
                 action="BUY",
                 quantity=quantity,
@@ -360,10 +371,10 @@ class AutonomousAgent:
         elif action == "SELL":
             print(f"[EXECUTE] Selling {quantity} {symbol} @ {price}")
             
-            item = self.db.query(AIPortfolioItem).filter(AIPortfolioItem.symbol == symbol).first()
+            item = self.db.query(AIPortfolioItem).filter(AIPortfolioItem.account == self.account, AIPortfolioItem.symbol == symbol).first()
             if not item or item.quantity < quantity:
                 print(f"[EXECUTE] Fail: Insufficient Quantity for {symbol}")
-                return
+                return False
 
             # 1. Update Cash
             settings.ai_cash_balance += total_val
@@ -384,6 +395,7 @@ class AutonomousAgent:
             
             # 3. Log Trade History
             history = AITradeHistory(
+                account=self.account,
                 symbol=symbol,
                 action="SELL",
                 quantity=quantity,
@@ -403,10 +415,17 @@ class AutonomousAgent:
             )
 
         # 5. Commit
-        self.db.commit()
+        if commit:
+            self.db.commit()
+            # Chat shouldn't describe the portfolio as it was before this trade
+            chat_context.invalidate("ai_portfolio")
+            chat_context.invalidate("ai_trade_history")
+        else:
+            self.db.flush() # Later trades in the same batch must see this position; caller invalidates after its commit
+        return True
 
     def _add_notification(self, title, message, type, notifications):
-        note = AINotification(title=title, message=message, type=type)
+        note = AINotification(account=self.account, title=title, message=message, type=type)
         self.db.add(note)
         # self.db.commit() # Commit done in caller
         notifications.append({"title": title, "message": message, "type": type})
@@ -0,0 +1,328 @@
+"""
+Offline hot-path benchmarks with a regression gate.
+
+Runs the portfolio, allocation, news, chat-context and history paths against the offline
+stand-ins (offline_data.py, LLM_BACKEND=offline) and a seeded database, records latency
+percentiles and peak allocations per case, and compares them with a stored baseline.
+
+    python benchmark.py                          # temp SQLite DB, compare with benchmark_baseline.json
+    python benchmark.py --update-baseline        # record a new baseline
+    DATABASE_URL=postgresql://... python benchmark.py --trades 200000 --baseline pg_baseline.json
+
+Exit code 1 when a case regressed past the tolerance, 2 when the baseline doesn't match the run.
+"""
+import os
+import sys
+import gc
+import json
+import time
+import argparse
+import platform
+import tempfile
+import resource
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+DEFAULT_SIZES = {"universe": 200, "holdings": 40, "manual_holdings": 30, "trades": 20000,
+                 "transactions": 5000, "history_days": 730, "notifications": 2000}
+LATENCY_TOLERANCE = 0.25   # p50/p90 may grow 25% over baseline...
+LATENCY_SLACK_MS = 10.0    # ...plus this much absolute, so fast cases don't flap on scheduler noise
+MEMORY_TOLERANCE = 0.30
+MEMORY_SLACK_KB = 256
+
+
+def _offline_environment(database_url: Optional[str]):
+    """Selects the offline backends; must run before any app module is imported."""
+    os.environ.setdefault("LLM_BACKEND", "offline")
+    os.environ.setdefault("MARKET_DATA_BACKEND", "offline")
+    os.environ.setdefault("SEARCH_BACKEND", "offline")
+    workdir = tempfile.mkdtemp(prefix="psx-bench-")
+    os.environ.setdefault("LLM_CACHE_PATH", os.path.join(workdir, "llm_cache.db"))
+    os.environ["DATABASE_URL"] = database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    if os.environ["LLM_BACKEND"] != "offline" or os.environ["MARKET_DATA_BACKEND"] != "offline":
+        raise SystemExit("Benchmarks run offline only (LLM_BACKEND / MARKET_DATA_BACKEND must be 'offline').")
+
+
+# --- Seeding ---
+
+def seed_database(sizes: Dict[str, int], allow_existing: bool = False):
+    from sqlalchemy import insert
+    from models import (SessionLocal, init_db, StockUniverse, StockFundamentals, AIPortfolioItem, PortfolioItem,
+                        AITradeHistory, Transaction, PortfolioHistory, AINotification)
+    from accounts import accounts
+    from offline_data import offline_symbols, offline_price, offline_sector
+
+    init_db()
+    db = SessionLocal()
+    try:
+        if db.query(AITradeHistory.id).first() and not allow_existing:
+            raise SystemExit("Database already has data; benchmarks seed an empty one (use --allow-existing to reuse it).")
+        if db.query(AITradeHistory.id).first():
+            return
+
+        symbols = offline_symbols(max(sizes["universe"], sizes["holdings"], sizes["manual_holdings"]))
+        now = datetime.utcnow()
+        tiers = ("CORE", "STABILITY", "OPTIONAL")
+
+        db.execute(insert(StockUniverse), [
+            {"symbol": s, "tier": tiers[i % 3], "active": True,
+             "fundamentals_json": json.dumps({"fair_value": round(offline_price(s, 0) * 1.15, 2), "pe": 6 + i % 10})}
+            for i, s in enumerate(symbols[:sizes["universe"]])
+        ])
+        db.execute(insert(StockFundamentals), [
+            {"symbol": s, "sector": offline_sector(s), "pe": 6 + i % 10, "fair_value": round(offline_price(s, 0) * 1.15, 2),
+             "dividend_yield": i % 12, "source": "MANUAL", "updated_at": now}
+            for i, s in enumerate(symbols[:sizes["universe"]])
+        ])
+
+        held = symbols[:sizes["holdings"]]
+        db.execute(insert(AIPortfolioItem), [
+            {"account": "default", "symbol": s, "quantity": 100 + i, "avg_cost": offline_price(s, 0),
+             "total_cost": (100 + i) * offline_price(s, 0), "current_price": offline_price(s, 0), "purchased_at": now}
+            for i, s in enumerate(held)
+        ])
+        db.execute(insert(PortfolioItem), [
+            {"symbol": s, "quantity": 50 + i, "avg_cost": offline_price(s, 0)}
+            for i, s in enumerate(symbols[:sizes["manual_holdings"]])
+        ])
+
+        actions = ("BUY", "BUY", "SELL", "DEPOSIT")
+        db.execute(insert(AITradeHistory), [
+            {"account": "default", "symbol": held[i % len(held)] if held else "CASH", "action": actions[i % 4],
+             "quantity": 0 if actions[i % 4] == "DEPOSIT" else 10, "price": 5000.0 if actions[i % 4] == "DEPOSIT" else 100.0,
+             "pnl": 25.0 if actions[i % 4] == "SELL" else None,
+             "timestamp": now - timedelta(minutes=sizes["trades"] - i), "reason": "Seeded benchmark trade"}
+            for i in range(sizes["trades"])
+        ])
+        db.execute(insert(Transaction), [
+            {"symbol": symbols[i % len(symbols)], "action": "BUY" if i % 3 else "SELL", "quantity": 10, "price": 100.0,
+             "timestamp": now - timedelta(minutes=sizes["transactions"] - i), "notes": "Seeded"}
+            for i in range(sizes["transactions"])
+        ])
+        db.execute(insert(PortfolioHistory), [
+            {"total_value": 1e6 + i * 100, "cash_balance": 1e5, "holdings_value": 9e5 + i * 100,
+             "date": now - timedelta(days=sizes["history_days"] - i)}
+            for i in range(sizes["history_days"])
+        ])
+        db.execute(insert(AINotification), [
+            {"account": "default", "title": f"Seeded {i}", "message": "Benchmark notification", "type": "INFO",
+             "timestamp": now - timedelta(minutes=sizes["notifications"] - i)}
+            for i in range(sizes["notifications"])
+        ])
+
+        settings = accounts.settings(db)
+        settings.ai_cash_balance = 500000.0
+        settings.cash_balance = 250000.0
+        settings.universe_mode = "UNIVERSE"
+        db.commit()
+    finally:
+        db.close()
+
+
+# --- Cases ---
+
+@contextmanager
+def _market_open():
+    """analyze_news skips closed sessions; benchmarks must not depend on the wall clock."""
+    from market_calendar import market_calendar
+    original = market_calendar.status
+    market_calendar.status = lambda settings=None, now=None: {**original(settings, now), "is_open": True}
+    try:
+        yield
+    finally:
+        market_calendar.status = original
+
+
+def _cold_market_caches():
+    """Every iteration pays for its upstream calls (at the stand-in latency) instead of hitting warm caches."""
+    from market_data import market_data
+    from chat_context import chat_context
+    from search_client import search_client
+    from offline_data import advance
+    market_data.price_cache.clear()
+    market_data.ticks_cache = None
+    market_data.stats_cache = None
+    with search_client.lock:
+        search_client.cache.clear()
+    chat_context.invalidate()
+    advance() # Fresh prices and stories, so news dedup and the LLM cache see new input
+
+
+def build_cases() -> Dict[str, Dict]:
+    """{name: {"run": fn(db, client), "setup": fn() or None}}."""
+    import main
+    from portfolio_engine import PortfolioEngine
+    from autonomous_agent import AutonomousAgent
+    from accounts import accounts
+
+    def allocate(db, client):
+        settings = accounts.settings(db)
+        return AutonomousAgent(db)._allocate_capital(settings.ai_cash_balance, settings)
+
+    def analyze(db, client):
+        with _market_open():
+            return main.analyze_news(db)
+
+    def chat(db, client):
+        request = main.ChatRequest(message="How is my portfolio doing? Any news on QAAB today?")
+        return main.build_chat_context(request, db)
+
+    return {
+        "ai_portfolio_data": {"run": lambda db, client: main.get_ai_portfolio_data(db, True), "setup": _cold_market_caches},
+        "portfolio_summary": {"run": lambda db, client: PortfolioEngine(db).get_portfolio_summary(), "setup": _cold_market_caches},
+        "allocate_capital": {"run": allocate, "setup": _cold_market_caches},
+        "analyze_news": {"run": analyze, "setup": _cold_market_caches},
+        "chat_context": {"run": chat, "setup": _cold_market_caches},
+        "history_trades": {"run": lambda db, client: client.get("/autonomous/trade-history").raise_for_status(), "setup": None},
+        "history_portfolio": {"run": lambda db, client: client.get("/portfolio/history").raise_for_status(), "setup": None},
+        "history_transactions": {"run": lambda db, client: client.get("/portfolio/transactions?limit=500").raise_for_status(), "setup": None},
+        "history_notifications": {"run": lambda db, client: client.get("/autonomous/notifications").raise_for_status(), "setup": None},
+    }
+
+
+def _percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * q
+    lo, hi = int(k), min(int(k) + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def run_case(case: Dict, iterations: int, warmup: int) -> Dict:
+    from models import SessionLocal
+    from fastapi.testclient import TestClient
+    import main
+    client = TestClient(main.app) # No context manager: startup (scheduler) is not run
+
+    def once(measure_memory: bool = False):
+        if case["setup"]:
+            case["setup"]()
+        db = SessionLocal()
+        try:
+            gc.collect()
+            if measure_memory:
+                tracemalloc.start()
+            start = time.perf_counter()
+            case["run"](db, client)
+            elapsed = (time.perf_counter() - start) * 1000
+            peak = tracemalloc.get_traced_memory()[1] / 1024 if measure_memory else None
+            return elapsed, peak
+        finally:
+            if measure_memory:
+                tracemalloc.stop()
+            db.close()
+
+    for _ in range(warmup):
+        once()
+    latencies = [once()[0] for _ in range(iterations)]
+    peak_kb = once(measure_memory=True)[1] # Separate pass: tracing slows the timed runs down
+    return {
+        "iterations": iterations,
+        "p50_ms": round(_percentile(latencies, 0.50), 3),
+        "p90_ms": round(_percentile(latencies, 0.90), 3),
+        "p99_ms": round(_percentile(latencies, 0.99), 3),
+        "mean_ms": round(sum(latencies) / len(latencies), 3),
+        "max_ms": round(max(latencies), 3),
+        "peak_alloc_kb": round(peak_kb, 1)
+    }
+
+
+# --- Baseline gate ---
+
+def compare(results: Dict, baseline: Dict, latency_tolerance: float = LATENCY_TOLERANCE,
+            memory_tolerance: float = MEMORY_TOLERANCE) -> List[str]:
+    """Regressions of `results` against `baseline` (same sizes), one line each."""
+    failures = []
+    for name, current in results["cases"].items():
+        base = baseline["cases"].get(name)
+        if not base:
+            continue # New case: recorded on the next --update-baseline
+        for metric in ("p50_ms", "p90_ms"):
+            limit = base[metric] * (1 + latency_tolerance) + LATENCY_SLACK_MS
+            if current[metric] > limit:
+                failures.append(f"{name}: {metric} {current[metric]:.1f} > {limit:.1f} (baseline {base[metric]:.1f})")
+        limit = base["peak_alloc_kb"] * (1 + memory_tolerance) + MEMORY_SLACK_KB
+        if current["peak_alloc_kb"] > limit:
+            failures.append(f"{name}: peak_alloc_kb {current['peak_alloc_kb']:.0f} > {limit:.0f} (baseline {base['peak_alloc_kb']:.0f})")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline hot-path benchmarks with a baseline regression gate.")
+    parser.add_argument("--database-url", help="Empty SQLite/Postgres database to seed (default: temp SQLite file)")
+    parser.add_argument("--allow-existing", action="store_true", help="Reuse an already seeded database")
+    for key, value in DEFAULT_SIZES.items():
+        parser.add_argument(f"--{key.replace('_', '-')}", type=int, default=value)
+    parser.add_argument("--iterations", type=int, default=15)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--cases", help="Comma separated case names (default: all)")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=LATENCY_TOLERANCE, help="Allowed latency growth (0.25 = 25%%)")
+    parser.add_argument("--output", help="Also write the results JSON here")
+    args = parser.parse_args()
+
+    _offline_environment(args.database_url)
+    sizes = {key: getattr(args, key) for key in DEFAULT_SIZES}
+    print(f"[BENCH] Seeding {os.environ['DATABASE_URL'].split('://')[0]} database: {sizes}")
+    seed_database(sizes, args.allow_existing)
+
+    cases = build_cases()
+    selected = [c.strip() for c in args.cases.split(",")] if args.cases else list(cases)
+    unknown = [c for c in selected if c not in cases]
+    if unknown:
+        raise SystemExit(f"Unknown cases {unknown}; available: {list(cases)}")
+
+    results = {
+        "meta": {
+            "sizes": sizes,
+            "database": os.environ["DATABASE_URL"].split("://")[0],
+            "market_latency_ms": int(os.getenv("MARKET_OFFLINE_LATENCY_MS", "0")),
+            "llm_latency_ms": int(os.getenv("LLM_OFFLINE_LATENCY_MS", "0")),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "recorded_at": datetime.utcnow().isoformat(timespec="seconds") + "Z"
+        },
+        "cases": {}
+    }
+    for name in selected:
+        results["cases"][name] = run_case(cases[name], args.iterations, args.warmup)
+        r = results["cases"][name]
+        print(f"[BENCH] {name:<22} p50 {r['p50_ms']:>9.2f} ms  p90 {r['p90_ms']:>9.2f} ms  "
+              f"p99 {r['p99_ms']:>9.2f} ms  peak {r['peak_alloc_kb']:>9.0f} KB")
+    results["meta"]["max_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"[BENCH] Max RSS {results['meta']['max_rss_kb'] / 1024:.0f} MB")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.update_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+        print(f"[BENCH] Baseline written to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"[BENCH] No baseline at {args.baseline}; run with --update-baseline to record one.")
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    mismatched = [k for k in ("sizes", "database", "market_latency_ms", "llm_latency_ms")
+                  if baseline["meta"].get(k) != results["meta"][k]]
+    if mismatched:
+        print(f"[BENCH] Baseline was recorded with different {mismatched}; not comparable.")
+        return 2
+
+    failures = compare(results, baseline, args.tolerance)
+    for failure in failures:
+        print(f"[BENCH] REGRESSION {failure}")
+    print(f"[BENCH] {'FAILED' if failures else 'OK'}: {len(results['cases'])} cases against {args.baseline}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,20 +1,16 @@
 from sqlalchemy.orm import Session
 from datetime import datetime
-from models import UserSettings
+from models import DEFAULT_ACCOUNT
+from accounts import accounts
 
 class BudgetEngine:
-    def __init__(self, db: Session):
+    def __init__(self, db: Session, account: str = DEFAULT_ACCOUNT):
         self.db = db
+        self.account = account
         self.settings = self._get_or_create_settings()
 
     def _get_or_create_settings(self):
-        settings = self.db.query(UserSettings).first()
-        if not settings:
-            settings = UserSettings()
-            self.db.add(settings)
-            self.db.commit()
-            self.db.refresh(settings)
-        return settings
+        return accounts.settings(self.db, self.account)
 
     def get_daily_budget(self) -> float:
         """
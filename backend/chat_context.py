@@ -0,0 +1,221 @@
+import time
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Optional
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from models import AIPortfolioItem, AITradeHistory, DEFAULT_ACCOUNT
+from accounts import accounts
+from market_data import market_data
+from cycle_profiler import cycle_profiler
+
+# Seconds a section snapshot is reused across chat turns
+CHAT_SECTION_TTLS = {
+    "ai_portfolio": 30,
+    "ai_trade_history": 60,
+    "market_status": 60,
+    "news_context": 300, # Keyed by query, so only repeated questions hit
+}
+
+# Estimated prompt tokens (~4 chars/token) per section; holdings/trades are trimmed to fit
+CHAT_SECTION_TOKENS = {
+    "ai_portfolio": 900,
+    "ai_trade_history": 350,
+    "news_context": 400,
+}
+CHAT_CONTEXT_DEADLINE = 3.0 # Seconds all network-bound sections together may take before the LLM call
+CHAT_CONTEXT_CONCURRENCY = 4
+CHAT_TRADE_HISTORY_LIMIT = 10
+CHAT_REASON_CHARS = 80
+CHAT_NEWS_BODY_CHARS = 160
+SEARCH_KEYWORDS = ["news", "search", "latest", "forecast", "outlook", "why", "happened", "market", "trend"]
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+
+def _clip(text: Optional[str], limit: int) -> str:
+    text = " ".join((text or "").split()).replace("|", "/")
+    return text if len(text) <= limit else text[:limit - 1] + "…"
+
+
+class ChatContextBuilder:
+    """
+    Builds the /chat prompt context. Only the sections the chat prompt actually reads
+    (AI portfolio, AI trades, news, market status) are built, each as a compact text table
+    cached for a few seconds, and trimmed to a token budget. Network-bound sections load
+    concurrently under one deadline.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._sections: Dict[str, tuple] = {} # {key: (expires_at, value)}; expired values still serve as fallback
+        self._inflight: Dict[str, Future] = {}
+        # Shared pool: a section that misses the deadline keeps loading and warms the cache for the next turn
+        self.pool = ThreadPoolExecutor(max_workers=CHAT_CONTEXT_CONCURRENCY, thread_name_prefix="chat-context")
+
+    def _fresh(self, key: str) -> Optional[str]:
+        with self.lock:
+            entry = self._sections.get(key)
+        if entry and entry[0] > time.monotonic():
+            cycle_profiler.count("chat_context_hits")
+            return entry[1]
+        cycle_profiler.count("chat_context_misses")
+        return None
+
+    def _store(self, key: str, ttl: int, value: str) -> str:
+        with self.lock:
+            self._sections[key] = (time.monotonic() + ttl, value)
+        return value
+
+    def _cached(self, key: str, ttl: int, loader: Callable[[], str]) -> str:
+        value = self._fresh(key)
+        return value if value is not None else self._store(key, ttl, loader())
+
+    def _submit(self, key: str, ttl: int, loader: Callable[[], str]) -> Future:
+        """Loads a section in the pool (or returns the fresh/in-flight one). Concurrent turns share one load."""
+        value = self._fresh(key)
+        if value is not None:
+            done = Future()
+            done.set_result(value)
+            return done
+        with self.lock:
+            future = self._inflight.get(key)
+            if future is None:
+                future = self.pool.submit(self._load, key, ttl, loader)
+                self._inflight[key] = future
+        return future
+
+    def _load(self, key: str, ttl: int, loader: Callable[[], str]) -> str:
+        try:
+            return self._store(key, ttl, loader())
+        finally:
+            with self.lock:
+                self._inflight.pop(key, None)
+
+    def _stale(self, key: str) -> Optional[str]:
+        with self.lock:
+            entry = self._sections.get(key)
+        return entry[1] if entry else None
+
+    def invalidate(self, section: Optional[str] = None):
+        """Drops cached snapshots (all, or those of one section) e.g. after a trade."""
+        with self.lock:
+            if section is None:
+                self._sections.clear()
+            else:
+                self._sections = {k: v for k, v in self._sections.items() if k.split(":", 1)[0] != section}
+
+    def should_search(self, message: str) -> bool:
+        return any(kw in message.lower() for kw in SEARCH_KEYWORDS)
+
+    def build(self, db: Session, message: str, deadline: float = CHAT_CONTEXT_DEADLINE, account: str = DEFAULT_ACCOUNT) -> Dict[str, str]:
+        """
+        Network-bound sections (market status, news search) load concurrently under one deadline
+        while the DB sections are built on the request's session. A section that misses the
+        deadline falls back to its last (stale) snapshot, or is left out.
+        """
+        start = time.monotonic()
+        pending = {"market_status": self._submit("market_status", CHAT_SECTION_TTLS["market_status"], self.market_status)}
+        if self.should_search(message):
+            query = f"{message} Pakistan Stock Exchange"
+            key = "news_context:" + " ".join(query.lower().split())
+            pending[key] = self._submit(key, CHAT_SECTION_TTLS["news_context"], lambda: self.news_context(query))
+
+        # Account sections are keyed per fund; invalidate("ai_portfolio") still drops every fund's
+        context = {
+            "ai_portfolio": self._cached(f"ai_portfolio:{account}", CHAT_SECTION_TTLS["ai_portfolio"], lambda: self.ai_portfolio(db, account)),
+            "ai_trade_history": self._cached(f"ai_trade_history:{account}", CHAT_SECTION_TTLS["ai_trade_history"], lambda: self.ai_trade_history(db, account)),
+        }
+
+        wait(list(pending.values()), timeout=max(0.0, deadline - (time.monotonic() - start)))
+        for key, future in pending.items():
+            section = key.split(":", 1)[0]
+            if future.done() and not future.exception():
+                context[section] = future.result()
+                continue
+            if future.done():
+                print(f"[CHAT CONTEXT] {section} failed: {future.exception()}")
+            else:
+                print(f"[CHAT CONTEXT] {section} missed the {deadline:.1f}s deadline")
+                cycle_profiler.count("chat_context_late")
+            stale = self._stale(key)
+            if stale is not None:
+                context[section] = stale
+        return context
+
+    # --- Sections ---
+
+    def ai_portfolio(self, db: Session, account: str = DEFAULT_ACCOUNT) -> str:
+        """Summary line + one row per holding, largest positions first. Prices come from caches only."""
+        settings = accounts.get(db, account)
+        cash = settings.ai_cash_balance if settings else 0.0
+        realized = db.query(func.sum(AITradeHistory.pnl)).filter(
+            AITradeHistory.account == account, AITradeHistory.pnl.isnot(None)
+        ).scalar() or 0.0
+
+        rows = []
+        for item in db.query(AIPortfolioItem).filter(AIPortfolioItem.account == account).all():
+            price = market_data.get_cached_price(item.symbol) or item.current_price or 0.0
+            value = price * item.quantity
+            pnl = value - item.total_cost
+            pnl_pct = pnl / item.total_cost * 100 if item.total_cost else 0.0
+            decision = " ".join(filter(None, [item.last_decision, item.last_confidence])) or "-"
+            rows.append((value, pnl, f"{item.symbol}|{item.quantity:g}|{item.avg_cost:.2f}|{price:.2f}|{value:,.0f}|{pnl_pct:+.1f}%|{decision}"))
+        rows.sort(key=lambda r: r[0], reverse=True)
+
+        holdings_value = sum(r[0] for r in rows)
+        unrealized = sum(r[1] for r in rows)
+        lines = [
+            f"Cash: {cash:,.0f} | Holdings: {holdings_value:,.0f} | Net worth: {cash + holdings_value:,.0f} | "
+            f"Unrealized PnL: {unrealized:,.0f} | Realized PnL: {realized:,.0f}",
+            "SYMBOL|QTY|AVG|PRICE|VALUE|PNL%|LAST_DECISION"
+        ]
+        return self._fit(lines, [r[2] for r in rows], CHAT_SECTION_TOKENS["ai_portfolio"],
+                         lambda rest: f"...+{len(rest)} smaller positions ({sum(r[0] for r in rows[-len(rest):]):,.0f})")
+
+    def ai_trade_history(self, db: Session, account: str = DEFAULT_ACCOUNT) -> str:
+        trades = db.query(AITradeHistory).filter(AITradeHistory.account == account).order_by(AITradeHistory.timestamp.desc()).limit(CHAT_TRADE_HISTORY_LIMIT).all()
+        if not trades:
+            return "No trades yet."
+        rows = [
+            f"{t.timestamp.strftime('%Y-%m-%d')}|{t.action}|{t.symbol}|{t.quantity:g}|{t.price:.2f}|{_clip(t.reason, CHAT_REASON_CHARS)}"
+            for t in trades
+        ]
+        return self._fit(["DATE|ACTION|SYMBOL|QTY|PRICE|REASON"], rows, CHAT_SECTION_TOKENS["ai_trade_history"],
+                         lambda rest: f"...+{len(rest)} older trades")
+
+    def market_status(self) -> str:
+        status = market_data.get_market_status()
+        return f"{status.get('status', 'UNKNOWN')} | {status.get('index', 'KSE-100')}: {status.get('value', 0)}"
+
+    def news_context(self, query: str) -> str:
+        try:
+            from news_agent import news_agent
+            results = news_agent.search_web(query, limit=3)
+        except Exception as e:
+            print(f"Search context error: {e}")
+            return "Unavailable."
+        rows = [f"- {_clip(r.get('title'), 120)}: {_clip(r.get('body'), CHAT_NEWS_BODY_CHARS)}" for r in results or []]
+        return self._fit([], rows, CHAT_SECTION_TOKENS["news_context"], lambda rest: "") or "No results."
+
+    def _fit(self, header: List[str], rows: List[str], max_tokens: int, overflow: Callable[[List[str]], str]) -> str:
+        """Header plus as many rows as fit the token budget; the rest is summarized in one line."""
+        used = estimate_tokens("\n".join(header))
+        kept = []
+        for i, row in enumerate(rows):
+            tokens = estimate_tokens(row)
+            if used + tokens > max_tokens:
+                tail = overflow(rows[i:])
+                if tail:
+                    kept.append(tail)
+                cycle_profiler.count("chat_context_trimmed_rows", len(rows) - i)
+                break
+            kept.append(row)
+            used += tokens
+        return "\n".join(header + kept)
+
+
+chat_context = ChatContextBuilder()
@@ -0,0 +1,165 @@
+import json
+import math
+import time
+import pytz
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from sqlalchemy.orm import Session
+
+from models import SessionLocal, CycleMetric, DEFAULT_ACCOUNT
+
+_current_profile: ContextVar[Optional["CycleProfile"]] = ContextVar("current_cycle_profile", default=None)
+
+
+class CycleProfile:
+    """Per-cycle timings (ms per stage) and counters (upstream calls, cache hits, LLM tokens)."""
+
+    def __init__(self, name: str, account: str = DEFAULT_ACCOUNT):
+        self.name = name
+        self.account = account
+        self.started_at = datetime.now(pytz.utc)
+        self.status = "COMPLETED"
+        self.total_ms = 0.0
+        self.stages: Dict[str, float] = {}
+        self.counters: Dict[str, int] = {}
+
+    def add_stage(self, name: str, ms: float):
+        # Stages entered more than once (e.g. per-candidate news) accumulate
+        self.stages[name] = self.stages.get(name, 0.0) + ms
+
+    def count(self, key: str, n: int = 1):
+        self.counters[key] = self.counters.get(key, 0) + n
+
+
+class CycleProfiler:
+    """
+    Instruments trading cycles. Deep modules (market_data, news_agent, llm_agent) call
+    `count()` / `record_llm_usage()`; these are no-ops unless a cycle is being profiled.
+    """
+
+    @contextmanager
+    def profile(self, name: str = "trading_cycle", account: str = DEFAULT_ACCOUNT):
+        profile = CycleProfile(name, account)
+        token = _current_profile.set(profile)
+        start = time.perf_counter()
+        try:
+            yield profile
+        except Exception:
+            profile.status = "ERROR"
+            raise
+        finally:
+            profile.total_ms = (time.perf_counter() - start) * 1000
+            _current_profile.reset(token)
+            self._save(profile)
+
+    @contextmanager
+    def stage(self, name: str):
+        profile = _current_profile.get()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if profile:
+                profile.add_stage(name, (time.perf_counter() - start) * 1000)
+
+    def count(self, key: str, n: int = 1):
+        profile = _current_profile.get()
+        if profile:
+            profile.count(key, n)
+
+    def record_llm_usage(self, response):
+        """Records token usage from an OpenAI chat completion response."""
+        profile = _current_profile.get()
+        if not profile:
+            return
+        usage = getattr(response, "usage", None)
+        profile.count("llm_calls")
+        if usage:
+            profile.count("llm_prompt_tokens", getattr(usage, "prompt_tokens", 0) or 0)
+            profile.count("llm_completion_tokens", getattr(usage, "completion_tokens", 0) or 0)
+
+    def _save(self, profile: CycleProfile):
+        # Own session: the cycle's session may have been rolled back on error
+        db = SessionLocal()
+        try:
+            counters = profile.counters
+            db.add(CycleMetric(
+                account=profile.account,
+                name=profile.name,
+                started_at=profile.started_at,
+                status=profile.status,
+                total_ms=round(profile.total_ms, 1),
+                upstream_calls=counters.get("upstream_calls", 0),
+                cache_hits=counters.get("cache_hits", 0),
+                cache_misses=counters.get("cache_misses", 0),
+                llm_tokens=counters.get("llm_prompt_tokens", 0) + counters.get("llm_completion_tokens", 0),
+                stages_json=json.dumps({k: round(v, 1) for k, v in profile.stages.items()}, separators=(",", ":")),
+                counters_json=json.dumps(counters, separators=(",", ":"))
+            ))
+            db.commit()
+            print(f"[PROFILE] {profile.name} ({profile.account}) {profile.status} in {profile.total_ms:.0f}ms "
+                  f"stages={ {k: round(v) for k, v in profile.stages.items()} } counters={counters}")
+        except Exception as e:
+            print(f"[PROFILE] Failed to store cycle metrics: {e}")
+            db.rollback()
+        finally:
+            db.close()
+
+    def summarize(self, db: Session, window_hours: int = 24, name: str = "trading_cycle",
+                  account: str = DEFAULT_ACCOUNT) -> Dict:
+        """Percentile summary (p50/p90/p99) of one account's total and per-stage timings over a window."""
+        since = datetime.now(pytz.utc) - timedelta(hours=window_hours)
+        rows = db.query(CycleMetric).filter(
+            CycleMetric.account == account,
+            CycleMetric.name == name,
+            CycleMetric.started_at >= since
+        ).order_by(CycleMetric.started_at.asc()).all()
+
+        stage_samples: Dict[str, List[float]] = {}
+        counters: Dict[str, int] = {}
+        statuses: Dict[str, int] = {}
+        for row in rows:
+            statuses[row.status] = statuses.get(row.status, 0) + 1
+            for stage, ms in json.loads(row.stages_json or "{}").items():
+                stage_samples.setdefault(stage, []).append(ms)
+            for key, value in json.loads(row.counters_json or "{}").items():
+                counters[key] = counters.get(key, 0) + value
+
+        hits = counters.get("cache_hits", 0)
+        lookups = hits + counters.get("cache_misses", 0)
+
+        return {
+            "account": account,
+            "window_hours": window_hours,
+            "cycles": len(rows),
+            "statuses": statuses,
+            "total_ms": _percentiles([r.total_ms for r in rows]),
+            "stages_ms": {stage: _percentiles(samples) for stage, samples in stage_samples.items()},
+            "counters": counters,
+            "cache_hit_rate": round(hits / lookups, 3) if lookups else None,
+            "avg_llm_tokens": round(sum(r.llm_tokens or 0 for r in rows) / len(rows), 1) if rows else 0,
+            "last_cycle": {
+                "started_at": rows[-1].started_at.isoformat(),
+                "status": rows[-1].status,
+                "total_ms": rows[-1].total_ms,
+                "stages_ms": json.loads(rows[-1].stages_json or "{}")
+            } if rows else None
+        }
+
+
+def _percentiles(samples: List[float]) -> Dict:
+    if not samples:
+        return {"p50": None, "p90": None, "p99": None, "max": None}
+    ordered = sorted(samples)
+
+    def rank(p):
+        # Nearest-rank percentile
+        index = max(0, min(len(ordered) - 1, math.ceil(p / 100 * len(ordered)) - 1))
+        return round(ordered[index], 1)
+
+    return {"p50": rank(50), "p90": rank(90), "p99": rank(99), "max": round(ordered[-1], 1)}
+
+
+cycle_profiler = CycleProfiler()
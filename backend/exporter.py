@@ -0,0 +1,144 @@
+import os
+import argparse
+import tempfile
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional
+
+import pyarrow as pa
+import pyarrow.ipc as ipc
+import pyarrow.parquet as pq
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from models import SessionLocal, AITradeHistory, Transaction, PortfolioHistory, Kline
+
+EXPORT_BATCH_ROWS = 10000 # Rows fetched per round trip; also one Parquet row group / Arrow record batch
+EXPORT_FORMATS = ("parquet", "arrow")
+
+_TS = pa.timestamp("us")
+
+# table -> (model, date column, symbol column or None, account column or None, arrow schema)
+EXPORT_TABLES = {
+    "ai_trade_history": (AITradeHistory, "timestamp", "symbol", "account", pa.schema([
+        ("id", pa.int64()), ("account", pa.string()), ("symbol", pa.string()), ("action", pa.string()), ("quantity", pa.int64()),
+        ("price", pa.float64()), ("pnl", pa.float64()), ("timestamp", _TS), ("reason", pa.string()),
+    ])),
+    "transactions": (Transaction, "timestamp", "symbol", None, pa.schema([
+        ("id", pa.int64()), ("symbol", pa.string()), ("action", pa.string()), ("quantity", pa.int64()),
+        ("price", pa.float64()), ("timestamp", _TS), ("notes", pa.string()),
+    ])),
+    "portfolio_history": (PortfolioHistory, "date", None, None, pa.schema([
+        ("id", pa.int64()), ("date", _TS), ("total_value", pa.float64()),
+        ("cash_balance", pa.float64()), ("holdings_value", pa.float64()),
+    ])),
+    "klines": (Kline, "ts", "symbol", None, pa.schema([
+        ("symbol", pa.string()), ("timeframe", pa.string()), ("ts", _TS), ("open", pa.float64()),
+        ("high", pa.float64()), ("low", pa.float64()), ("close", pa.float64()), ("volume", pa.float64()),
+    ])),
+}
+
+
+def _strip_tz(value):
+    # SQLite hands back naive datetimes, Postgres aware ones; the export is naive UTC either way
+    return value.replace(tzinfo=None) if isinstance(value, datetime) and value.tzinfo else value
+
+
+class HistoryExporter:
+    """
+    Streams history tables to Parquet or Arrow IPC files. Date range and symbol filters are
+    (and, for AI history, the account) pushed down into the SQL query, and rows are fetched and written in fixed-size batches,
+    so memory stays flat however large the table is.
+    """
+
+    def _query(self, table: str, start: Optional[datetime], end: Optional[datetime], symbols: Optional[List[str]],
+               account: Optional[str] = None):
+        if table not in EXPORT_TABLES:
+            raise ValueError(f"Unknown table '{table}' (expected one of {', '.join(EXPORT_TABLES)})")
+        model, date_col, symbol_col, account_col, schema = EXPORT_TABLES[table]
+        date_column = getattr(model, date_col)
+
+        query = select(*[getattr(model, name) for name in schema.names])
+        if start:
+            query = query.where(date_column >= start)
+        if end:
+            query = query.where(date_column < end)
+        if symbols:
+            if not symbol_col:
+                raise ValueError(f"{table} has no symbol column to filter on")
+            query = query.where(getattr(model, symbol_col).in_([s.upper() for s in symbols]))
+        if account:
+            if not account_col:
+                raise ValueError(f"{table} has no account column to filter on")
+            query = query.where(getattr(model, account_col) == account)
+        return query.order_by(date_column), schema
+
+    def batches(self, db: Session, table: str, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                symbols: Optional[List[str]] = None, account: Optional[str] = None,
+                batch_rows: int = EXPORT_BATCH_ROWS) -> Iterator[pa.RecordBatch]:
+        query, schema = self._query(table, start, end, symbols, account)
+        result = db.execute(query.execution_options(yield_per=batch_rows))
+        for rows in result.partitions():
+            columns = list(zip(*rows))
+            yield pa.RecordBatch.from_arrays(
+                [pa.array([_strip_tz(v) for v in col], type=field.type) for col, field in zip(columns, schema)],
+                schema=schema
+            )
+
+    def export(self, db: Session, table: str, path: str, fmt: str = "parquet", start: Optional[datetime] = None,
+               end: Optional[datetime] = None, symbols: Optional[List[str]] = None, account: Optional[str] = None) -> Dict:
+        """Writes the (filtered) table to `path`; no `account` means every AI fund. Returns row/batch counts."""
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown format '{fmt}' (expected one of {', '.join(EXPORT_FORMATS)})")
+        if table not in EXPORT_TABLES:
+            raise ValueError(f"Unknown table '{table}' (expected one of {', '.join(EXPORT_TABLES)})")
+        schema = EXPORT_TABLES[table][4]
+        rows = batches = 0
+
+        writer = pq.ParquetWriter(path, schema, compression="zstd") if fmt == "parquet" else ipc.new_file(path, schema)
+        try:
+            for batch in self.batches(db, table, start, end, symbols, account):
+                if fmt == "parquet":
+                    writer.write_table(pa.Table.from_batches([batch])) # One row group per batch
+                else:
+                    writer.write_batch(batch)
+                rows += batch.num_rows
+                batches += 1
+        finally:
+            writer.close()
+
+        print(f"[EXPORT] {table} -> {path} ({rows} rows, {batches} batches)")
+        return {"table": table, "format": fmt, "rows": rows, "batches": batches, "path": path}
+
+    def export_temp(self, db: Session, table: str, fmt: str = "parquet", **filters) -> Dict:
+        """Exports into a temp file the caller is responsible for removing."""
+        fd, path = tempfile.mkstemp(prefix=f"{table}-", suffix=".parquet" if fmt == "parquet" else ".arrow")
+        os.close(fd)
+        try:
+            return self.export(db, table, path, fmt, **filters)
+        except Exception:
+            os.remove(path)
+            raise
+
+
+exporter = HistoryExporter()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export history tables to Parquet / Arrow IPC")
+    parser.add_argument("table", choices=list(EXPORT_TABLES))
+    parser.add_argument("output")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="parquet")
+    parser.add_argument("--start", type=datetime.fromisoformat, help="Inclusive, e.g. 2025-01-01")
+    parser.add_argument("--end", type=datetime.fromisoformat, help="Exclusive")
+    parser.add_argument("--symbols", help="Comma separated, e.g. OGDC,HUBC")
+    parser.add_argument("--account", help="AI fund for ai_trade_history (default: all)")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        exporter.export(
+            db, args.table, args.output, args.format, start=args.start, end=args.end,
+            symbols=args.symbols.split(",") if args.symbols else None, account=args.account
+        )
+    finally:
+        db.close()
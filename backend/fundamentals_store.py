@@ -0,0 +1,249 @@
+import os
+import json
+import time
+import threading
+import pytz
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from sqlalchemy.orm import Session
+
+from models import SessionLocal, StockFundamentals, StockUniverse, AIPortfolioItem, insert_ignore
+from market_data import market_data
+
+FUNDAMENTALS_CACHE_TTL = 300        # Seconds before the in-memory copy is reloaded (picks up other workers' writes)
+FUNDAMENTALS_MAX_AGE_HOURS = int(os.getenv("FUNDAMENTALS_MAX_AGE_HOURS", "24"))
+FUNDAMENTALS_REFRESH_BATCH = 10     # /companies calls per batch (each commits on its own)
+FUNDAMENTALS_BATCH_PAUSE = 2.0      # Seconds between batches, on top of market_data's per-request spacing
+FUNDAMENTALS_REFRESH_LIMIT = 200    # Symbols refreshed per run, stalest first
+
+TYPED_FIELDS = ("name", "sector", "pe", "eps", "fair_value", "growth", "dividend_yield", "market_cap")
+TEXT_FIELDS = ("name", "sector")
+
+# /companies/{symbol} key spellings -> typed field (looked up at the top level and one level down)
+API_FIELD_ALIASES = {
+    "name": ("name", "companyName", "company_name"),
+    "sector": ("sector", "sectorName", "sector_name", "industry"),
+    "pe": ("pe", "peRatio", "pe_ratio", "priceToEarnings", "PE"),
+    "eps": ("eps", "EPS", "earningsPerShare"),
+    "dividend_yield": ("dividendYield", "dividend_yield", "yield", "divYield"),
+    "market_cap": ("marketCap", "market_cap", "mktCap"),
+}
+
+# Hand-entered fundamentals_json keys -> typed field ("yield" is what seed_universe uses)
+LEGACY_KEYS = {"pe": "pe", "fair_value": "fair_value", "growth": "growth", "yield": "dividend_yield",
+               "dividend_yield": "dividend_yield", "sector": "sector", "eps": "eps", "name": "name"}
+
+# Screening filters -> (field, operator)
+SCREEN_FILTERS = {
+    "pe_min": ("pe", ">="), "pe_max": ("pe", "<"),
+    "yield_min": ("dividend_yield", ">="), "yield_max": ("dividend_yield", "<"),
+    "growth_min": ("growth", ">="), "eps_min": ("eps", ">="),
+    "market_cap_min": ("market_cap", ">="),
+}
+
+
+def _number(value) -> Optional[float]:
+    if value is None or isinstance(value, bool):
+        return None
+    try:
+        return float(str(value).replace(",", "").replace("%", "").strip())
+    except ValueError:
+        return None
+
+
+def _clean(field: str, value):
+    if field in TEXT_FIELDS:
+        return str(value).strip() or None if value is not None else None
+    return _number(value)
+
+
+def parse_company_info(data: Dict) -> Dict:
+    """Typed fields found in a /companies/{symbol} payload. Missing/unparseable ones are left out."""
+    nested = [v for v in data.values() if isinstance(v, dict)]
+    values = {}
+    for field, aliases in API_FIELD_ALIASES.items():
+        for source in [data] + nested:
+            raw = next((source[k] for k in aliases if source.get(k) not in (None, "")), None)
+            if raw is not None:
+                value = _clean(field, raw)
+                if value is not None:
+                    values[field] = value
+                break
+    return values
+
+
+def parse_legacy(fundamentals_json: Optional[str]) -> Dict:
+    try:
+        raw = json.loads(fundamentals_json or "{}")
+    except ValueError:
+        return {}
+    values = {}
+    for key, field in LEGACY_KEYS.items():
+        if key in raw:
+            value = _clean(field, raw[key])
+            if value is not None:
+                values[field] = value
+    return values
+
+
+def as_legacy(row: Dict) -> Dict:
+    """Typed row in the {"pe", "fair_value", "growth", "yield", ...} shape scoring code reads."""
+    out = {k: v for k, v in row.items() if k in TYPED_FIELDS and k != "dividend_yield" and v is not None}
+    if row.get("dividend_yield") is not None:
+        out["yield"] = row["dividend_yield"]
+    return out
+
+
+class FundamentalsStore:
+    """
+    Typed fundamentals (stock_fundamentals), one row per symbol. Manual values come from the
+    universe's fundamentals_json, API values from a scheduled /companies/{symbol} refresh; the
+    refresh only overwrites fields the API actually returned, so manual fair value and growth
+    survive. Reads go through an in-memory copy of the whole (small) table.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._cache: Dict[str, Dict] = {}
+        self._loaded_at = 0.0
+
+    # --- Cache ---
+
+    def _rows(self) -> Dict[str, Dict]:
+        with self.lock:
+            if self._cache and time.monotonic() - self._loaded_at < FUNDAMENTALS_CACHE_TTL:
+                return self._cache
+        db = SessionLocal()
+        try:
+            rows = {
+                r.symbol: {f: getattr(r, f) for f in TYPED_FIELDS}
+                for r in db.query(StockFundamentals).all()
+            }
+        finally:
+            db.close()
+        with self.lock:
+            self._cache = rows
+            self._loaded_at = time.monotonic()
+        return rows
+
+    def invalidate(self):
+        with self.lock:
+            self._cache = {}
+            self._loaded_at = 0.0
+
+    def get(self, symbol: str) -> Optional[Dict]:
+        """Typed fields for a symbol (legacy key names, Nones dropped), or None if unknown."""
+        row = self._rows().get(symbol)
+        return as_legacy(row) if row else None
+
+    # --- Writes ---
+
+    def upsert(self, db: Session, symbol: str, values: Dict, source: str = "MANUAL", refreshed: bool = False) -> StockFundamentals:
+        """Sets the given typed fields (others untouched). Caller commits."""
+        row = db.query(StockFundamentals).filter(StockFundamentals.symbol == symbol).first()
+        if not row:
+            row = StockFundamentals(symbol=symbol)
+            db.add(row)
+        for field, value in values.items():
+            if field in TYPED_FIELDS:
+                setattr(row, field, value)
+        now = datetime.now(pytz.utc)
+        row.source = source
+        row.updated_at = now
+        if refreshed:
+            row.refreshed_at = now
+        self.invalidate()
+        return row
+
+    def set_manual(self, db: Session, symbol: str, fundamentals: Dict) -> StockFundamentals:
+        """Typed copy of hand-entered fundamentals (universe update / seeding). Caller commits."""
+        return self.upsert(db, symbol, parse_legacy(json.dumps(fundamentals)), source="MANUAL")
+
+    def backfill(self, db: Session) -> int:
+        """Typed rows for universe stocks that only have fundamentals_json (first start after upgrade)."""
+        typed = {s for (s,) in db.query(StockFundamentals.symbol).all()}
+        rows = []
+        for stock in db.query(StockUniverse).all():
+            values = parse_legacy(stock.fundamentals_json) if stock.symbol not in typed else None
+            if values:
+                rows.append({"symbol": stock.symbol, "source": "MANUAL", "updated_at": datetime.now(pytz.utc),
+                             **{f: values.get(f) for f in TYPED_FIELDS}})
+        if not rows:
+            return 0
+        db.execute(insert_ignore(db, StockFundamentals), rows) # Another worker may be backfilling too
+        db.commit()
+        self.invalidate()
+        print(f"[FUNDAMENTALS] Backfilled {len(rows)} symbols from fundamentals_json")
+        return len(rows)
+
+    # --- Refresh ---
+
+    def stale_symbols(self, db: Session, limit: int = FUNDAMENTALS_REFRESH_LIMIT) -> List[str]:
+        """Active universe + AI holdings whose API data is missing or older than the max age, stalest first."""
+        symbols = {s for (s,) in db.query(StockUniverse.symbol).filter(StockUniverse.active == True).all()}
+        symbols |= {s for (s,) in db.query(AIPortfolioItem.symbol).all()}
+        refreshed = dict(db.query(StockFundamentals.symbol, StockFundamentals.refreshed_at).filter(
+            StockFundamentals.symbol.in_(symbols)
+        ).all()) if symbols else {}
+
+        cutoff = datetime.now(pytz.utc).replace(tzinfo=None) - timedelta(hours=FUNDAMENTALS_MAX_AGE_HOURS)
+        def age_key(symbol):
+            ts = refreshed.get(symbol)
+            return ts.replace(tzinfo=None) if ts else datetime.min
+        return sorted((s for s in symbols if age_key(s) < cutoff), key=age_key)[:limit]
+
+    def refresh(self, db: Session, symbols: Optional[List[str]] = None, batch_size: int = FUNDAMENTALS_REFRESH_BATCH) -> Dict:
+        """Pulls /companies/{symbol} for stale (or the given) symbols in paced batches."""
+        symbols = symbols if symbols is not None else self.stale_symbols(db)
+        stats = {"requested": len(symbols), "updated": 0, "empty": 0}
+        for start in range(0, len(symbols), batch_size):
+            if start:
+                time.sleep(FUNDAMENTALS_BATCH_PAUSE)
+            for symbol in symbols[start:start + batch_size]:
+                values = parse_company_info(market_data.get_company_info(symbol) or {})
+                if not values:
+                    stats["empty"] += 1
+                    continue
+                self.upsert(db, symbol, values, source="API", refreshed=True)
+                stats["updated"] += 1
+            db.commit()
+        print(f"[FUNDAMENTALS] Refreshed {stats['updated']}/{stats['requested']} symbols ({stats['empty']} without data)")
+        return stats
+
+    # --- Screening ---
+
+    def screen(self, db: Session, sector: Optional[str] = None, universe_only: bool = False,
+               limit: int = 100, **filters) -> List[Dict]:
+        """
+        Fundamentals screen in SQL, e.g. screen(db, pe_max=8, yield_min=10). Filters are the
+        SCREEN_FILTERS keys; rows missing a filtered field never match. Cheapest PE first.
+        """
+        query = db.query(StockFundamentals)
+        for key, value in filters.items():
+            if value is None:
+                continue
+            if key not in SCREEN_FILTERS:
+                raise ValueError(f"Unknown filter '{key}'")
+            field, op = SCREEN_FILTERS[key]
+            column = getattr(StockFundamentals, field)
+            query = query.filter(column >= value if op == ">=" else column < value)
+        if sector:
+            query = query.filter(StockFundamentals.sector == sector)
+        if universe_only:
+            query = query.join(StockUniverse, StockUniverse.symbol == StockFundamentals.symbol).filter(StockUniverse.active == True)
+
+        rows = query.order_by(StockFundamentals.pe.is_(None), StockFundamentals.pe.asc()).limit(limit).all()
+        return [{"symbol": r.symbol, **{f: getattr(r, f) for f in TYPED_FIELDS}, "source": r.source,
+                 "refreshed_at": r.refreshed_at} for r in rows]
+
+
+fundamentals_store = FundamentalsStore()
+
+
+def run_fundamentals_refresh_job():
+    """Scheduled entry point (own session)."""
+    db = SessionLocal()
+    try:
+        fundamentals_store.refresh(db)
+    finally:
+        db.close()
@@ -0,0 +1,59 @@
+import pytz
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from models import SessionLocal, Kline, upsert
+
+
+def parse_kline_time(value) -> Optional[datetime]:
+    """Candle timestamps arrive as epoch (s or ms) or ISO strings; stored as naive UTC."""
+    if value is None:
+        return None
+    try:
+        if isinstance(value, (int, float)):
+            seconds = value / 1000 if value > 1e11 else value
+            return datetime.fromtimestamp(seconds, pytz.utc).replace(tzinfo=None)
+        parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+        return parsed.astimezone(pytz.utc).replace(tzinfo=None) if parsed.tzinfo else parsed
+    except (ValueError, OverflowError, OSError):
+        return None
+
+
+class KlineStore:
+    """Keeps every candle fetched from the API, so history is available offline (exports, risk)."""
+
+    def save(self, symbol: str, timeframe: str, klines: List[Dict]) -> int:
+        rows = []
+        for k in klines:
+            ts = parse_kline_time(k.get("timestamp"))
+            if ts is None:
+                continue
+            rows.append({
+                "symbol": symbol,
+                "timeframe": timeframe,
+                "ts": ts,
+                "open": k.get("open"),
+                "high": k.get("high"),
+                "low": k.get("low"),
+                "close": k.get("close"),
+                "volume": k.get("volume"),
+            })
+        if not rows:
+            return 0
+
+        db = SessionLocal()
+        try:
+            # Unique on (symbol, timeframe, ts). Stored candles take the API's latest OHLCV: the current
+            # period's candle is partial until it closes (e.g. a chart fetched mid-session)
+            db.execute(upsert(db, Kline, ["symbol", "timeframe", "ts"], ["open", "high", "low", "close", "volume"]), rows)
+            db.commit()
+            return len(rows)
+        except Exception as e:
+            print(f"[KLINES] Failed to store {symbol} {timeframe}: {e}")
+            db.rollback()
+            return 0
+        finally:
+            db.close()
+
+
+kline_store = KlineStore()
@@ -0,0 +1,179 @@
+import json
+import pytz
+from datetime import datetime
+from typing import Dict, Optional
+from sqlalchemy.orm import Session
+
+from models import AITradeHistory, AIPortfolioItem, LedgerCheckpoint, DEFAULT_ACCOUNT
+from accounts import accounts
+
+# BUY/SELL move cash by quantity * price; MANUAL_BUY imports stock bought outside the AI budget (no cash)
+CASH_AMOUNT_ACTIONS = ("DEPOSIT", "WITHDRAW", "ADJUSTMENT") # `price` holds the amount, quantity is 0
+LEDGER_CHECKPOINT_MIN_EVENTS = 50 # New events needed before the periodic job writes another checkpoint
+REPLAY_BATCH = 1000
+TOLERANCE = 0.01
+
+
+class LedgerState:
+    """Cash, open positions ({symbol: [qty, total_cost]}) and realized PnL after a given ledger id."""
+
+    def __init__(self, cash: float, positions: Optional[Dict[str, list]] = None, realized_pnl: float = 0.0, ledger_id: int = 0):
+        self.cash = cash
+        self.positions = positions or {}
+        self.realized_pnl = realized_pnl
+        self.ledger_id = ledger_id
+        self.events_replayed = 0
+
+    def apply(self, event: AITradeHistory):
+        action = event.action
+        qty = event.quantity or 0
+        price = event.price or 0.0
+
+        if action in CASH_AMOUNT_ACTIONS:
+            self.cash += -price if action == "WITHDRAW" else price
+        elif action in ("BUY", "MANUAL_BUY"):
+            if action == "BUY":
+                self.cash -= qty * price
+            position = self.positions.setdefault(event.symbol, [0, 0.0])
+            position[0] += qty
+            position[1] += qty * price
+        elif action == "SELL":
+            self.cash += qty * price
+            position = self.positions.setdefault(event.symbol, [0, 0.0])
+            avg_cost = position[1] / position[0] if position[0] else 0.0
+            cost_sold = avg_cost * qty
+            self.realized_pnl += event.pnl if event.pnl is not None else qty * price - cost_sold
+            position[0] -= qty
+            position[1] -= cost_sold
+            if position[0] <= 0:
+                del self.positions[event.symbol]
+
+        self.ledger_id = event.id
+        self.events_replayed += 1
+
+    def as_dict(self) -> Dict:
+        return {
+            "ledger_id": self.ledger_id,
+            "cash": round(self.cash, 2),
+            "realized_pnl": round(self.realized_pnl, 2),
+            "positions": {s: {"quantity": q, "total_cost": round(c, 2)} for s, (q, c) in sorted(self.positions.items())}
+        }
+
+
+class CashLedger:
+    """
+    ai_trade_history is the source of truth for AI cash and positions; UserSettings.ai_cash_balance
+    and ai_portfolio_items are projections of it. Checkpoints snapshot the replayed state at a
+    ledger id so audits and repairs only replay the events after the latest one.
+    Each account (AI fund) has its own ledger: events and checkpoints are filtered by account.
+    """
+
+    def latest_checkpoint(self, db: Session, upto_id: Optional[int] = None, account: str = DEFAULT_ACCOUNT) -> Optional[LedgerCheckpoint]:
+        query = db.query(LedgerCheckpoint).filter(LedgerCheckpoint.account == account)
+        if upto_id is not None:
+            query = query.filter(LedgerCheckpoint.ledger_id <= upto_id)
+        return query.order_by(LedgerCheckpoint.ledger_id.desc()).first()
+
+    def replay(self, db: Session, full: bool = False, upto_id: Optional[int] = None, account: str = DEFAULT_ACCOUNT) -> LedgerState:
+        """State after `upto_id` (default: latest event). `full` ignores checkpoints, e.g. after editing history."""
+        checkpoint = None if full else self.latest_checkpoint(db, upto_id, account)
+        if checkpoint:
+            state = LedgerState(
+                checkpoint.cash,
+                {s: list(p) for s, p in json.loads(checkpoint.positions_json or "{}").items()},
+                checkpoint.realized_pnl,
+                checkpoint.ledger_id
+            )
+        else:
+            settings = accounts.get(db, account)
+            state = LedgerState((settings.initial_ai_capital or 0.0) if settings else 0.0)
+
+        query = db.query(AITradeHistory).filter(AITradeHistory.account == account, AITradeHistory.id > state.ledger_id)
+        if upto_id is not None:
+            query = query.filter(AITradeHistory.id <= upto_id)
+        for event in query.order_by(AITradeHistory.id.asc()).yield_per(REPLAY_BATCH):
+            state.apply(event)
+        return state
+
+    def checkpoint(self, db: Session, state: Optional[LedgerState] = None, account: str = DEFAULT_ACCOUNT) -> Optional[LedgerCheckpoint]:
+        """
+        Stores the (replayed) state as a checkpoint. Caller commits.
+        Nothing is written if the latest checkpoint is already at this ledger id with the same state;
+        if it is at this id but differs (a full replay after repairing history), it is corrected in place.
+        """
+        state = state or self.replay(db, account=account)
+        if state.ledger_id == 0:
+            return None
+        positions_json = json.dumps(state.positions, separators=(",", ":"))
+        latest = self.latest_checkpoint(db, account=account)
+        if latest and latest.ledger_id == state.ledger_id:
+            if (abs((latest.cash or 0.0) - state.cash) <= TOLERANCE
+                    and abs((latest.realized_pnl or 0.0) - state.realized_pnl) <= TOLERANCE
+                    and json.loads(latest.positions_json or "{}") == json.loads(positions_json)):
+                return None
+            latest.cash = state.cash
+            latest.realized_pnl = state.realized_pnl
+            latest.positions_json = positions_json
+            latest.created_at = datetime.now(pytz.utc)
+            return latest
+        row = LedgerCheckpoint(
+            account=account,
+            ledger_id=state.ledger_id,
+            cash=state.cash,
+            realized_pnl=state.realized_pnl,
+            positions_json=positions_json,
+            created_at=datetime.now(pytz.utc)
+        )
+        db.add(row)
+        return row
+
+    def maybe_checkpoint(self, db: Session, min_events: int = LEDGER_CHECKPOINT_MIN_EVENTS, account: str = DEFAULT_ACCOUNT) -> Optional[LedgerCheckpoint]:
+        """Periodic job: checkpoints once enough events accumulated since the last one. Caller commits."""
+        state = self.replay(db, account=account)
+        if state.events_replayed < min_events:
+            return None
+        print(f"[LEDGER] Checkpoint for {account} at ledger id {state.ledger_id} ({state.events_replayed} events since last)")
+        return self.checkpoint(db, state, account)
+
+    def record_adjustment(self, db: Session, amount: float, reason: str, account: str = DEFAULT_ACCOUNT):
+        """Ledger event for a manual cash correction, so the projection can be rebuilt from history. Caller commits."""
+        db.add(AITradeHistory(
+            account=account,
+            symbol="CASH",
+            action="ADJUSTMENT",
+            quantity=0,
+            price=amount, # Price holds the signed amount
+            pnl=None,
+            timestamp=datetime.now(pytz.utc),
+            reason=reason
+        ))
+
+    def audit(self, db: Session, full: bool = False, account: str = DEFAULT_ACCOUNT,
+              state: Optional[LedgerState] = None) -> Dict:
+        """Replayed state (or the given one, already replayed) vs. the stored projections (cash balance and holdings)."""
+        state = state or self.replay(db, full=full, account=account)
+        settings = accounts.get(db, account)
+        stored_cash = settings.ai_cash_balance if settings else 0.0
+
+        holdings = {i.symbol: i for i in db.query(AIPortfolioItem).filter(AIPortfolioItem.account == account).all()}
+        position_drift = {}
+        for symbol in set(holdings) | set(state.positions):
+            qty, cost = state.positions.get(symbol, [0, 0.0])
+            item = holdings.get(symbol)
+            if not item or item.quantity != qty or abs((item.total_cost or 0.0) - cost) > TOLERANCE:
+                position_drift[symbol] = {
+                    "ledger": {"quantity": qty, "total_cost": round(cost, 2)},
+                    "stored": {"quantity": item.quantity, "total_cost": round(item.total_cost or 0.0, 2)} if item else None
+                }
+
+        return {
+            "account": account,
+            **state.as_dict(),
+            "events_replayed": state.events_replayed,
+            "stored_cash": round(stored_cash, 2),
+            "cash_drift": round(stored_cash - state.cash, 2),
+            "position_drift": position_drift
+        }
+
+
+cash_ledger = CashLedger()
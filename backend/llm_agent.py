@@ -1,16 +1,16 @@
 import os
 import json
-from openai import OpenAI
-from typing import Dict, List
+from typing import Dict, Iterator, List, Tuple
+from llm_gateway import llm_gateway
+
+# Separates the streamed markdown answer from the trailing structured JSON
+STREAM_META_DELIMITER = "<<<META>>>"
 
 class LLMAgent:
     def __init__(self):
-        # Initialize OpenAI client. It will look for OPENAI_API_KEY in env vars.
-        api_key = os.getenv("OPENAI_API_KEY")
-        if api_key:
-            self.client = OpenAI(api_key=api_key)
-        else:
-            self.client = None
+        # OpenAI client lives in the shared gateway (caching); kept here for "is LLM enabled" checks.
+        self.client = llm_gateway.client
+        if not self.client:
             print("Warning: OPENAI_API_KEY not found. LLM features will be disabled.")
 
         self.system_prompt = """
@@ -43,6 +43,56 @@ class LLMAgent:
         }
         """
 
+        # Streaming variant: the answer comes first as plain markdown so it can be shown token by token,
+        # and the structured part follows the delimiter.
+        self.stream_system_prompt = self.system_prompt.split("4. Output")[0] + f"""4. Output your response in TWO parts:
+           - First, the answer itself as plain markdown (bold text for emphasis). Do NOT wrap it in JSON.
+           - Then a line containing only {STREAM_META_DELIMITER} followed by JSON with the following structure:
+        {{
+            "suggested_trades": [
+                {{"symbol": "ABC", "action": "BUY/SELL/HOLD", "qty": 10, "price_range": "100-102"}}
+            ],
+            "alerts": ["Analysis/Insight"]
+        }}
+        """
+
+    def _section(self, value) -> str:
+        # Context sections arrive pre-rendered as compact text tables; anything else is JSON-encoded
+        return value if isinstance(value, str) else json.dumps(value)
+
+    def _build_messages(self, system_prompt: str, user_message: str, context: Dict, history: List[Dict[str, str]]) -> List[Dict]:
+        # Construct the prompt
+        # We ignore 'data_source' context type now, always purely AI context.
+        
+        messages = [{"role": "system", "content": system_prompt}]
+        
+        # Inject history if available (context awareness)
+        if history:
+            # Limit to last 6 messages to save context window/tokens
+            recent_history = history[-6:] 
+            for msg in recent_history:
+                if msg.get('role') in ['user', 'assistant']:
+                    messages.append({"role": msg['role'], "content": msg['content']})
+
+        messages.append({"role": "user", "content": f"""
+            ACTIVE MODE: AI AUTONOMOUS PORTFOLIO ANALYSIS
+            
+            DATA AVAILABLE:
+            1. AI AUTONOMOUS PORTFOLIO (Your Holdings, PKR):
+            {self._section(context.get('ai_portfolio', {}))}
+            
+            Recent AI Trades:
+            {self._section(context.get('ai_trade_history', []))}
+            
+            2. RECENT WEB SEARCH & NEWS (Real-time Context):
+            {self._section(context.get('news_context', []))}
+            
+            Market Status: {self._section(context.get('market_status', {}))}
+            
+            User Question: {user_message}
+            """})
+        return messages
+
     def get_response(self, user_message: str, context: Dict, history: List[Dict[str, str]] = []) -> Dict:
         try:
             # Check if client is initialized
@@ -53,42 +103,14 @@ class LLMAgent:
                     "alerts": ["API Key Missing"]
                 }
 
-            # Construct the prompt
-            # We ignore 'data_source' context type now, always purely AI context.
-            
-            messages = [{"role": "system", "content": self.system_prompt}]
-            
-            # Inject history if available (context awareness)
-            if history:
-                # Limit to last 6 messages to save context window/tokens
-                recent_history = history[-6:] 
-                for msg in recent_history:
-                    if msg.get('role') in ['user', 'assistant']:
-                        messages.append({"role": msg['role'], "content": msg['content']})
-
-            messages.append({"role": "user", "content": f"""
-                ACTIVE MODE: AI AUTONOMOUS PORTFOLIO ANALYSIS
-                
-                DATA AVAILABLE:
-                1. AI AUTONOMOUS PORTFOLIO (Your Holdings):
-                   {json.dumps(context.get('ai_portfolio', {}))}
-                   Recent AI Trades: {json.dumps(context.get('ai_trade_history', []))}
-                
-                2. RECENT WEB SEARCH & NEWS (Real-time Context):
-                   {json.dumps(context.get('news_context', []))}
-                
-                Market Status: {json.dumps(context.get('market_status', {}))}
-                
-                User Question: {user_message}
-                """})
-
-            response = self.client.chat.completions.create(
+            messages = self._build_messages(self.system_prompt, user_message, context, history)
+
+            content = llm_gateway.chat(
+                messages,
+                call_type="chat",
                 model="gpt-4o", # Or gpt-3.5-turbo
-                messages=messages,
                 response_format={"type": "json_object"}
             )
-
-            content = response.choices[0].message.content
             return json.loads(content)
 
         except Exception as e:
@@ -99,4 +121,63 @@ class LLMAgent:
                 "alerts": ["System Error"]
             }
 
+    def get_response_stream(self, user_message: str, context: Dict, history: List[Dict[str, str]] = []) -> Iterator[Tuple[str, Dict]]:
+        """
+        Streaming variant of get_response. Yields ("token", {"text": ...}) events while the answer
+        is generated, then one ("done", {"suggested_trades": [...], "alerts": [...]}) event.
+        """
+        if not self.client:
+            fallback = self.get_response(user_message, context, history)
+            yield "token", {"text": fallback["answer"]}
+            yield "done", {"suggested_trades": fallback["suggested_trades"], "alerts": fallback["alerts"]}
+            return
+
+        messages = self._build_messages(self.stream_system_prompt, user_message, context, history)
+        pending = ""   # Answer text held back in case it is the start of the delimiter
+        meta = None    # Text after the delimiter, once seen
+        try:
+            for delta in llm_gateway.chat_stream(messages, call_type="chat", model="gpt-4o"):
+                if meta is not None:
+                    meta += delta
+                    continue
+                pending += delta
+                if STREAM_META_DELIMITER in pending:
+                    text, meta = pending.split(STREAM_META_DELIMITER, 1)
+                    if text.rstrip():
+                        yield "token", {"text": text.rstrip()}
+                    continue
+                # Emit everything that can't be a prefix of the delimiter
+                safe = len(pending) - len(STREAM_META_DELIMITER) + 1
+                if safe > 0:
+                    yield "token", {"text": pending[:safe]}
+                    pending = pending[safe:]
+            if meta is None and pending:
+                yield "token", {"text": pending}
+        except Exception as e:
+            print(f"LLM Error: {e}")
+            yield "token", {"text": f"\n\n❌ **Error generating response**: {str(e)}"}
+            yield "done", {"suggested_trades": [], "alerts": ["System Error"]}
+            return
+
+        yield "done", self._parse_stream_meta(meta)
+
+    def _parse_stream_meta(self, meta) -> Dict:
+        result = {"suggested_trades": [], "alerts": []}
+        if not meta:
+            return result
+        text = meta.strip().removeprefix("```json").removeprefix("```").removesuffix("```").strip()
+        try:
+            data = json.loads(text)
+        except ValueError:
+            print(f"LLM Error: malformed stream metadata: {text[:200]}")
+            return result
+        if not isinstance(data, dict):
+            print(f"LLM Error: stream metadata is not an object: {text[:200]}")
+            return result
+        if isinstance(data.get("suggested_trades"), list):
+            result["suggested_trades"] = data["suggested_trades"]
+        if isinstance(data.get("alerts"), list):
+            result["alerts"] = data["alerts"]
+        return result
+
 llm_agent = LLMAgent()
@@ -0,0 +1,402 @@
+import os
+import json
+import time
+import random
+import sqlite3
+import hashlib
+import threading
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional
+import openai
+from openai import OpenAI
+
+from cycle_profiler import cycle_profiler
+from llm_offline import OfflineClient
+
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", os.path.join(os.path.dirname(__file__), "llm_cache.db"))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "5000"))
+
+# Seconds a cached response stays valid, per call type. 0 disables caching for that type.
+CACHE_TTLS = {
+    "chat": 120,               # Same question + same context within a couple of minutes (retries, double submits)
+    "news_analysis": 6 * 3600, # Same article set -> same alerts
+    "sentiment": 30 * 60,      # Same query + same search results
+}
+DEFAULT_TTL = 300
+
+# "openai" (default) or "offline": deterministic local stand-in for load tests without network access
+LLM_BACKEND = os.getenv("LLM_BACKEND", "openai").lower()
+
+# Concurrent completions in flight: overall, and per call type so scheduler bursts can't starve chat
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+CALLER_CONCURRENCY = {
+    "chat": 4,
+    "news_analysis": 4,
+    "sentiment": 4,
+}
+DEFAULT_CALLER_CONCURRENCY = 2
+
+# Overall seconds per call (queueing + attempts + backoff) unless the caller set a tighter deadline
+CALL_DEADLINES = {
+    "chat": 45,
+    "news_analysis": 90,
+    "sentiment": 30,
+}
+DEFAULT_DEADLINE = 60
+
+LLM_MAX_RETRIES = 2
+RETRY_BASE_DELAY = 0.5 # Seconds; full jitter over base * 2^attempt
+RETRY_MAX_DELAY = 8.0
+RETRY_BUDGET_RATIO = 0.2 # Retries may add at most ~20% on top of first attempts
+RETRY_BUDGET_MAX = 10.0
+RETRYABLE_ERRORS = (openai.APITimeoutError, openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)
+
+_deadline: ContextVar[Optional[float]] = ContextVar("llm_deadline", default=None)
+
+
+class LLMDeadlineExceeded(TimeoutError):
+    """No time left in the caller's deadline to queue for or make an LLM call."""
+
+
+class RetryBudget:
+    """
+    Token bucket shared by all callers: each first attempt deposits RETRY_BUDGET_RATIO tokens,
+    each retry spends one. When the upstream is failing for everyone, retries stop amplifying load.
+    """
+
+    def __init__(self, ratio: float = RETRY_BUDGET_RATIO, max_tokens: float = RETRY_BUDGET_MAX):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self.lock = threading.Lock()
+
+    def record_attempt(self):
+        with self.lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        with self.lock:
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+
+class ResponseCache:
+    """
+    Content-addressed LLM response cache in a local SQLite file, shared by all workers.
+    Entries expire by TTL; the table is kept under max_entries by evicting least recently used rows.
+    """
+
+    def __init__(self, path: str = LLM_CACHE_PATH, max_entries: int = LLM_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.stats = {}  # {call_type: {"hits": n, "misses": n}}
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS llm_cache (
+                    key TEXT PRIMARY KEY,
+                    call_type TEXT,
+                    response TEXT,
+                    expires_at REAL,
+                    last_access REAL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_llm_cache_last_access ON llm_cache (last_access)")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL") # Readers never block the writer across workers
+            yield conn
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _count(self, call_type: str, outcome: str):
+        # Caller holds self.lock
+        bucket = self.stats.setdefault(call_type, {"hits": 0, "misses": 0})
+        bucket[outcome] += 1
+
+    def get(self, key: str, call_type: str) -> Optional[str]:
+        now = time.time()
+        with self.lock:
+            try:
+                with self._connect() as conn:
+                    row = conn.execute(
+                        "SELECT response, expires_at FROM llm_cache WHERE key = ?", (key,)
+                    ).fetchone()
+                    if row and row[1] > now:
+                        conn.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (now, key))
+                        self._count(call_type, "hits")
+                        return row[0]
+            except sqlite3.Error as e:
+                print(f"[LLM CACHE] Read error: {e}")
+            self._count(call_type, "misses")
+            return None
+
+    def put(self, key: str, call_type: str, response: str, ttl: int):
+        now = time.time()
+        try:
+            with self.lock, self._connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO llm_cache (key, call_type, response, expires_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                    (key, call_type, response, now + ttl, now)
+                )
+                count = conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+                if count > self.max_entries:
+                    # Drop expired rows first, then the least recently used 10% beyond the bound
+                    conn.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (now,))
+                    overflow = conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0] - self.max_entries
+                    if overflow > 0:
+                        conn.execute(
+                            "DELETE FROM llm_cache WHERE key IN (SELECT key FROM llm_cache ORDER BY last_access ASC LIMIT ?)",
+                            (overflow + self.max_entries // 10,)
+                        )
+        except sqlite3.Error as e:
+            print(f"[LLM CACHE] Write error: {e}")
+
+    def summary(self) -> Dict:
+        try:
+            with self._connect() as conn:
+                entries = conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        except sqlite3.Error:
+            entries = None
+        with self.lock:
+            by_call_type = {call_type: dict(bucket) for call_type, bucket in self.stats.items()}
+        hits = sum(s["hits"] for s in by_call_type.values())
+        misses = sum(s["misses"] for s in by_call_type.values())
+        return {
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / (hits + misses), 3) if hits + misses else None,
+            "by_call_type": by_call_type
+        }
+
+
+def cache_key(model: str, messages: List[Dict], response_format: Optional[Dict]) -> str:
+    """Hash of model + messages with whitespace normalized (prompt indentation doesn't change the answer)."""
+    normalized = [
+        {"role": m.get("role"), "content": " ".join(str(m.get("content", "")).split())}
+        for m in messages
+    ]
+    payload = json.dumps({"model": model, "messages": normalized, "format": response_format}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMGateway:
+    """
+    Single entry point for chat completions used by llm_agent and news_agent.
+    Adds response caching, concurrency limits, deadlines and budgeted retries around the client.
+    """
+
+    def __init__(self):
+        if LLM_BACKEND == "offline":
+            self.client = OfflineClient()
+            print("[LLM] Using offline stand-in backend")
+        else:
+            # Initialize OpenAI client. It will look for OPENAI_API_KEY in env vars.
+            # Retries are done here (budgeted, deadline-aware) rather than by the SDK.
+            api_key = os.getenv("OPENAI_API_KEY")
+            self.client = OpenAI(api_key=api_key, max_retries=0) if api_key else None
+        self.cache = ResponseCache()
+        self.global_slots = threading.BoundedSemaphore(LLM_MAX_CONCURRENCY)
+        self.caller_slots: Dict[str, threading.BoundedSemaphore] = {}
+        self.slots_lock = threading.Lock()
+        self.retry_budget = RetryBudget()
+
+    def limits_summary(self) -> Dict:
+        return {
+            "backend": "offline" if isinstance(self.client, OfflineClient) else ("openai" if self.client else None),
+            "max_concurrency": LLM_MAX_CONCURRENCY,
+            "caller_concurrency": {**CALLER_CONCURRENCY},
+            "retry_budget_tokens": round(self.retry_budget.tokens, 2)
+        }
+
+    # --- Deadlines ---
+
+    @contextmanager
+    def deadline(self, seconds: float):
+        """
+        Bounds every LLM call made inside the block (including from worker threads started with
+        contextvars.copy_context()) to finish within `seconds`. Nested deadlines only tighten.
+        """
+        at = time.monotonic() + max(0.0, seconds)
+        current = _deadline.get()
+        token = _deadline.set(min(at, current) if current is not None else at)
+        try:
+            yield
+        finally:
+            _deadline.reset(token)
+
+    def _deadline_for(self, call_type: str) -> float:
+        own = time.monotonic() + CALL_DEADLINES.get(call_type, DEFAULT_DEADLINE)
+        inherited = _deadline.get()
+        return min(own, inherited) if inherited is not None else own
+
+    def _remaining(self, deadline_at: float, call_type: str) -> float:
+        remaining = deadline_at - time.monotonic()
+        if remaining <= 0:
+            cycle_profiler.count("llm_deadline_exceeded")
+            raise LLMDeadlineExceeded(f"{call_type} LLM call out of time")
+        return remaining
+
+    # --- Concurrency ---
+
+    def _caller_slot(self, call_type: str) -> threading.BoundedSemaphore:
+        with self.slots_lock:
+            if call_type not in self.caller_slots:
+                self.caller_slots[call_type] = threading.BoundedSemaphore(
+                    CALLER_CONCURRENCY.get(call_type, DEFAULT_CALLER_CONCURRENCY)
+                )
+            return self.caller_slots[call_type]
+
+    @contextmanager
+    def _slots(self, call_type: str, deadline_at: float):
+        """Holds a per-call-type slot and a global slot, waiting no longer than the deadline."""
+        caller = self._caller_slot(call_type)
+        start = time.perf_counter()
+        if not caller.acquire(timeout=self._remaining(deadline_at, call_type)):
+            cycle_profiler.count("llm_queue_timeouts")
+            raise LLMDeadlineExceeded(f"Timed out waiting for a {call_type} LLM slot")
+        try:
+            if not self.global_slots.acquire(timeout=max(0.0, deadline_at - time.monotonic())):
+                cycle_profiler.count("llm_queue_timeouts")
+                raise LLMDeadlineExceeded("Timed out waiting for an LLM slot")
+            try:
+                cycle_profiler.count("llm_queue_ms", int((time.perf_counter() - start) * 1000))
+                yield
+            finally:
+                self.global_slots.release()
+        finally:
+            caller.release()
+
+    # --- Execution ---
+
+    def _execute(self, call_type: str, deadline_at: float, request: Callable[[float], Any], hold_slots: bool = True) -> Any:
+        """
+        Runs request(timeout), holding concurrency slots unless the caller already does.
+        Transient errors are retried with jittered exponential backoff while the retry budget
+        and the deadline allow.
+        """
+        self.retry_budget.record_attempt()
+        attempt = 0
+        while True:
+            try:
+                with self._slots(call_type, deadline_at) if hold_slots else nullcontext():
+                    return request(self._remaining(deadline_at, call_type))
+            except RETRYABLE_ERRORS as e:
+                attempt += 1
+                delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+                if attempt > LLM_MAX_RETRIES or time.monotonic() + delay >= deadline_at:
+                    raise
+                if not self.retry_budget.try_spend():
+                    cycle_profiler.count("llm_retry_budget_exhausted")
+                    raise
+                cycle_profiler.count("llm_retries")
+                print(f"[LLM] {call_type} attempt {attempt} failed ({type(e).__name__}); retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+    def chat(self, messages: List[Dict], call_type: str = "chat", model: str = "gpt-4o",
+             response_format: Optional[Dict] = None, ttl: Optional[int] = None) -> str:
+        """
+        Returns the completion text. Identical (model, messages) within the call type's TTL
+        are served from cache without an API call. Raises on API errors and LLMDeadlineExceeded.
+        """
+        if not self.client:
+            raise RuntimeError("OPENAI_API_KEY not configured")
+
+        ttl = CACHE_TTLS.get(call_type, DEFAULT_TTL) if ttl is None else ttl
+        key = cache_key(model, messages, response_format)
+
+        if ttl > 0:
+            cached = self.cache.get(key, call_type)
+            if cached is not None:
+                cycle_profiler.count("llm_cache_hits")
+                return cached
+            cycle_profiler.count("llm_cache_misses")
+
+        kwargs = {"model": model, "messages": messages}
+        if response_format:
+            kwargs["response_format"] = response_format
+        response = self._execute(
+            call_type, self._deadline_for(call_type),
+            lambda timeout: self.client.chat.completions.create(timeout=timeout, **kwargs)
+        )
+        cycle_profiler.record_llm_usage(response)
+
+        content = response.choices[0].message.content
+        if ttl > 0 and content and self._is_cacheable(content, response_format):
+            self.cache.put(key, call_type, content, ttl)
+        return content
+
+    def chat_stream(self, messages: List[Dict], call_type: str = "chat", model: str = "gpt-4o",
+                    ttl: Optional[int] = None) -> Iterator[str]:
+        """
+        Yields completion text deltas as they arrive. A cached response is yielded as one chunk;
+        a completed stream is cached under the same key scheme as chat(). Raises on API errors.
+        Slots are held until the stream ends; only opening the stream is retried.
+        """
+        if not self.client:
+            raise RuntimeError("OPENAI_API_KEY not configured")
+
+        ttl = CACHE_TTLS.get(call_type, DEFAULT_TTL) if ttl is None else ttl
+        key = cache_key(model, messages, {"stream": True})
+
+        if ttl > 0:
+            cached = self.cache.get(key, call_type)
+            if cached is not None:
+                cycle_profiler.count("llm_cache_hits")
+                yield cached
+                return
+            cycle_profiler.count("llm_cache_misses")
+
+        # Absolute deadline computed up front: a generator can't rely on context set by its consumer
+        deadline_at = self._deadline_for(call_type)
+        with self._slots(call_type, deadline_at):
+            stream = self._execute(
+                call_type, deadline_at,
+                lambda timeout: self.client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    stream=True,
+                    stream_options={"include_usage": True}, # Final chunk carries token usage
+                    timeout=timeout
+                ),
+                hold_slots=False
+            )
+            parts = []
+            for chunk in stream:
+                if time.monotonic() > deadline_at:
+                    cycle_profiler.count("llm_deadline_exceeded")
+                    raise LLMDeadlineExceeded(f"{call_type} stream exceeded its deadline")
+                if chunk.usage:
+                    cycle_profiler.record_llm_usage(chunk)
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    parts.append(delta)
+                    yield delta
+
+        # Only reached if the consumer read the whole stream; an abandoned stream is never cached
+        content = "".join(parts)
+        if ttl > 0 and content:
+            self.cache.put(key, call_type, content, ttl)
+
+    def _is_cacheable(self, content: str, response_format: Optional[Dict]) -> bool:
+        # Never pin a malformed JSON answer in the cache; a retry should get a fresh one
+        if response_format and response_format.get("type") == "json_object":
+            try:
+                json.loads(content)
+            except ValueError:
+                return False
+        return True
+
+
+llm_gateway = LLMGateway()
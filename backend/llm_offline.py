@@ -0,0 +1,115 @@
+import os
+import re
+import json
+import time
+import hashlib
+from types import SimpleNamespace
+from typing import Dict, Iterator, List, Optional
+
+import httpx
+import openai
+
+# Simulated completion latency, so load tests see realistic concurrency without network access
+LLM_OFFLINE_LATENCY_MS = int(os.getenv("LLM_OFFLINE_LATENCY_MS", "0"))
+OFFLINE_CHUNK_CHARS = 12 # Characters per streamed delta
+
+_SYMBOL_HEADER_RE = re.compile(r"^\s*\[([A-Z0-9&\-\.]+)\]\s*$", re.MULTILINE)
+_TICKER_RE = re.compile(r"\b([A-Z]{3,5})\b")
+_URL_RE = re.compile(r"\((https?://[^\s)]+)\)\s*$")
+_DELIMITER_RE = re.compile(r"<<<[A-Z]+>>>")
+_NOT_TICKERS = {"PSX", "KSE", "ALL", "THE", "AND", "FOR", "USD", "PKR", "SBP", "IMF", "CEO", "GDP", "CPI", "LTD", "URL"}
+
+
+def _seed(*parts: str) -> int:
+    return int.from_bytes(hashlib.sha256("\x00".join(parts).encode("utf-8")).digest()[:8], "big")
+
+
+def _score(*parts: str) -> float:
+    """Deterministic score in [-1, 1] with one decimal."""
+    return round((_seed(*parts) % 21 - 10) / 10, 1)
+
+
+class OfflineCompletions:
+    """
+    Stand-in for `OpenAI().chat.completions`. Answers are derived from the prompt alone,
+    so the same request always gets the same response, in the shape each caller expects.
+    """
+
+    def create(self, model: str, messages: List[Dict], response_format: Optional[Dict] = None,
+               stream: bool = False, stream_options: Optional[Dict] = None, timeout: Optional[float] = None, **kwargs):
+        latency = LLM_OFFLINE_LATENCY_MS / 1000
+        if timeout is not None and latency > timeout:
+            time.sleep(timeout)
+            raise openai.APITimeoutError(request=httpx.Request("POST", "offline://chat/completions"))
+        if latency:
+            time.sleep(latency)
+
+        system = next((m["content"] for m in messages if m.get("role") == "system"), "")
+        prompt = messages[-1].get("content", "") if messages else ""
+        content = self._respond(system, prompt, stream)
+        usage = SimpleNamespace(
+            prompt_tokens=sum(len(str(m.get("content", ""))) for m in messages) // 4 + 1,
+            completion_tokens=len(content) // 4 + 1
+        )
+        if stream:
+            return self._stream(content, usage, (stream_options or {}).get("include_usage", False))
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content), finish_reason="stop")],
+            usage=usage
+        )
+
+    def _stream(self, content: str, usage, include_usage: bool) -> Iterator:
+        for i in range(0, len(content), OFFLINE_CHUNK_CHARS):
+            delta = SimpleNamespace(content=content[i:i + OFFLINE_CHUNK_CHARS])
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=delta, finish_reason=None)], usage=None)
+        if include_usage:
+            yield SimpleNamespace(choices=[], usage=usage)
+
+    def _respond(self, system: str, prompt: str, stream: bool) -> str:
+        # Batch sentiment: one [SYMBOL] header per symbol
+        symbols = _SYMBOL_HEADER_RE.findall(prompt)
+        if symbols and '"scores"' in prompt:
+            return json.dumps({"scores": {
+                s: {"score": _score(s, prompt), "summary": f"Offline sentiment for {s}."} for s in symbols
+            }})
+
+        # Single-query sentiment
+        if '"score": float' in prompt:
+            return json.dumps({"score": _score(prompt), "summary": "Offline sentiment."})
+
+        # News analysis: an alert per distinct ticker-looking word in the article lines ("- title: body (url)")
+        if '"alerts"' in prompt and "news" in system.lower():
+            alerts, seen = [], set()
+            for line in prompt.splitlines():
+                line = line.strip()
+                if not line.startswith("- "):
+                    continue
+                url = _URL_RE.search(line)
+                for ticker in _TICKER_RE.findall(line):
+                    if ticker in _NOT_TICKERS or ticker in seen or len(alerts) >= 3:
+                        continue
+                    seen.add(ticker)
+                    score = _score(ticker, line)
+                    alerts.append({
+                        "symbol": ticker,
+                        "signal": "BUY" if score > 0.3 else "SELL" if score < -0.3 else "NEUTRAL",
+                        "reason": f"Offline analysis of news mentioning {ticker}.",
+                        "url": url.group(1) if url else ""
+                    })
+            return json.dumps({"alerts": alerts})
+
+        # Chat
+        question = prompt.rsplit("User Question:", 1)[-1].strip()
+        answer = f"**Offline mode.** Deterministic stand-in answer to: {question[:200]}"
+        meta = {"suggested_trades": [], "alerts": ["Offline LLM backend"]}
+        delimiter = _DELIMITER_RE.search(system)
+        if stream and delimiter:
+            return f"{answer}\n{delimiter.group(0)}\n{json.dumps(meta)}"
+        return json.dumps({"answer": answer, **meta})
+
+
+class OfflineClient:
+    """Drop-in for the OpenAI client (only `chat.completions.create` is used)."""
+
+    def __init__(self):
+        self.chat = SimpleNamespace(completions=OfflineCompletions())
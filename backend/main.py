@@ -1,4 +1,4 @@
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Form
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
 from sqlalchemy import func
@@ -6,21 +6,37 @@ from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
 from dotenv import load_dotenv
 import os
+import json
 from datetime import datetime, timedelta
 import pytz
-from apscheduler.schedulers.background import BackgroundScheduler
 
 # Explicitly load .env from the backend directory
 env_path = os.path.join(os.path.dirname(__file__), ".env")
 load_dotenv(env_path)
 
-from models import SessionLocal, init_db, PortfolioItem, UserSettings, Transaction, PortfolioHistory, AIAlert, AIPortfolioItem, AINotification, AITradeHistory, AIRecommendation
+from models import SessionLocal, init_db, PortfolioItem, UserSettings, Transaction, PortfolioHistory, AIAlert, AIPortfolioItem, AINotification, AITradeHistory, AIRecommendation, DEFAULT_ACCOUNT
+from accounts import accounts
 from portfolio_engine import PortfolioEngine
 from market_data import market_data
 from autonomous_agent import AutonomousAgent
 from llm_agent import llm_agent
-from news_agent import news_agent
-from fastapi.responses import JSONResponse
+from chat_context import chat_context
+from llm_gateway import llm_gateway
+from news_agent import news_agent, NEWS_ANALYSIS_MIN_ARTICLES
+from news_store import news_store
+from search_client import search_client
+from ledger import cash_ledger
+from exporter import exporter
+from retention import retention_service, run_retention_job, RETENTION_POLICIES
+from fundamentals_store import fundamentals_store, run_fundamentals_refresh_job
+from risk_analytics import risk_analytics, run_kline_sync_job
+from statement_importer import statement_importer, StatementError
+from scheduler import scheduler_service
+from market_calendar import market_calendar
+from cycle_profiler import cycle_profiler
+from screening import UNIVERSE_MODES, CycleSnapshot
+from fastapi.responses import JSONResponse, StreamingResponse, FileResponse
+from starlette.background import BackgroundTask
 
 # Initialize Database
 init_db()
@@ -64,45 +80,36 @@ def get_db():
 def analyze_news(db: Session = Depends(get_db)):
     """Triggers the AI News Analysis cycle."""
     # Check Trading Hours (PKT)
-    settings = db.query(UserSettings).first()
-    if settings:
-        pkt_tz = pytz.timezone('Asia/Karachi')
-        now_pkt = datetime.now(pkt_tz)
-        current_time_str = now_pkt.strftime("%H:%M")
-        
-        start_time = settings.trading_start_time or "09:30"
-        end_time = settings.trading_end_time or "15:30"
-        
-        if not (start_time <= current_time_str <= end_time):
-            print(f"[NEWS ANALYSIS] Skipping: Current time {current_time_str} (PKT) is outside trading hours ({start_time} - {end_time})")
-            return {"message": "Skipped: Outside trading hours", "alerts_generated": 0}
+    # Weekends, PSX holidays and half-days included, so no searches/tokens are spent on closed days
+    settings = accounts.settings(db)
+    market = market_calendar.status(settings)
+    if not market["is_open"]:
+        next_open = market["next_open"].strftime("%Y-%m-%d %H:%M") if market["next_open"] else "unknown"
+        print(f"[NEWS ANALYSIS] Skipping: {market['reason']}. Next open {next_open} PKT")
+        return {"message": f"Skipped: {market['reason']}", "alerts_generated": 0, "next_open": next_open}
 
     print("DEBUG: Starting News Analysis...")
     
-    # 1. Fetch News
-    news = news_agent.fetch_market_news()
+    # 1. Fetch News (parallel queries; starts analysis once enough articles arrived)
+    news = news_agent.fetch_market_news(min_articles=NEWS_ANALYSIS_MIN_ARTICLES)
     print(f"DEBUG: Fetched {len(news)} news items.")
+
+    # 2. Keep only stories not seen before (exact URL + near-duplicate clustering)
+    fresh_news = news_store.ingest(db, news)
+    if not fresh_news:
+        return {"message": "No new stories since last analysis", "alerts_generated": 0}
     
-    # 2. Analyze with LLM
-    alerts_data = news_agent.analyze_news(news)
+    # 3. Analyze with LLM
+    # Stories from chunks whose LLM call failed stay unanalyzed and are re-sent next run
+    alerts_data, analyzed_news = news_agent.analyze_news(fresh_news)
+    news_store.mark_analyzed(db, analyzed_news)
     print(f"DEBUG: Generated {len(alerts_data)} alerts.")
     
-    new_alerts = []
-    for alert in alerts_data:
-        # Check if duplicate (same symbol and signal today)
-        # For simplicity, just adding for now
-        db_alert = AIAlert(
-            symbol=alert.get('symbol'),
-            signal=alert.get('signal'),
-            reason=alert.get('reason'),
-            url=alert.get('url'),
-            timestamp=datetime.now()
-        )
-        db.add(db_alert)
-        new_alerts.append(db_alert)
+    # 4. Store only genuinely new signals (unique on symbol, signal, url, trading day)
+    inserted = news_store.save_alerts(db, alerts_data)
         
     db.commit()
-    return {"message": "Analysis complete", "alerts_generated": len(new_alerts)}
+    return {"message": "Analysis complete", "alerts_generated": inserted, "duplicates_ignored": len(alerts_data) - inserted}
 
 @app.get("/autonomous/alerts")
 def get_alerts(db: Session = Depends(get_db)):
@@ -131,76 +138,63 @@ def get_db():
 @app.on_event("startup")
 def on_startup():
     init_db()
+    db = SessionLocal()
+    try:
+        fundamentals_store.backfill(db)
+    finally:
+        db.close()
     start_scheduler()
 
+@app.on_event("shutdown")
+def on_shutdown():
+    scheduler_service.release()
+
 def start_scheduler():
-    """Starts the background scheduler for autonomous trading."""
-    scheduler = BackgroundScheduler()
-    # Run every 1 minute to check if we need to trade
-    scheduler.add_job(run_scheduled_trading_cycle, 'interval', minutes=1)
-    
-    # Run Daily Budget Injection at 9:00 AM PKT
-    scheduler.add_job(run_daily_budget_injection, 'cron', hour=9, minute=0, timezone='Asia/Karachi')
-    
-    scheduler.start()
-    print("DEBUG: Background Scheduler Started")
+    """
+    Starts the background scheduler for autonomous trading.
+    Every worker runs a leader heartbeat; only the lock holder schedules the trading
+    cycle (from polling_interval + trading hours), the 9:00 AM PKT budget injection,
+    the nightly retention/rollup, fundamentals refresh and daily kline sync jobs.
+    """
+    scheduler_service.start(
+        trading_job=run_scheduled_trading_cycle,
+        budget_job=run_daily_budget_injection,
+        retention_job=run_retention_job,
+        fundamentals_job=run_fundamentals_refresh_job,
+        klines_job=run_kline_sync_job
+    )
 
-def run_scheduled_trading_cycle():
+def run_scheduled_trading_cycle(account_keys: List[str]):
     """
-    Checks if it's time to run the trading cycle based on user settings.
-    This runs every minute but only executes the trade logic if the polling interval has passed.
+    Runs the trading cycle of the accounts the scheduler found due (one shard, one tick).
+    Market data (board snapshot, regime and news sentiment) is fetched once and shared;
+    each account gets its own session so one failing account doesn't roll back the others.
+    Settings are re-checked here in case they changed since the run was planned.
     """
-    db = SessionLocal()
-    try:
-        settings = db.query(UserSettings).first()
-        if not settings or not settings.autonomous_mode:
-            return # Auto mode disabled
-
-        # 1. Check Trading Hours (PKT)
-        pkt_tz = pytz.timezone('Asia/Karachi')
-        now_pkt = datetime.now(pkt_tz)
-        current_time_str = now_pkt.strftime("%H:%M")
-        
-        start_time = settings.trading_start_time or "09:30"
-        end_time = settings.trading_end_time or "15:30"
-        
-        if not (start_time <= current_time_str <= end_time):
-            # print(f"[AUTO] Outside trading hours: {current_time_str}")
-            return
-
-        # 2. Check Polling Interval
-        # If last_run_date is None, run immediately
-        # Else, check if enough minutes have passed
-        should_run = False
-        if not settings.last_run_date:
-            should_run = True
-        else:
-            # Ensure last_run_date is timezone aware or handle naive comparison
-            # We'll assume last_run_date is stored as UTC in DB (default), so we compare with UTC now
-            # OR simpler: just check total seconds difference
-            last_run = settings.last_run_date
-            if last_run.tzinfo is None:
-                last_run = pytz.utc.localize(last_run)
-            
-            now_utc = datetime.now(pytz.utc)
-            minutes_diff = (now_utc - last_run).total_seconds() / 60
-            
-            if minutes_diff >= settings.polling_interval:
-                should_run = True
-        
-        if should_run:
-            print(f"[AUTO] Triggering Trading Cycle at {current_time_str} PKT")
-            agent = AutonomousAgent(db)
-            agent.run_trading_cycle()
-            
-            # Update last run time
+    shared = CycleSnapshot()
+    for account in account_keys:
+        db = SessionLocal()
+        try:
+            settings = accounts.get(db, account)
+            if not settings or not settings.autonomous_mode:
+                continue # Auto mode disabled
+
+            # 1. Check Market Calendar (PKT trading hours, weekends, holidays)
+            if not market_calendar.is_open(None, settings.trading_start_time, settings.trading_end_time):
+                continue
+
+            print(f"[AUTO] Triggering Trading Cycle for {account} at {datetime.now(pytz.timezone('Asia/Karachi')).strftime('%H:%M')} PKT")
+            agent = AutonomousAgent(db, account)
+            agent.run_trading_cycle(shared)
+
+            # Update last run time (the scheduler computes the next run from this)
             settings.last_run_date = datetime.now(pytz.utc)
             db.commit()
-            
-    except Exception as e:
-        print(f"[AUTO] Scheduler Error: {e}")
-    finally:
-        db.close()
+
+        except Exception as e:
+            print(f"[AUTO] Scheduler Error ({account}): {e}")
+        finally:
+            db.close()
 
 @app.get("/")
 def read_root():
@@ -321,10 +315,7 @@ def sell_portfolio_item(sell: PortfolioSell, db: Session = Depends(get_db)):
         raise HTTPException(status_code=400, detail="Insufficient quantity")
     
     # 2. Update Cash Balance
-    settings = db.query(UserSettings).first()
-    if not settings:
-        settings = UserSettings()
-        db.add(settings)
+    settings = accounts.settings(db)
     
     total_sale_value = sell.quantity * sell.price
     settings.cash_balance += total_sale_value
@@ -360,10 +351,7 @@ class CashUpdate(BaseModel):
 
 @app.post("/portfolio/cash")
 def update_cash(update: CashUpdate, db: Session = Depends(get_db)):
-    settings = db.query(UserSettings).first()
-    if not settings:
-        settings = UserSettings()
-        db.add(settings)
+    settings = accounts.settings(db)
     
     if update.type == "DEPOSIT":
         settings.cash_balance += update.amount
@@ -376,6 +364,17 @@ def update_cash(update: CashUpdate, db: Session = Depends(get_db)):
     db.commit()
     return {"cash_balance": settings.cash_balance}
 
+@app.post("/import/statement")
+def import_statement(file: UploadFile = File(...), target: str = Form("portfolio"), dry_run: bool = Form(False),
+                     account: str = Form(DEFAULT_ACCOUNT), db: Session = Depends(get_db)):
+    """Bulk-imports a broker statement (CSV/XLSX) into the manual ('portfolio') or an AI account's ('ai') holdings. Rows are applied oldest first whatever the file's order. dry_run only reports the positions."""
+    if target == "ai":
+        get_account_settings(db, account)
+    try:
+        return statement_importer.run(db, file.file, file.filename or "statement.csv", target, dry_run, account=account)
+    except StatementError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @app.get("/portfolio/history")
 def get_portfolio_history(db: Session = Depends(get_db)):
     """Returns the portfolio value history for the chart."""
@@ -424,72 +423,46 @@ class ChatRequest(BaseModel):
     message: str
     data_source: str = "ai" # "ai" or "personal"
     history: List[Dict[str, str]] = [] # [{"role": "user", "content": "..."}]
+    account: str = DEFAULT_ACCOUNT # AI fund the "ai" context describes
+
+def build_chat_context(request: ChatRequest, db: Session) -> Dict:
+    # Only the sections the chat prompt uses, as compact cached tables (the personal portfolio is ignored by the prompt)
+    return chat_context.build(db, request.message, account=request.account)
 
 @app.post("/chat")
 def chat_endpoint(request: ChatRequest, db: Session = Depends(get_db)):
-    # Gather context
-    engine = PortfolioEngine(db)
-    
-    # Always fetch ALL data for both portfolios to allow comparison/roasting
-    user_portfolio = engine.get_portfolio_summary()
-    ai_portfolio = get_ai_portfolio_data(db)
-    
-    # Fetch recent history for both
-    user_history = [
-        {
-            "symbol": t.symbol,
-            "action": t.action,
-            "price": t.price,
-            "qty": t.quantity,
-            "date": t.timestamp.strftime("%Y-%m-%d"),
-            "notes": t.notes
-        }
-        for t in db.query(Transaction).order_by(Transaction.timestamp.desc()).limit(10).all()
-    ]
-    
-    ai_history = [
-        {
-            "symbol": t.symbol, 
-            "action": t.action, 
-            "price": t.price, 
-            "qty": t.quantity, 
-            "date": t.timestamp.strftime("%Y-%m-%d"),
-            "reason": t.reason
-        } 
-        for t in db.query(AITradeHistory).order_by(AITradeHistory.timestamp.desc()).limit(10).all()
-    ]
-
-    context = {
-        "market_status": market_data.get_market_status(),
-        "data_source": request.data_source,
-        "portfolio": user_portfolio,
-        "ai_portfolio": ai_portfolio,
-        "user_trade_history": user_history,
-        "ai_trade_history": ai_history
-    }
-    
-    # Check for search intent in message
-    search_keywords = ["news", "search", "latest", "forecast", "outlook", "why", "happened", "market", "trend"]
-    # Check if message contains a stock symbol or keyword
-    should_search = any(kw in request.message.lower() for kw in search_keywords)
-    
-    if should_search:
-        try:
-            from news_agent import news_agent
-            # Use original message as query
-            search_results = news_agent.search_web(request.message + " Pakistan Stock Exchange", limit=3)
-            context["news_context"] = search_results
-        except Exception as e:
-            print(f"Search context error: {e}")
-    
+    context = build_chat_context(request, db)
     response = llm_agent.get_response(request.message, context, request.history)
     return response
 
+def _sse(event: str, data: Dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/chat/stream")
+def chat_stream_endpoint(request: ChatRequest, db: Session = Depends(get_db)):
+    """
+    Server-Sent Events variant of /chat.
+    Emits `token` events ({"text"}) as the answer is generated, then one `done` event
+    with {"suggested_trades", "alerts"}.
+    """
+    # Context is built before streaming starts; the generator never touches the request's session
+    context = build_chat_context(request, db)
+
+    def event_stream():
+        for event, data in llm_agent.get_response_stream(request.message, context, request.history):
+            yield _sse(event, data)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"} # Don't let proxies buffer tokens
+    )
+
 # --- Autonomous Agent Routes ---
 @app.get("/autonomous/plan")
-def get_daily_plan(db: Session = Depends(get_db)):
+def get_daily_plan(account: str = DEFAULT_ACCOUNT, db: Session = Depends(get_db)):
     """Deprecated: Returns latest AI notifications instead of a plan."""
-    return db.query(AINotification).order_by(AINotification.timestamp.desc()).limit(5).all()
+    return db.query(AINotification).filter(AINotification.account == account).order_by(AINotification.timestamp.desc()).limit(5).all()
 
 @app.get("/autonomous/alerts")
 def get_alerts(db: Session = Depends(get_db)):
@@ -505,27 +478,29 @@ class SettingsUpdate(BaseModel):
     polling_interval: Optional[int] = None
     trading_start_time: Optional[str] = None
     trading_end_time: Optional[str] = None
+    universe_mode: Optional[str] = None # HELD, UNIVERSE, FULL_MARKET
 
-@app.get("/settings")
-def get_settings(db: Session = Depends(get_db)):
-    settings = db.query(UserSettings).first()
+def get_account_settings(db: Session, account: str) -> UserSettings:
+    settings = accounts.settings(db, account)
     if not settings:
-        settings = UserSettings()
-        db.add(settings)
-        db.commit()
-        db.refresh(settings)
+        raise HTTPException(status_code=404, detail=f"Unknown account '{account}'")
     return settings
 
+@app.get("/settings")
+def get_settings(account: str = DEFAULT_ACCOUNT, db: Session = Depends(get_db)):
+    return get_account_settings(db, account)
+
 @app.post("/settings")
-def update_settings(update: SettingsUpdate, db: Session = Depends(get_db)):
-    settings = db.query(UserSettings).first()
-    if not settings:
-        settings = UserSettings()
-        db.add(settings)
+def update_settings(update: SettingsUpdate, account: str = DEFAULT_ACCOUNT, db: Session = Depends(get_db)):
+    settings = get_account_settings(db, account)
     
     if update.daily_trade_budget is not None:
         settings.daily_trade_budget = update.daily_trade_budget
     if update.ai_cash_balance is not None:
+        # Manual correction goes into the ledger too, so replays reproduce it
+        delta = update.ai_cash_balance - (settings.ai_cash_balance or 0.0)
+        if abs(delta) > 0.005:
+            cash_ledger.record_adjustment(db, delta, f"Manual cash balance set to Rs. {update.ai_cash_balance:,.2f}", account)
         settings.ai_cash_balance = update.ai_cash_balance
     if update.autonomous_mode is not None:
         settings.autonomous_mode = update.autonomous_mode
@@ -537,16 +512,62 @@ def update_settings(update: SettingsUpdate, db: Session = Depends(get_db)):
         settings.trading_start_time = update.trading_start_time
     if update.trading_end_time is not None:
         settings.trading_end_time = update.trading_end_time
+    if update.universe_mode is not None:
+        if update.universe_mode not in UNIVERSE_MODES:
+            raise HTTPException(status_code=400, detail=f"universe_mode must be one of {UNIVERSE_MODES}")
+        settings.universe_mode = update.universe_mode
         
     db.commit()
     db.refresh(settings)
+
+    # Autonomous mode, polling interval or hours may have changed the next run
+    scheduler_service.request_reschedule(settings)
+    return settings
+
+# --- Account Routes ---
+class AccountCreate(BaseModel):
+    account: str
+    initial_ai_capital: float = 100000.0
+    daily_trade_budget: float = 0.0
+    universe_mode: Optional[str] = None
+
+@app.get("/accounts")
+def list_accounts(db: Session = Depends(get_db)):
+    """AI funds in this deployment and the scheduler shard each one runs in."""
+    accounts.settings(db) # Default account always listed
+    return [{
+        "account": s.account,
+        "autonomous_mode": s.autonomous_mode,
+        "ai_cash_balance": s.ai_cash_balance,
+        "shard": accounts.shard_of(s.account)
+    } for s in accounts.list(db)]
+
+@app.post("/accounts")
+def create_account(body: AccountCreate, db: Session = Depends(get_db)):
+    """New AI fund with its own cash, holdings, ledger and settings (autonomous mode off)."""
+    if not accounts.valid_key(body.account):
+        raise HTTPException(status_code=400, detail="Account key must be 1-48 chars of a-z, 0-9, '_' or '-'")
+    if accounts.get(db, body.account):
+        raise HTTPException(status_code=409, detail=f"Account '{body.account}' already exists")
+    if body.universe_mode is not None and body.universe_mode not in UNIVERSE_MODES:
+        raise HTTPException(status_code=400, detail=f"universe_mode must be one of {UNIVERSE_MODES}")
+
+    values = {"initial_ai_capital": body.initial_ai_capital, "daily_trade_budget": body.daily_trade_budget}
+    if body.universe_mode:
+        values["universe_mode"] = body.universe_mode
+    settings = accounts.create(db, body.account, **values)
+    db.commit()
+    db.refresh(settings)
     return settings
 
 # --- Recommendation Routes ---
 @app.get("/autonomous/recommendations")
-def get_recommendations(db: Session = Depends(get_db)):
+def get_recommendations(account: str = DEFAULT_ACCOUNT, db: Session = Depends(get_db)):
     """Fetch pending recommendations."""
-    return db.query(AIRecommendation).filter(AIRecommendation.status == "PENDING").all()
+    return db.query(AIRecommendation).filter(
+        AIRecommendation.account == account,
+        AIRecommendation.status == "PENDING"
+    ).all()
 
 @app.post("/autonomous/recommendations/{rec_id}/{action}")
 def handle_recommendation(rec_id: int, action: str, db: Session = Depends(get_db)):
@@ -556,8 +577,8 @@ def handle_recommendation(rec_id: int, action: str, db: Session = Depends(get_db
         raise HTTPException(status_code=404, detail="Recommendation not found")
         
     if action == "approve":
-        settings = db.query(UserSettings).first()
-        agent = AutonomousAgent(db)
+        settings = accounts.get(db, rec.account)
+        agent = AutonomousAgent(db, rec.account)
         
         # Execute Trade
         # Create empty notifications list for the function to populate
@@ -581,6 +602,68 @@ def handle_recommendation(rec_id: int, action: str, db: Session = Depends(get_db
     
     return {"message": f"Recommendation {action}d"}
 
+class RecommendationBatch(BaseModel):
+    ids: List[int]
+    action: str # approve, deny
+
+@app.post("/autonomous/recommendations/batch")
+def handle_recommendations_batch(batch: RecommendationBatch, db: Session = Depends(get_db)):
+    """Approve or Deny many pending recommendations atomically (all or nothing)."""
+    if batch.action not in ("approve", "deny"):
+        raise HTTPException(status_code=400, detail="Action must be 'approve' or 'deny'")
+
+    ids = list(dict.fromkeys(batch.ids))
+    recs = db.query(AIRecommendation).filter(AIRecommendation.id.in_(ids)).all()
+    recs_by_id = {r.id: r for r in recs}
+
+    missing = [rec_id for rec_id in ids if rec_id not in recs_by_id]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Recommendations not found: {missing}")
+    not_pending = [r.id for r in recs if r.status != "PENDING"]
+    if not_pending:
+        raise HTTPException(status_code=400, detail=f"Recommendations already resolved: {not_pending}")
+    account_keys = {r.account for r in recs}
+    if len(account_keys) > 1:
+        raise HTTPException(status_code=400, detail=f"Batch spans several accounts: {sorted(account_keys)}")
+
+    notifications = []
+    if batch.action == "approve":
+        account = recs[0].account
+        settings = accounts.get(db, account)
+        agent = AutonomousAgent(db, account)
+
+        # Execute in id order inside one transaction; any failure rolls back the whole batch
+        for rec_id in sorted(ids):
+            rec = recs_by_id[rec_id]
+            ok = agent.execute_trade(
+                rec.symbol,
+                rec.action,
+                rec.quantity,
+                rec.price,
+                rec.reason,
+                notifications,
+                settings,
+                recommendation_id=rec.id,
+                commit=False
+            )
+            if not ok:
+                db.rollback()
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Batch aborted: could not execute {rec.action} {rec.quantity} {rec.symbol} (recommendation {rec.id})"
+                )
+            rec.status = "APPROVED"
+    else:
+        for rec in recs:
+            rec.status = "DENIED"
+
+    db.commit()
+    if batch.action == "approve":
+        # Only once the batch is durable, so a rollback keeps the cached chat context valid
+        chat_context.invalidate("ai_portfolio")
+        chat_context.invalidate("ai_trade_history")
+    return {"message": f"{len(ids)} recommendations {batch.action}d", "notifications": notifications}
+
 class ManualStockAdd(BaseModel):
     symbol: str
     quantity: int
@@ -589,11 +672,12 @@ class ManualStockAdd(BaseModel):
     reasoning: str
 
 @app.post("/autonomous/holdings/add")
-def manual_add_stock(item: ManualStockAdd, db: Session = Depends(get_db)):
+def manual_add_stock(item: ManualStockAdd, account: str = DEFAULT_ACCOUNT, db: Session = Depends(get_db)):
     """Manually add a stock to AI portfolio."""
-    
+    get_account_settings(db, account)
+
     # 1. Check if item exists
-    db_item = db.query(AIPortfolioItem).filter(AIPortfolioItem.symbol == item.symbol).first()
+    db_item = db.query(AIPortfolioItem).filter(AIPortfolioItem.account == account, AIPortfolioItem.symbol == item.symbol).first()
     
     if db_item:
         # CONSOLIDATE: Calculate new weighted avg cost
@@ -622,6 +706,7 @@ def manual_add_stock(item: ManualStockAdd, db: Session = Depends(get_db)):
     else:
         # CREATE NEW
         new_item = AIPortfolioItem(
+            account=account,
             symbol=item.symbol,
             quantity=item.quantity,
             avg_cost=item.price,
@@ -636,6 +721,7 @@ def manual_add_stock(item: ManualStockAdd, db: Session = Depends(get_db)):
     # Track as Manual Buy so 'Invested Capital' increases correctly
     # Action=MANUAL_BUY, Price=Unit Price, Qty=Qty
     history_item = AITradeHistory(
+        account=account,
         symbol=item.symbol,
         action="MANUAL_BUY",
         quantity=item.quantity,
@@ -648,6 +734,7 @@ def manual_add_stock(item: ManualStockAdd, db: Session = Depends(get_db)):
     
     # Add Notification
     note = AINotification(
+        account=account,
         title=f"Manual Add: {item.symbol}",
         message=f"Manually added {item.quantity} shares of {item.symbol} @ Rs. {item.price:.2f}",
         type="INFO",
@@ -665,10 +752,10 @@ class ManualStockSell(BaseModel):
     reason: str
 
 @app.post("/autonomous/holdings/sell")
-def manual_sell_stock(item: ManualStockSell, db: Session = Depends(get_db)):
+def manual_sell_stock(item: ManualStockSell, account: str = DEFAULT_ACCOUNT, db: Session = Depends(get_db)):
     """Manually sell a stock from AI portfolio."""
     # Find item
-    db_item = db.query(AIPortfolioItem).filter(AIPortfolioItem.symbol == item.symbol).first()
+    db_item = db.query(AIPortfolioItem).filter(AIPortfolioItem.account == account, AIPortfolioItem.symbol == item.symbol).first()
     if not db_item:
         raise HTTPException(status_code=404, detail="Item not found in AI portfolio")
         
@@ -677,8 +764,8 @@ def manual_sell_stock(item: ManualStockSell, db: Session = Depends(get_db)):
         
     # Use Agent's logic to execute trade (handles Cash, History, Notification)
     # We create a dummy settings/notification list just for this call context or fetch real ones
-    settings = db.query(UserSettings).first()
-    agent = AutonomousAgent(db)
+    settings = accounts.get(db, account)
+    agent = AutonomousAgent(db, account)
     notifications = []
     
     agent.execute_trade(
@@ -698,9 +785,9 @@ class NotesUpdate(BaseModel):
     notes: str
 
 @app.post("/autonomous/holdings/update-notes")
-def update_stock_notes(update: NotesUpdate, db: Session = Depends(get_db)):
+def update_stock_notes(update: NotesUpdate, account: str = DEFAULT_ACCOUNT, db: Session = Depends(get_db)):
     """Update user reasoning/notes for an AI holding."""
-    item = db.query(AIPortfolioItem).filter(AIPortfolioItem.symbol == update.symbol).first()
+    item = db.query(AIPortfolioItem).filter(AIPortfolioItem.account == account, AIPortfolioItem.symbol == update.symbol).first()
     if not item:
         raise HTTPException(status_code=404, detail="Item not found")
     
@@ -744,25 +831,117 @@ def update_universe_item(item: UniverseItemMethod, db: Session = Depends(get_db)
             last_updated=datetime.now()
         )
         db.add(new_item)
+    fundamentals_store.set_manual(db, item.symbol, item.fundamentals)
     
     db.commit()
     return {"message": f"Updated {item.symbol}"}
 
+@app.get("/fundamentals/screen")
+def screen_fundamentals(pe_min: Optional[float] = None, pe_max: Optional[float] = None, yield_min: Optional[float] = None,
+                        yield_max: Optional[float] = None, growth_min: Optional[float] = None, eps_min: Optional[float] = None,
+                        market_cap_min: Optional[float] = None, sector: Optional[str] = None, universe_only: bool = False,
+                        limit: int = 100, db: Session = Depends(get_db)):
+    """SQL fundamentals screen, e.g. ?pe_max=8&yield_min=10 (upper bounds exclusive). Cheapest PE first."""
+    return fundamentals_store.screen(
+        db, sector=sector, universe_only=universe_only, limit=limit, pe_min=pe_min, pe_max=pe_max,
+        yield_min=yield_min, yield_max=yield_max, growth_min=growth_min, eps_min=eps_min, market_cap_min=market_cap_min
+    )
+
+@app.post("/fundamentals/refresh")
+def refresh_fundamentals(symbols: Optional[str] = None, db: Session = Depends(get_db)):
+    """Pulls /companies data now for the given symbols (comma separated) or every stale universe/held symbol."""
+    targets = [s.strip().upper() for s in symbols.split(",") if s.strip()] if symbols else None
+    return fundamentals_store.refresh(db, targets)
+
 @app.post("/autonomous/trade")
-def trigger_trading_cycle(db: Session = Depends(get_db)):
+def trigger_trading_cycle(account: str = DEFAULT_ACCOUNT, db: Session = Depends(get_db)):
     """Manually triggers the AI trading cycle."""
-    agent = AutonomousAgent(db)
+    get_account_settings(db, account)
+    agent = AutonomousAgent(db, account)
     notifications = agent.run_trading_cycle()
     return {"message": "Trading cycle completed", "notifications": notifications}
 
-def get_ai_portfolio_data(db: Session, refresh_prices: bool = True):
+@app.get("/llm/cache-stats")
+def get_llm_cache_stats():
+    """Hit/miss counts (this worker) and size of the shared LLM response cache, plus call limits."""
+    return {**llm_gateway.cache.summary(), "limits": llm_gateway.limits_summary()}
+
+@app.get("/autonomous/ledger/audit")
+def audit_ledger(full: bool = False, account: str = DEFAULT_ACCOUNT, db: Session = Depends(get_db)):
+    """Cash/positions replayed from the trade ledger (from the last checkpoint) vs. stored balances."""
+    get_account_settings(db, account)
+    return cash_ledger.audit(db, full=full, account=account)
+
+@app.get("/news/search-stats")
+def get_search_stats():
+    """DuckDuckGo search cache and throttling counters (this worker). 'no_news' and 'throttled' are separate."""
+    return search_client.summary()
+
+@app.get("/export/{table}")
+def export_history(table: str, format: str = "parquet", start: Optional[datetime] = None, end: Optional[datetime] = None,
+                   symbols: Optional[str] = None, account: Optional[str] = None, db: Session = Depends(get_db)):
+    """
+    Downloads ai_trade_history, transactions, portfolio_history or klines as Parquet / Arrow IPC (end is exclusive).
+    `account` limits ai_trade_history to one AI fund; without it every fund's trades are exported with their account.
+    """
+    if account:
+        get_account_settings(db, account)
+    try:
+        result = exporter.export_temp(
+            db, table, format, start=start, end=end,
+            symbols=[s.strip() for s in symbols.split(",") if s.strip()] if symbols else None,
+            account=account
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    media_type = "application/vnd.apache.parquet" if format == "parquet" else "application/vnd.apache.arrow.file"
+    return FileResponse(
+        result["path"], media_type=media_type, filename=f"{table}.{format}",
+        headers={"X-Export-Rows": str(result["rows"])}, background=BackgroundTask(os.remove, result["path"])
+    )
+
+@app.get("/maintenance/retention")
+def get_retention_status(db: Session = Depends(get_db)):
+    """Retention policies with current row counts and how many rows the next run would roll up."""
+    status = retention_service.run(db, dry_run=True)
+    return {t: {**retention_service.policies()[t], **status[t]} for t in status}
+
+@app.post("/maintenance/retention/run")
+def run_retention(dry_run: bool = False, db: Session = Depends(get_db)):
+    """Rolls up and deletes notifications, alerts, resolved recommendations and cycle metrics past their retention policy."""
+    return retention_service.run(db, dry_run=dry_run)
+
+@app.get("/maintenance/rollups")
+def get_rollups(table: Optional[str] = None, days: int = 90, account: Optional[str] = None, db: Session = Depends(get_db)):
+    """Daily counts of rolled-up rows per account and category (notification type, alert signal, recommendation/cycle status)."""
+    if table and table not in RETENTION_POLICIES:
+        raise HTTPException(status_code=400, detail=f"Unknown table '{table}'")
+    return retention_service.rollups(db, table, days, account)
+
+@app.get("/risk/analytics")
+def get_risk_analytics(portfolio: str = "ai", account: str = DEFAULT_ACCOUNT, confidence: float = 0.95,
+                       horizon_days: int = 1, db: Session = Depends(get_db)):
+    """VaR (parametric + historical), volatility and per-holding contributions for the AI ('ai') or manual ('personal') portfolio."""
+    if portfolio not in ("ai", "personal"):
+        raise HTTPException(status_code=400, detail="portfolio must be 'ai' or 'personal'")
+    if not 0.5 <= confidence < 1 or not 1 <= horizon_days <= 30:
+        raise HTTPException(status_code=400, detail="confidence must be in [0.5, 1) and horizon_days in [1, 30]")
+    if portfolio == "personal":
+        return PortfolioEngine(db).check_risk_exposure(confidence, horizon_days)
+    settings = get_account_settings(db, account)
+    items = db.query(AIPortfolioItem).filter(AIPortfolioItem.account == account).all()
+    return {"account": account, **risk_analytics.exposure_report(db, items, settings.ai_cash_balance, confidence, horizon_days)}
+
+@app.get("/autonomous/cycle-metrics")
+def get_cycle_metrics(window_hours: int = 24, account: str = DEFAULT_ACCOUNT, db: Session = Depends(get_db)):
+    """Per-stage latency percentiles, upstream calls, cache hit rate and LLM tokens for an account's recent trading cycles."""
+    get_account_settings(db, account)
+    return cycle_profiler.summarize(db, window_hours, account=account)
+
+def get_ai_portfolio_data(db: Session, refresh_prices: bool = True, account: str = DEFAULT_ACCOUNT):
     """Helper to calculate AI portfolio metrics."""
-    items = db.query(AIPortfolioItem).all()
-    settings = db.query(UserSettings).first()
-    if not settings:
-        settings = UserSettings()
-        db.add(settings)
-        db.commit()
+    settings = get_account_settings(db, account)
+    items = db.query(AIPortfolioItem).filter(AIPortfolioItem.account == account).all()
     
     # Calculate current value and PnL dynamically
     portfolio_data = []
@@ -869,6 +1048,7 @@ def get_ai_portfolio_data(db: Session, refresh_prices: bool = True):
     # Calculate Total Realized P&L from History
     from models import AITradeHistory
     total_realized_pnl = db.query(func.sum(AITradeHistory.pnl)).filter(
+        AITradeHistory.account == account,
         AITradeHistory.pnl.isnot(None)
     ).scalar() or 0.0
     
@@ -879,12 +1059,14 @@ def get_ai_portfolio_data(db: Session, refresh_prices: bool = True):
     # Calculate Total Invested Capital (Initial + Deposits + Manual Buys)
     # 1. Cash Deposits (Action=DEPOSIT, Price=Amount)
     cash_deposits = db.query(func.sum(AITradeHistory.price)).filter(
+        AITradeHistory.account == account,
         AITradeHistory.action == "DEPOSIT"
     ).scalar() or 0.0
     
     # 2. Manual Stock Imports (Action=MANUAL_BUY, Price=Unit Price, Qty=Qty)
     # We need sum(price * quantity)
     manual_stock_value = db.query(func.sum(AITradeHistory.price * AITradeHistory.quantity)).filter(
+        AITradeHistory.account == account,
         AITradeHistory.action == "MANUAL_BUY"
     ).scalar() or 0.0
     
@@ -916,56 +1098,67 @@ def get_ai_portfolio_data(db: Session, refresh_prices: bool = True):
     }
 
 @app.get("/autonomous/portfolio")
-def get_ai_portfolio(refresh_prices: bool = True, db: Session = Depends(get_db)):
+def get_ai_portfolio(refresh_prices: bool = True, account: str = DEFAULT_ACCOUNT, db: Session = Depends(get_db)):
     """Returns the AI's current portfolio holdings with overall PnL metrics."""
-    return get_ai_portfolio_data(db, refresh_prices)
+    return get_ai_portfolio_data(db, refresh_prices, account)
 
-def run_daily_budget_injection():
-    """Standalone function to inject daily budget."""
+def run_daily_budget_injection(account_keys: Optional[List[str]] = None):
+    """Standalone function to inject the daily budget into every account (or the given ones)."""
     db = SessionLocal()
     try:
-        settings = db.query(UserSettings).first()
-        if not settings:
-            settings = UserSettings()
-            db.add(settings)
-        
-        # Add daily budget
-        budget_to_add = settings.daily_trade_budget
-        settings.ai_cash_balance += budget_to_add
-        
-        # Track deposit in trade history for P&L calculation
-        from models import AITradeHistory
-        deposit_record = AITradeHistory(
-            symbol="DEPOSIT",
-            action="DEPOSIT",
-            quantity=0, # Cash injection has 0 qty
-            price=budget_to_add, # Price holds the Amount for DEPOSIT
-            # total_value removed as it doesn't exist in model
-            pnl=None,
-            reason=f"Daily budget injection: Rs. {budget_to_add:,.2f}"
-        )
-        db.add(deposit_record)
-        
-        # Log notification
-        agent = AutonomousAgent(db)
-        agent._add_notification(
-            "New Day: Budget Injected", 
-            f"Added Rs. {budget_to_add:,.2f} to AI Cash Balance. New Balance: Rs. {settings.ai_cash_balance:,.2f}", 
-            "SYSTEM", 
-            [] 
-        )
-        
-        db.commit()
-        print(f"[DAILY JOB] Injected Rs. {budget_to_add}")
-        return {"added_budget": budget_to_add, "new_balance": settings.ai_cash_balance}
-    except Exception as e:
-        print(f"[DAILY JOB ERROR] {e}")
-        return None
+        accounts.settings(db) # Default account exists even on a fresh install
+        keys = account_keys or [s.account for s in accounts.list(db)]
     finally:
         db.close()
 
+    results = {}
+    for account in keys:
+        db = SessionLocal()
+        try:
+            settings = accounts.get(db, account)
+            if not settings:
+                continue
+
+            # Add daily budget
+            budget_to_add = settings.daily_trade_budget
+            settings.ai_cash_balance += budget_to_add
+
+            # Track deposit in trade history for P&L calculation
+            deposit_record = AITradeHistory(
+                account=account,
+                symbol="DEPOSIT",
+                action="DEPOSIT",
+                quantity=0, # Cash injection has 0 qty
+                price=budget_to_add, # Price holds the Amount for DEPOSIT
+                pnl=None,
+                reason=f"Daily budget injection: Rs. {budget_to_add:,.2f}"
+            )
+            db.add(deposit_record)
+
+            # Log notification
+            agent = AutonomousAgent(db, account)
+            agent._add_notification(
+                "New Day: Budget Injected",
+                f"Added Rs. {budget_to_add:,.2f} to AI Cash Balance. New Balance: Rs. {settings.ai_cash_balance:,.2f}",
+                "SYSTEM",
+                []
+            )
+
+            db.flush()
+            # Once a day: snapshot the ledger if enough trades accumulated since the last checkpoint
+            cash_ledger.maybe_checkpoint(db, account=account)
+
+            db.commit()
+            print(f"[DAILY JOB] Injected Rs. {budget_to_add} into {account}")
+            results[account] = {"added_budget": budget_to_add, "new_balance": settings.ai_cash_balance}
+        except Exception as e:
+            print(f"[DAILY JOB ERROR] {account}: {e}")
+        finally:
+            db.close()
+    return results
+
 @app.post("/autonomous/new-day")
-def simulate_new_day(db: Session = Depends(get_db)):
+def simulate_new_day(account: str = DEFAULT_ACCOUNT, db: Session = Depends(get_db)):
     """Simulates a new day: Adds daily budget to AI cash balance."""
     # We can just call the standalone function, but we need to handle the DB session carefully.
     # Since run_daily_budget_injection creates its own session, we can just call it.
@@ -975,28 +1168,31 @@ def simulate_new_day(db: Session = Depends(get_db)):
     
     # Actually, let's just use the logic directly here to avoid session conflicts if we were passing db,
     # but since the scheduler needs it standalone, let's call the standalone function.
-    result = run_daily_budget_injection()
+    if not accounts.get(db, account) and account != DEFAULT_ACCOUNT:
+        raise HTTPException(status_code=404, detail=f"Unknown account '{account}'")
+    result = run_daily_budget_injection([account]).get(account)
     if result:
         return {"message": "New day simulated", **result}
     else:
         raise HTTPException(status_code=500, detail="Failed to simulate new day")
 
 @app.get("/autonomous/notifications")
-def get_ai_notifications(db: Session = Depends(get_db)):
+def get_ai_notifications(account: str = DEFAULT_ACCOUNT, db: Session = Depends(get_db)):
     """Returns the AI's action log."""
-    return db.query(AINotification).order_by(AINotification.timestamp.desc()).limit(50).all()
+    return db.query(AINotification).filter(AINotification.account == account).order_by(AINotification.timestamp.desc()).limit(50).all()
 
 @app.get("/autonomous/trade-history")
-def get_trade_history(db: Session = Depends(get_db)):
+def get_trade_history(account: str = DEFAULT_ACCOUNT, db: Session = Depends(get_db)):
     """Returns the AI's complete trade history with P&L breakdown."""
     from models import AITradeHistory
-    trades = db.query(AITradeHistory).order_by(AITradeHistory.timestamp.desc()).all()
+    trades = db.query(AITradeHistory).filter(AITradeHistory.account == account).order_by(AITradeHistory.timestamp.desc()).all()
     return trades
 
 @app.get("/autonomous/intraday")
-def run_intraday_check(db: Session = Depends(get_db)):
+def run_intraday_check(account: str = DEFAULT_ACCOUNT, db: Session = Depends(get_db)):
     # Deprecated or can be merged into trading cycle
-    agent = AutonomousAgent(db)
+    get_account_settings(db, account)
+    agent = AutonomousAgent(db, account)
     # reusing trading cycle for now as it covers monitoring
     notifications = agent.run_trading_cycle()
     return {"notifications": notifications}
@@ -0,0 +1,153 @@
+import os
+import json
+import pytz
+from datetime import datetime, date, timedelta
+from typing import Dict, Optional, Tuple
+
+PKT = pytz.timezone('Asia/Karachi')
+
+DEFAULT_START = "09:30"
+DEFAULT_END = "15:30"
+
+# Gazetted holidays that fall on the same date every year
+FIXED_HOLIDAYS = {
+    (2, 5): "Kashmir Solidarity Day",
+    (3, 23): "Pakistan Day",
+    (5, 1): "Labour Day",
+    (5, 28): "Youm-e-Takbeer",
+    (8, 14): "Independence Day",
+    (11, 9): "Iqbal Day",
+    (12, 25): "Quaid-e-Azam Day",
+}
+
+HOLIDAYS_FILE = os.getenv(
+    "PSX_HOLIDAYS_FILE",
+    os.path.join(os.path.dirname(__file__), "market_holidays.json")
+)
+
+
+def parse_hhmm(value: Optional[str], default: str) -> Tuple[int, int]:
+    try:
+        hour, minute = (value or default).split(":")
+        return int(hour), int(minute)
+    except (ValueError, AttributeError):
+        hour, minute = default.split(":")
+        return int(hour), int(minute)
+
+
+class MarketCalendar:
+    """
+    PSX trading calendar: weekends, gazetted holidays, declared (lunar) holidays and half-days.
+    Declared holidays/half-days are read from market_holidays.json so they can be updated
+    when PSX publishes its notice, without a code change.
+    """
+
+    def __init__(self, holidays_file: str = HOLIDAYS_FILE):
+        self.declared_holidays: Dict[date, str] = {}
+        self.half_days: Dict[date, str] = {} # {date: "HH:MM" early close}
+        self._next_open_cache: Dict[tuple, Optional[datetime]] = {}
+        self._next_open_day: Optional[date] = None # Cache only holds entries for this day
+        self._load(holidays_file)
+
+    def _load(self, path: str):
+        if not path or not os.path.exists(path):
+            return
+        try:
+            with open(path) as f:
+                data = json.load(f)
+            for day, name in data.get("holidays", {}).items():
+                self.declared_holidays[date.fromisoformat(day)] = name
+            for day, close in data.get("half_days", {}).items():
+                self.half_days[date.fromisoformat(day)] = close
+            print(f"[CALENDAR] Loaded {len(self.declared_holidays)} holidays, {len(self.half_days)} half-days")
+        except Exception as e:
+            print(f"[CALENDAR] Failed to load {path}: {e}")
+
+    def holiday_name(self, day: date) -> Optional[str]:
+        if day in self.declared_holidays:
+            return self.declared_holidays[day]
+        return FIXED_HOLIDAYS.get((day.month, day.day))
+
+    def is_trading_day(self, day: date) -> bool:
+        if day.weekday() >= 5: # Saturday, Sunday
+            return False
+        return self.holiday_name(day) is None
+
+    def session(self, day: date, start_time: str = None, end_time: str = None) -> Optional[Tuple[datetime, datetime]]:
+        """
+        Returns (open, close) in PKT for the given day, or None if the market is shut.
+        Close is exclusive and one minute past end_time, matching the old inclusive "HH:MM" check.
+        Half-days close at the declared time if that is earlier than end_time.
+        """
+        if not self.is_trading_day(day):
+            return None
+
+        start_h, start_m = parse_hhmm(start_time, DEFAULT_START)
+        end_h, end_m = parse_hhmm(end_time, DEFAULT_END)
+        if day in self.half_days:
+            half_h, half_m = parse_hhmm(self.half_days[day], DEFAULT_END)
+            end_h, end_m = min((end_h, end_m), (half_h, half_m))
+
+        open_at = PKT.localize(datetime(day.year, day.month, day.day, start_h, start_m))
+        close_at = PKT.localize(datetime(day.year, day.month, day.day, end_h, end_m)) + timedelta(minutes=1)
+        if close_at <= open_at:
+            return None
+        return open_at, close_at
+
+    def is_open(self, now: datetime = None, start_time: str = None, end_time: str = None) -> bool:
+        now = (now or datetime.now(PKT)).astimezone(PKT)
+        window = self.session(now.date(), start_time, end_time)
+        return bool(window) and window[0] <= now < window[1]
+
+    def next_open(self, now: datetime = None, start_time: str = None, end_time: str = None) -> Optional[datetime]:
+        """
+        Returns `now` if the market is open, else the next session open (PKT).
+        Results for a closed market are cached per (day, hours) so idle checks are free.
+        """
+        now = (now or datetime.now(PKT)).astimezone(PKT)
+        if self.is_open(now, start_time, end_time):
+            return now
+
+        if now.date() != self._next_open_day:
+            self._next_open_cache.clear()
+            self._next_open_day = now.date()
+        key = (now.date(), start_time, end_time)
+        cached = self._next_open_cache.get(key, False)
+        if cached is not False and (cached is None or cached > now):
+            return cached
+
+        result = None
+        day = now.date()
+        for _ in range(30): # Longest PSX closure (Eid + weekend) is well under this
+            window = self.session(day, start_time, end_time)
+            if window and window[0] > now:
+                result = window[0]
+                break
+            day += timedelta(days=1)
+
+        self._next_open_cache[key] = result
+        return result
+
+    def status(self, settings=None, now: datetime = None) -> Dict:
+        """Market status for the configured trading hours: {"is_open", "reason", "next_open"}."""
+        now = (now or datetime.now(PKT)).astimezone(PKT)
+        start_time = getattr(settings, "trading_start_time", None) or DEFAULT_START
+        end_time = getattr(settings, "trading_end_time", None) or DEFAULT_END
+
+        if self.is_open(now, start_time, end_time):
+            return {"is_open": True, "reason": "Market open", "next_open": now}
+
+        today = now.date()
+        if today.weekday() >= 5:
+            reason = "Weekend"
+        elif self.holiday_name(today):
+            reason = f"Holiday: {self.holiday_name(today)}"
+        else:
+            reason = f"Outside trading hours ({start_time} - {end_time})"
+            if today in self.half_days:
+                reason = f"Half-day: closed after {self.half_days[today]}"
+
+        return {"is_open": False, "reason": reason, "next_open": self.next_open(now, start_time, end_time)}
+
+
+market_calendar = MarketCalendar()
@@ -1,11 +1,23 @@
+import os
 import requests
 import time
 from datetime import datetime, timedelta
 from typing import Dict, Any, Optional
+from cycle_profiler import cycle_profiler
+from kline_store import kline_store
+from offline_data import OfflineMarketHTTP
+
+# "psxterminal" (default) or "offline": deterministic local stand-in for benchmarks without network access
+MARKET_DATA_BACKEND = os.getenv("MARKET_DATA_BACKEND", "psxterminal").lower()
 
 class MarketDataService:
     def __init__(self):
         self.base_url = "https://psxterminal.com/api" 
+        if MARKET_DATA_BACKEND == "offline":
+            self.http = OfflineMarketHTTP()
+            print("[MARKET DATA] Using offline stand-in backend")
+        else:
+            self.http = requests
         self.headers = {
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
         }
@@ -13,6 +25,7 @@ class MarketDataService:
         # Caches
         self.price_cache = {} # {symbol: (timestamp, price)}
         self.stats_cache = None # (timestamp, data)
+        self.ticks_cache = None # (timestamp, {symbol: tick}) - whole REG board
         
         # Cache Durations
         self.price_ttl = timedelta(seconds=60) # 1 minute for prices
@@ -20,6 +33,8 @@ class MarketDataService:
         
         self.last_request_time = 0
         self.min_interval = 0.1 # ~100 requests per minute = 0.6s per request
+        if MARKET_DATA_BACKEND == "offline":
+            self.min_interval = 0.0 # Spacing protects psxterminal; the stand-in's latency is MARKET_OFFLINE_LATENCY_MS
 
     def _rate_limit(self):
         current_time = time.time()
@@ -28,18 +43,26 @@ class MarketDataService:
             time.sleep(self.min_interval - elapsed)
         self.last_request_time = time.time()
 
+    def get_cached_price(self, symbol: str) -> float:
+        """Last known price from the price cache regardless of age, without any network call. 0.0 if unknown."""
+        entry = self.price_cache.get(symbol)
+        return entry[1] if entry else 0.0
+
     def get_live_price(self, symbol: str) -> float:
         # Check cache
         if symbol in self.price_cache:
             timestamp, price = self.price_cache[symbol]
             if datetime.now() - timestamp < self.price_ttl:
+                cycle_profiler.count("cache_hits")
                 return price
 
+        cycle_profiler.count("cache_misses")
+        cycle_profiler.count("upstream_calls")
         self._rate_limit()
         try:
             # Try REG market first
             url = f"{self.base_url}/ticks/REG/{symbol}"
-            response = requests.get(url, headers=self.headers, timeout=5)
+            response = self.http.get(url, headers=self.headers, timeout=5)
             
             if response.status_code == 200:
                 data = response.json()
@@ -55,17 +78,72 @@ class MarketDataService:
             print(f"Error fetching price for {symbol}: {e}")
             return 0.0
 
+    def get_ticks_snapshot(self, timeout: float = 10) -> Dict[str, Dict[str, float]]:
+        """
+        Fetches the whole REG board in one request: {symbol: {"price", "change_pct", "volume"}}.
+        Also warms the per-symbol price cache, so later get_live_price calls are cache hits.
+        """
+        if self.ticks_cache:
+            timestamp, data = self.ticks_cache
+            if datetime.now() - timestamp < self.price_ttl:
+                cycle_profiler.count("cache_hits")
+                return data
+
+        cycle_profiler.count("cache_misses")
+        cycle_profiler.count("upstream_calls")
+        self._rate_limit()
+        try:
+            url = f"{self.base_url}/ticks/REG"
+            response = self.http.get(url, headers=self.headers, timeout=timeout)
+            
+            if response.status_code == 200:
+                payload = response.json()
+                rows = payload.get("data", []) if isinstance(payload, dict) else payload
+                if isinstance(rows, dict):
+                    rows = list(rows.values())
+
+                now = datetime.now()
+                snapshot = {}
+                for tick in rows or []:
+                    symbol = tick.get("symbol")
+                    try:
+                        price = float(tick.get("price") or 0)
+                    except (TypeError, ValueError):
+                        continue
+                    if not symbol or price <= 0:
+                        continue
+                    snapshot[symbol] = {
+                        "price": price,
+                        "change_pct": float(tick.get("changePercent") or 0),
+                        "volume": float(tick.get("volume") or 0)
+                    }
+                    self.price_cache[symbol] = (now, price)
+
+                if snapshot:
+                    self.ticks_cache = (now, snapshot)
+                return snapshot
+            
+            print(f"Warning: Could not fetch ticks snapshot. Status: {response.status_code}")
+            return {}
+            
+        except Exception as e:
+            print(f"Error fetching ticks snapshot: {e}")
+            return {}
+
     def get_market_summary(self) -> Dict[str, Any]:
         # Check cache
         if self.stats_cache:
             timestamp, data = self.stats_cache
             if datetime.now() - timestamp < self.stats_ttl:
+                cycle_profiler.count("cache_hits")
                 return data
 
+        cycle_profiler.count("cache_misses")
+        cycle_profiler.count("upstream_calls")
         self._rate_limit()
         try:
             url = f"{self.base_url}/stats/REG"
-            response = requests.get(url, headers=self.headers, timeout=5)
+            response = self.http.get(url, headers=self.headers, timeout=5)
             
             if response.status_code == 200:
                 data = response.json()
@@ -108,11 +186,12 @@ class MarketDataService:
         self._rate_limit()
         try:
             url = f"{self.base_url}/klines/{symbol}/{timeframe}"
-            response = requests.get(url, headers=self.headers, timeout=5)
+            response = self.http.get(url, headers=self.headers, timeout=5)
             
             if response.status_code == 200:
                 data = response.json()
                 if data.get("success") and "data" in data:
+                    kline_store.save(symbol, timeframe, data["data"])
                     return data["data"]
             return []
         except Exception as e:
@@ -123,7 +202,7 @@ class MarketDataService:
         self._rate_limit()
         try:
             url = f"{self.base_url}/companies/{symbol}"
-            response = requests.get(url, headers=self.headers, timeout=5)
+            response = self.http.get(url, headers=self.headers, timeout=5)
             
             if response.status_code == 200:
                 data = response.json()
@@ -3,6 +3,7 @@ Database migration script to add new columns to existing tables.
 Run this once to update the schema without losing data.
 """
 import sqlite3
+from datetime import datetime
 
 DB_PATH = "./psx_copilot.db"
 
@@ -46,6 +47,106 @@ def migrate():
             print("✓ Added trading_end_time to user_settings")
         else:
             print("- trading_end_time already exists in user_settings")
+
+        if 'universe_mode' not in columns:
+            cursor.execute("ALTER TABLE user_settings ADD COLUMN universe_mode TEXT DEFAULT 'HELD'")
+            print("✓ Added universe_mode to user_settings")
+        else:
+            print("- universe_mode already exists in user_settings")
+        
+        # Alert dedup key (symbol, signal, url, trading day): backfill, drop existing duplicates, then enforce
+        cursor.execute("PRAGMA table_info(ai_alerts)")
+        columns = [col[1] for col in cursor.fetchall()]
+
+        if 'dedup_key' not in columns:
+            from news_store import alert_dedup_key
+            cursor.execute("ALTER TABLE ai_alerts ADD COLUMN trading_day DATE")
+            cursor.execute("ALTER TABLE ai_alerts ADD COLUMN dedup_key TEXT")
+            rows = cursor.execute("SELECT id, symbol, signal, url, timestamp FROM ai_alerts ORDER BY id").fetchall()
+            seen = set()
+            duplicates = []
+            for alert_id, symbol, signal, url, timestamp in rows:
+                day = datetime.fromisoformat(str(timestamp)).date() if timestamp else datetime.now().date()
+                key = alert_dedup_key(symbol, signal, url, day)
+                if key in seen:
+                    duplicates.append((alert_id,))
+                    continue
+                seen.add(key)
+                cursor.execute("UPDATE ai_alerts SET trading_day = ?, dedup_key = ? WHERE id = ?", (day.isoformat(), key, alert_id))
+            cursor.executemany("DELETE FROM ai_alerts WHERE id = ?", duplicates)
+            cursor.execute("CREATE INDEX IF NOT EXISTS ix_ai_alerts_trading_day ON ai_alerts (trading_day)")
+            cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS ix_ai_alerts_dedup_key ON ai_alerts (dedup_key)")
+            print(f"✓ Added dedup_key to ai_alerts ({len(duplicates)} duplicate alerts removed)")
+        else:
+            print("- dedup_key already exists in ai_alerts")
+
+        # Indexes for the dashboard's newest-first queries and the retention job
+        cursor.execute("CREATE INDEX IF NOT EXISTS ix_ai_alerts_timestamp ON ai_alerts (timestamp)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS ix_ai_notifications_timestamp ON ai_notifications (timestamp)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS ix_ai_recommendations_timestamp ON ai_recommendations (timestamp)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS ix_ai_recommendations_status ON ai_recommendations (status)")
+        print("✓ Ensured timestamp/status indexes on ai_alerts, ai_notifications, ai_recommendations")
+
+        # Multi-account: existing rows belong to the original fund ('default')
+        account_indexes = {
+            "ai_portfolio_items": [("symbol",)],
+            "ai_recommendations": [("status", "timestamp")],
+            "ai_trade_history": [("timestamp",), ("id",)],
+            "ai_notifications": [("timestamp",)],
+            "ledger_checkpoints": [("ledger_id",)],
+            "cycle_metrics": [("name", "started_at")],
+        }
+        cursor.execute("PRAGMA table_info(user_settings)")
+        if 'account' not in [col[1] for col in cursor.fetchall()]:
+            cursor.execute("ALTER TABLE user_settings ADD COLUMN account TEXT DEFAULT 'default'")
+            # Only one settings row was ever used (.first()); any extras get their own keys
+            cursor.execute("UPDATE user_settings SET account = 'legacy-' || id WHERE id != (SELECT MIN(id) FROM user_settings)")
+            print("✓ Added account to user_settings")
+        cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS ix_user_settings_account ON user_settings (account)")
+        for table, indexes in account_indexes.items():
+            cursor.execute(f"PRAGMA table_info({table})")
+            columns = [col[1] for col in cursor.fetchall()]
+            if not columns:
+                # Table predates this database; init_db() creates it with the account column
+                print(f"- {table} does not exist yet, skipped")
+                continue
+            if 'account' not in columns:
+                cursor.execute(f"ALTER TABLE {table} ADD COLUMN account TEXT NOT NULL DEFAULT 'default'")
+                print(f"✓ Added account to {table}")
+            for columns in indexes:
+                cursor.execute(f"CREATE INDEX IF NOT EXISTS ix_{table}_account_{'_'.join(columns)} ON {table} (account, {', '.join(columns)})")
+
+        # Rollups per AI fund: SQLite can't alter the unique key, so the table is rebuilt.
+        # Rows rolled up before this belong to the original fund (alerts are market-wide: '')
+        cursor.execute("PRAGMA table_info(daily_rollups)")
+        columns = [col[1] for col in cursor.fetchall()]
+        if columns and 'account' not in columns:
+            cursor.execute("ALTER TABLE daily_rollups RENAME TO daily_rollups_old")
+            cursor.execute("""
+                CREATE TABLE daily_rollups (
+                    id INTEGER NOT NULL PRIMARY KEY,
+                    table_name VARCHAR,
+                    day DATE,
+                    account VARCHAR NOT NULL DEFAULT '',
+                    category VARCHAR,
+                    symbol VARCHAR,
+                    count INTEGER,
+                    first_at DATETIME,
+                    last_at DATETIME,
+                    sample VARCHAR,
+                    CONSTRAINT uq_daily_rollups_key UNIQUE (table_name, day, account, category, symbol)
+                )
+            """)
+            cursor.execute("""
+                INSERT INTO daily_rollups (id, table_name, day, account, category, symbol, count, first_at, last_at, sample)
+                SELECT id, table_name, day, CASE WHEN table_name = 'ai_alerts' THEN '' ELSE 'default' END,
+                       category, symbol, count, first_at, last_at, sample
+                FROM daily_rollups_old
+            """)
+            cursor.execute("DROP TABLE daily_rollups_old")
+            for name, column in (("id", "id"), ("table_name", "table_name"), ("day", "day")):
+                cursor.execute(f"CREATE INDEX IF NOT EXISTS ix_daily_rollups_{name} ON daily_rollups ({column})")
+            print("✓ Added account to daily_rollups")
         
         conn.commit()
         print("\n✅ Migration completed successfully!")
@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, ForeignKey, Boolean
+from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, Date, ForeignKey, Boolean, Index, UniqueConstraint, insert
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from datetime import datetime
@@ -20,6 +20,8 @@ engine = create_engine(DATABASE_URL, connect_args=connect_args)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+DEFAULT_ACCOUNT = "default" # Account key of the original single AI fund; rows written before multi-account use it
+
 class PortfolioItem(Base):
     __tablename__ = "portfolio_items"
 
@@ -47,6 +49,7 @@ class UserSettings(Base):
     __tablename__ = "user_settings"
 
     id = Column(Integer, primary_key=True, index=True)
+    account = Column(String, unique=True, index=True, default=DEFAULT_ACCOUNT) # One settings row per AI fund
     cash_balance = Column(Float, default=0.0)
     monthly_investment = Column(Float, default=0.0)
     daily_trade_budget = Column(Float, default=5000.0)
@@ -60,6 +63,7 @@ class UserSettings(Base):
     polling_interval = Column(Integer, default=5) # Minutes
     trading_start_time = Column(String, default="09:30")
     trading_end_time = Column(String, default="15:30")
+    universe_mode = Column(String, default="HELD") # HELD, UNIVERSE, FULL_MARKET
 
 class DailyPlan(Base):
     __tablename__ = "daily_plans"
@@ -80,8 +84,10 @@ class AIAlert(Base):
     signal = Column(String) # BUY, SELL, HOLD
     reason = Column(String)
     url = Column(String, nullable=True)
-    timestamp = Column(DateTime, default=lambda: datetime.now(pytz.utc))
+    timestamp = Column(DateTime, index=True, default=lambda: datetime.now(pytz.utc))
     is_read = Column(Boolean, default=False)
+    trading_day = Column(Date, index=True, nullable=True) # PKT date the signal was generated
+    dedup_key = Column(String, unique=True, nullable=True) # sha1(symbol|signal|normalized url|trading day)
 
 class PortfolioHistory(Base):
     __tablename__ = "portfolio_history"
@@ -96,8 +102,12 @@ class PortfolioHistory(Base):
 
 class AIPortfolioItem(Base):
     __tablename__ = "ai_portfolio_items"
+    __table_args__ = (
+        Index("ix_ai_portfolio_items_account_symbol", "account", "symbol"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
+    account = Column(String, default=DEFAULT_ACCOUNT, nullable=False)
     symbol = Column(String, index=True)
     quantity = Column(Integer)
     avg_cost = Column(Float)
@@ -114,36 +124,49 @@ class AIPortfolioItem(Base):
 
 class AIRecommendation(Base):
     __tablename__ = "ai_recommendations"
+    __table_args__ = (
+        Index("ix_ai_recommendations_account_status_timestamp", "account", "status", "timestamp"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
+    account = Column(String, default=DEFAULT_ACCOUNT, nullable=False)
     symbol = Column(String, index=True)
     action = Column(String) # BUY, SELL
     quantity = Column(Integer)
     price = Column(Float)
     reason = Column(String, nullable=True)
-    status = Column(String, default="PENDING") # PENDING, APPROVED, DENIED, EXECUTED
-    timestamp = Column(DateTime, default=lambda: datetime.now(pytz.utc))
+    status = Column(String, index=True, default="PENDING") # PENDING, APPROVED, DENIED, EXECUTED
+    timestamp = Column(DateTime, index=True, default=lambda: datetime.now(pytz.utc))
     
 class AITradeHistory(Base):
     __tablename__ = "ai_trade_history"
+    __table_args__ = (
+        Index("ix_ai_trade_history_account_timestamp", "account", "timestamp"),
+        Index("ix_ai_trade_history_account_id", "account", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
+    account = Column(String, default=DEFAULT_ACCOUNT, nullable=False)
     symbol = Column(String, index=True)
-    action = Column(String) # BUY, SELL
+    action = Column(String) # BUY, SELL, MANUAL_BUY, DEPOSIT, WITHDRAW, ADJUSTMENT
     quantity = Column(Integer)
-    price = Column(Float)
+    price = Column(Float) # Unit price; the amount for DEPOSIT/WITHDRAW/ADJUSTMENT
     pnl = Column(Float, nullable=True) # Only for SELL
     timestamp = Column(DateTime, default=lambda: datetime.now(pytz.utc))
     reason = Column(String, nullable=True)
 
 class AINotification(Base):
     __tablename__ = "ai_notifications"
+    __table_args__ = (
+        Index("ix_ai_notifications_account_timestamp", "account", "timestamp"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
+    account = Column(String, default=DEFAULT_ACCOUNT, nullable=False)
     title = Column(String)
     message = Column(String)
     type = Column(String) # TRADE, ALERT, INFO, ACTION_REQUIRED
-    timestamp = Column(DateTime, default=lambda: datetime.now(pytz.utc))
+    timestamp = Column(DateTime, index=True, default=lambda: datetime.now(pytz.utc))
     is_read = Column(Boolean, default=False)
 
 class StockUniverse(Base):
@@ -155,11 +178,147 @@ class StockUniverse(Base):
     active = Column(Boolean, default=True)
     
     # Store JSON string of fundamentals: {"pe": 5.2, "fair_value": 150, "growth": 10}
+    # Hand-entered values; the typed copy used for scoring and screening lives in stock_fundamentals
     fundamentals_json = Column(String, default="{}") 
     
     last_updated = Column(DateTime, default=lambda: datetime.now(pytz.utc))
 
+class StockFundamentals(Base):
+    __tablename__ = "stock_fundamentals"
+
+    symbol = Column(String, primary_key=True, index=True)
+    name = Column(String, nullable=True)
+    sector = Column(String, index=True, nullable=True)
+    pe = Column(Float, index=True, nullable=True)
+    eps = Column(Float, nullable=True)
+    fair_value = Column(Float, nullable=True) # Manual estimate (the API has none)
+    growth = Column(Float, nullable=True) # Expected earnings growth, %
+    dividend_yield = Column(Float, index=True, nullable=True) # %
+    market_cap = Column(Float, nullable=True)
+    source = Column(String, default="MANUAL") # MANUAL, API
+    refreshed_at = Column(DateTime, index=True, nullable=True) # Last successful /companies/{symbol} pull
+    updated_at = Column(DateTime, default=lambda: datetime.now(pytz.utc))
+
+class NewsArticle(Base):
+    __tablename__ = "news_articles"
+
+    url_hash = Column(String, primary_key=True, index=True) # sha1 of normalized URL
+    url = Column(String)
+    title = Column(String, nullable=True)
+    body = Column(String, nullable=True)
+    simhash = Column(String) # 64-bit SimHash of title + body, hex
+    cluster_id = Column(String, index=True) # url_hash of the first article of the story
+    first_seen = Column(DateTime, index=True, default=lambda: datetime.now(pytz.utc))
+    analyzed_at = Column(DateTime, nullable=True) # Set once the story was sent to the LLM
+
+class LedgerCheckpoint(Base):
+    __tablename__ = "ledger_checkpoints"
+    __table_args__ = (
+        Index("ix_ledger_checkpoints_account_ledger_id", "account", "ledger_id"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    account = Column(String, default=DEFAULT_ACCOUNT, nullable=False)
+    ledger_id = Column(Integer, index=True) # Last ai_trade_history.id included in this snapshot
+    cash = Column(Float)
+    realized_pnl = Column(Float, default=0.0)
+    positions_json = Column(String, default="{}") # {"OGDC": [qty, total_cost], ...}
+    created_at = Column(DateTime, default=lambda: datetime.now(pytz.utc))
+
+# --- Scheduler Coordination ---
+
+class SchedulerLock(Base):
+    __tablename__ = "scheduler_locks"
+
+    name = Column(String, primary_key=True, index=True) # e.g. "scheduler"
+    owner = Column(String, nullable=True) # host:pid:token of the current leader
+    acquired_at = Column(DateTime, nullable=True)
+    expires_at = Column(DateTime, nullable=True) # Leader must renew before this
+    reschedule_requested = Column(Boolean, default=False) # Set by followers when settings change
+
+class CycleMetric(Base):
+    __tablename__ = "cycle_metrics"
+    __table_args__ = (
+        Index("ix_cycle_metrics_account_name_started_at", "account", "name", "started_at"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    account = Column(String, default=DEFAULT_ACCOUNT, nullable=False)
+    name = Column(String, index=True) # e.g. "trading_cycle"
+    started_at = Column(DateTime, index=True, default=lambda: datetime.now(pytz.utc))
+    status = Column(String) # COMPLETED, SKIPPED, ERROR
+    total_ms = Column(Float)
+    upstream_calls = Column(Integer, default=0)
+    cache_hits = Column(Integer, default=0)
+    cache_misses = Column(Integer, default=0)
+    llm_tokens = Column(Integer, default=0)
+    stages_json = Column(String, default="{}") # {"regime": 812.4, "prices": 95.1, ...} in ms
+    counters_json = Column(String, default="{}")
+
+# --- Retention ---
+
+class DailyRollup(Base):
+    __tablename__ = "daily_rollups"
+    __table_args__ = (
+        UniqueConstraint("table_name", "day", "account", "category", "symbol", name="uq_daily_rollups_key"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    table_name = Column(String, index=True) # ai_notifications, ai_alerts, ai_recommendations, cycle_metrics
+    day = Column(Date, index=True) # PKT date of the rolled-up rows
+    account = Column(String, default="", nullable=False) # AI fund of the rows; "" for market-wide alerts
+    category = Column(String) # Notification type, alert signal or recommendation status
+    symbol = Column(String, default="") # "" for notifications
+    count = Column(Integer, default=0)
+    first_at = Column(DateTime, nullable=True)
+    last_at = Column(DateTime, nullable=True)
+    sample = Column(String, nullable=True) # Title/reason of the latest rolled-up row
+
+# --- Market Data History ---
+
+class Kline(Base):
+    __tablename__ = "klines"
+    __table_args__ = (
+        UniqueConstraint("symbol", "timeframe", "ts", name="uq_klines_symbol_timeframe_ts"),
+        Index("ix_klines_timeframe_ts", "timeframe", "ts"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    symbol = Column(String, index=True)
+    timeframe = Column(String) # 1d, 1h, ...
+    ts = Column(DateTime) # Candle open time, UTC
+    open = Column(Float)
+    high = Column(Float)
+    low = Column(Float)
+    close = Column(Float)
+    volume = Column(Float)
+
+
+
+def insert_ignore(session, model):
+    """INSERT ... ON CONFLICT DO NOTHING for the session's dialect (bulk, idempotent writes)."""
+    dialect = session.get_bind().dialect.name
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    elif dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        return insert(model).prefix_with("IGNORE") # MySQL
+    return dialect_insert(model).on_conflict_do_nothing()
 
+def upsert(session, model, keys: list, columns: list):
+    """INSERT ... ON CONFLICT (keys) DO UPDATE SET columns for the session's dialect (bulk, last write wins)."""
+    dialect = session.get_bind().dialect.name
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    elif dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.mysql import insert as mysql_insert
+        stmt = mysql_insert(model)
+        return stmt.on_duplicate_key_update(**{c: stmt.inserted[c] for c in columns})
+    stmt = dialect_insert(model)
+    return stmt.on_conflict_do_update(index_elements=keys, set_={c: stmt.excluded[c] for c in columns})
 
 def init_db():
     Base.metadata.create_all(bind=engine)
@@ -1,15 +1,30 @@
-from duckduckgo_search import DDGS
 from llm_agent import llm_agent
+from llm_gateway import llm_gateway, CALLER_CONCURRENCY
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeout
+from typing import Dict, List, Optional
 import json
+import contextvars
+from cycle_profiler import cycle_profiler
+from search_client import search_client, SearchThrottled
+
+NEWS_FETCH_CONCURRENCY = 4 # Parallel DuckDuckGo queries per fetch
+NEWS_QUERY_TIMEOUT = 10    # Seconds per query (HTTP + wait)
+NEWS_ANALYSIS_MIN_ARTICLES = 40 # Enough to start analysis without waiting for the slowest query
+NEWS_CHUNK_TOKENS = 3000   # Estimated input tokens of news per analyze_news LLM call
+# Chunks analyzed in parallel: the gateway's news_analysis cap, so every submitted chunk is really in flight.
+# One round trip covers up to ~12k tokens of news; beyond that later chunks wait for a free slot.
+NEWS_ANALYSIS_CONCURRENCY = CALLER_CONCURRENCY["news_analysis"]
+SENTIMENT_BATCH_SIZE = 10 # Symbols scored per batch sentiment LLM call
+IGNORED_SYMBOLS = {"KSE100", "KSE30", "KMI30", "PSX", "ALLSHR", "ALL SHARE"}
 
 class NewsAgent:
     def __init__(self):
-        self.ddgs = DDGS()
+        # Shared pool so an early return never waits for slow queries to finish
+        self.search_pool = ThreadPoolExecutor(max_workers=NEWS_FETCH_CONCURRENCY, thread_name_prefix="news-search")
+        self.analysis_pool = ThreadPoolExecutor(max_workers=NEWS_ANALYSIS_CONCURRENCY, thread_name_prefix="news-analysis")
 
-    def fetch_market_news(self, query="PSX Pakistan Stock Exchange market news"):
-        """Fetches latest news using multiple query variations for broader coverage."""
-        
+    def _build_queries(self, query: str) -> List[str]:
         # Generate query variations
         queries = [query]
         
@@ -26,24 +41,60 @@ class NewsAgent:
             base_q = query.replace(" stock news", "").replace(" Pakistan Stock Exchange", "")
             queries.append(f"{base_q} financial results report")
             queries.append(f"{base_q} company announcement Pakistan")
+        return queries
+
+    def _search_news(self, q: str, timeout: int, limit: int = 20) -> List[Dict]:
+        # Cached + rate-limited; use timelimit='w' (week) to ensure news is recent
+        return search_client.text(q, max_results=limit, timelimit="w", timeout=timeout)
 
+    def iter_market_news(self, query="PSX Pakistan Stock Exchange market news", timeout: int = NEWS_QUERY_TIMEOUT):
+        """
+        Runs all query variations concurrently and yields articles as each query returns,
+        de-duplicated by URL. Queries still running after `timeout` seconds are dropped.
+        """
+        queries = self._build_queries(query)
         print(f"[NEWS AGENT] running queries: {queries}")
-        
-        all_results = []
-        seen_urls = set()
-        
+
+        futures = {}
         for q in queries:
-            try:
-                # Fetch fewer results per query to avoid rate limits/noise, but aggregate them
-                # Use timelimit='w' (week) to ensure news is recent
-                results = self.ddgs.text(q, max_results=20, timelimit="w") 
-                if results:
-                    for res in results:
-                        if res.get('href') not in seen_urls:
-                            all_results.append(res)
-                            seen_urls.add(res.get('href'))
-            except Exception as e:
-                print(f"Error fetching news for '{q}': {e}")
+            futures[self.search_pool.submit(contextvars.copy_context().run, self._search_news, q, timeout)] = q
+
+        seen_urls = set()
+        try:
+            for future in as_completed(futures, timeout=timeout):
+                q = futures[future]
+                try:
+                    results = future.result()
+                except SearchThrottled as e:
+                    print(f"[NEWS AGENT] Throttled fetching news for '{q}': {e}")
+                    continue
+                except Exception as e:
+                    print(f"Error fetching news for '{q}': {e}")
+                    continue
+                for res in results:
+                    if res.get('href') not in seen_urls:
+                        seen_urls.add(res.get('href'))
+                        yield res
+        except FuturesTimeout:
+            slow = [q for f, q in futures.items() if not f.done()]
+            print(f"[NEWS AGENT] Timed out after {timeout}s waiting for: {slow}")
+        finally:
+            for future in futures:
+                future.cancel() # Only affects queries that have not started yet
+
+    def fetch_market_news(self, query="PSX Pakistan Stock Exchange market news", min_articles: Optional[int] = None,
+                          timeout: int = NEWS_QUERY_TIMEOUT):
+        """
+        Fetches latest news using multiple query variations for broader coverage.
+        Queries run in parallel; with `min_articles` set, returns as soon as that many
+        unique articles have arrived instead of waiting for the slowest query.
+        """
+        all_results = []
+        for article in self.iter_market_news(query, timeout):
+            all_results.append(article)
+            if min_articles and len(all_results) >= min_articles:
+                print(f"[NEWS AGENT] Got {len(all_results)} articles; not waiting for remaining queries.")
+                break
                 
         return all_results
 
@@ -51,18 +102,68 @@ class NewsAgent:
         """Perform a direct web search for specific user queries."""
         try:
             print(f"[NEWS AGENT] Searching web for: {query}")
-            results = self.ddgs.text(query, max_results=limit, timelimit="w")
-            return results if results else []
+            return self._search_news(query, NEWS_QUERY_TIMEOUT, limit)
+        except SearchThrottled as e:
+            print(f"[NEWS AGENT] Web search throttled: {e}")
+            return []
         except Exception as e:
             print(f"Error searching web: {e}")
             return []
 
     def analyze_news(self, news_items):
-        """Uses LLM to analyze news and generate trade signals."""
+        """
+        Uses LLM to analyze news and generate trade signals (map-reduce).
+        Map: articles are split into token-budgeted chunks analyzed concurrently.
+        Reduce: per-symbol alerts from all chunks are merged and de-duplicated.
+        Returns (alerts, analyzed_items): articles of chunks whose LLM call failed are left out
+        of analyzed_items, so the caller can keep them for a retry.
+        """
         if not news_items:
-            return []
+            return [], []
+
+        if not llm_agent.client:
+            print("Warning: No LLM client available.")
+            return [], []
+
+        chunks = self._chunk_articles(news_items)
+        print(f"[NEWS AGENT] Analyzing {len(news_items)} articles in {len(chunks)} chunk(s).")
+
+        if len(chunks) == 1:
+            results = [self._analyze_chunk(chunks[0])]
+        else:
+            # copy_context per task so profiler counters from worker threads land in the current cycle
+            futures = [
+                self.analysis_pool.submit(contextvars.copy_context().run, self._analyze_chunk, chunk)
+                for chunk in chunks
+            ]
+            results = [f.result() for f in futures]
+
+        analyzed = [item for chunk, alerts in zip(chunks, results) if alerts is not None for item in chunk]
+        failed = sum(1 for alerts in results if alerts is None)
+        if failed:
+            print(f"[NEWS AGENT] {failed}/{len(chunks)} chunk(s) failed; their articles stay unanalyzed.")
+        return self._reduce_alerts(results), analyzed
+
+    def _chunk_articles(self, news_items, max_tokens: int = NEWS_CHUNK_TOKENS) -> List[List[Dict]]:
+        """Greedy packing by estimated tokens (~4 chars/token). An oversized article gets its own chunk."""
+        chunks, current, current_tokens = [], [], 0
+        for item in news_items:
+            tokens = len(self._format_article(item)) // 4 + 1
+            if current and current_tokens + tokens > max_tokens:
+                chunks.append(current)
+                current, current_tokens = [], 0
+            current.append(item)
+            current_tokens += tokens
+        if current:
+            chunks.append(current)
+        return chunks
+
+    def _format_article(self, item) -> str:
+        return f"- {item.get('title', '')}: {item.get('body', '')} ({item.get('href', '')})"
 
-        news_text = "\n".join([f"- {item['title']}: {item['body']} ({item['href']})" for item in news_items])
+    def _analyze_chunk(self, news_items) -> Optional[List[Dict]]:
+        """Alerts for one chunk; None if the LLM call or its JSON failed."""
+        news_text = "\n".join([self._format_article(item) for item in news_items])
         
         prompt = f"""
         You are an expert financial analyst for the Pakistan Stock Exchange (PSX).
@@ -90,10 +191,6 @@ class NewsAgent:
         }}
         If no actionable insights for specific companies, return {{"alerts": []}}.
         """
-        
-        if not llm_agent.client:
-            print("Warning: No LLM client available.")
-            return []
 
         messages = [
             {"role": "system", "content": "You are a financial news analyst. Return a JSON list of alerts."},
@@ -101,17 +198,42 @@ class NewsAgent:
         ]
         
         try:
-            response = llm_agent.client.chat.completions.create(
+            content = llm_gateway.chat(
+                messages,
+                call_type="news_analysis",
                 model="gpt-4o",
-                messages=messages,
                 response_format={"type": "json_object"}
             )
-            content = response.choices[0].message.content
             data = json.loads(content)
             return data.get("alerts", [])
         except Exception as e:
             print(f"Error analyzing news: {e}")
-            return []
+            return None
+
+    def _reduce_alerts(self, chunk_alerts: List[List[Dict]]) -> List[Dict]:
+        """
+        Merges alerts from all chunks: one alert per symbol, using the most frequent signal
+        (first seen wins ties). Index "symbols" the LLM sometimes returns anyway are dropped.
+        """
+        by_symbol: Dict[str, List[Dict]] = {}
+        for alerts in chunk_alerts:
+            for alert in alerts or []:
+                symbol = str(alert.get("symbol") or "").upper().strip()
+                if not symbol or symbol.replace("-", "") in IGNORED_SYMBOLS:
+                    continue
+                by_symbol.setdefault(symbol, []).append({**alert, "symbol": symbol})
+
+        merged = []
+        for symbol, alerts in by_symbol.items():
+            signals = [str(a.get("signal") or "HOLD").upper() for a in alerts]
+            signal = max(dict.fromkeys(signals), key=signals.count)
+            supporting = [a for a, sig in zip(alerts, signals) if sig == signal]
+
+            alert = {**supporting[0], "signal": signal}
+            if len(supporting) > 1:
+                alert["reason"] = f"{alert.get('reason', '')} (+{len(supporting) - 1} related reports)"
+            merged.append(alert)
+        return merged
 
     def get_sentiment_score(self, query: str) -> dict:
         """
@@ -121,14 +243,25 @@ class NewsAgent:
         print(f"[NEWS AGENT] Analyzing sentiment for: {query}")
         
         # 1. Fetch News
-        results = self.search_web(f"{query} Pakistan Stock Exchange news", limit=5)
+        try:
+            results = self._search_news(f"{query} Pakistan Stock Exchange news", NEWS_QUERY_TIMEOUT, limit=5)
+        except SearchThrottled:
+            # Not the same as "no news": the score is unknown, not neutral-because-quiet
+            print(f"[NEWS AGENT] Search throttled for {query}")
+            return {"score": 0.0, "summary": "News search throttled; sentiment unknown."}
+        except Exception as e:
+            print(f"Error searching web: {e}")
+            results = []
         if not results:
             print(f"[NEWS AGENT] No news found for {query}")
             return {"score": 0.0, "summary": "No recent news found."}
-            
+
+        # 2. Analyze with LLM
+        return self._score_articles(query, results)
+
+    def _score_articles(self, query: str, results: List[Dict]) -> dict:
         news_text = "\n".join([f"- {item['title']} ({item['body']})" for item in results])
         
-        # 2. Analyze with LLM
         prompt = f"""
         Analyze the sentiment of the following news regarding '{query}' in the context of the Pakistan Stock Exchange.
         
@@ -149,12 +282,13 @@ class NewsAgent:
         try:
             if not llm_agent.client: return {"score": 0.0, "summary": "LLM invalid"}
             
-            response = llm_agent.client.chat.completions.create(
+            content = llm_gateway.chat(
+                messages,
+                call_type="sentiment",
                 model="gpt-4o",
-                messages=messages,
                 response_format={"type": "json_object"}
             )
-            data = json.loads(response.choices[0].message.content)
+            data = json.loads(content)
             score = float(data.get("score", 0.0))
             summary = data.get("summary", "Neutral")
             
@@ -165,4 +299,119 @@ class NewsAgent:
             print(f"Error in sentiment analysis: {e}")
             return {"score": 0.0, "summary": "Error analyzing news"}
 
+    def fetch_symbol_news(self, symbols: List[str], limit: int = 5, timeout: int = NEWS_QUERY_TIMEOUT) -> Dict[str, List[Dict]]:
+        """Searches news for many symbols concurrently. Symbols whose search fails or times out get []."""
+        futures = {}
+        for symbol in symbols:
+            query = f"{symbol} stock financial news Pakistan Stock Exchange news"
+            futures[self.search_pool.submit(contextvars.copy_context().run, self._search_news, query, timeout, limit)] = symbol
+
+        articles = {symbol: [] for symbol in symbols}
+        try:
+            for future in as_completed(futures, timeout=timeout):
+                try:
+                    articles[futures[future]] = future.result()
+                except SearchThrottled as e:
+                    print(f"[NEWS AGENT] Throttled fetching news for {futures[future]}: {e}")
+                except Exception as e:
+                    print(f"Error fetching news for {futures[future]}: {e}")
+        except FuturesTimeout:
+            print(f"[NEWS AGENT] Symbol news timed out for: {[s for f, s in futures.items() if not f.done()]}")
+        return articles
+
+    def get_batch_sentiment(self, symbol_articles: Dict[str, List[Dict]],
+                            batch_size: int = SENTIMENT_BATCH_SIZE) -> Dict[str, dict]:
+        """
+        Scores many symbols with one LLM call per `batch_size` symbols (shared instructions, one round trip).
+        Returns {symbol: {"score", "summary"}}. Symbols missing or malformed in the batch answer
+        fall back to an individual call; symbols without articles are neutral without any call.
+        """
+        scores = {}
+        to_score = {}
+        for symbol, articles in symbol_articles.items():
+            if articles:
+                to_score[symbol] = articles
+            else:
+                scores[symbol] = {"score": 0.0, "summary": "No recent news found."}
+
+        if not to_score:
+            return scores
+        if not llm_agent.client:
+            scores.update({symbol: {"score": 0.0, "summary": "LLM invalid"} for symbol in to_score})
+            return scores
+
+        symbols = list(to_score)
+        batches = [symbols[i:i + batch_size] for i in range(0, len(symbols), batch_size)]
+        futures = [
+            self.analysis_pool.submit(contextvars.copy_context().run, self._score_batch, {s: to_score[s] for s in batch})
+            for batch in batches
+        ]
+        for future in futures:
+            scores.update(future.result())
+
+        # Per-symbol fallback for anything the batch answer did not cover validly
+        for symbol in symbols:
+            if symbol not in scores:
+                print(f"[NEWS AGENT] Batch sentiment missing/invalid for {symbol}; scoring individually.")
+                cycle_profiler.count("sentiment_fallbacks")
+                scores[symbol] = self._score_articles(f"{symbol} stock financial news", to_score[symbol])
+        return scores
+
+    def _score_batch(self, symbol_articles: Dict[str, List[Dict]]) -> Dict[str, dict]:
+        """One LLM call for several symbols. Returns only entries that pass validation."""
+        sections = []
+        for symbol, articles in symbol_articles.items():
+            news_text = "\n".join([f"  - {item.get('title', '')} ({item.get('body', '')})" for item in articles])
+            sections.append(f"[{symbol}]\n{news_text}")
+        news_block = "\n\n".join(sections)
+
+        prompt = f"""
+        Analyze the sentiment of the news for each of the following Pakistan Stock Exchange symbols.
+        News for each symbol is listed under its [SYMBOL] header.
+        
+        {news_block}
+        
+        For EACH symbol, determine a "Sentiment Score" from -1.0 (Very Negative/Bearish) to +1.0 (Very Positive/Bullish). 0.0 is Neutral.
+        Also provide a 1-sentence summary of WHY.
+        
+        Return JSON: {{"scores": {{"SYMBOL": {{"score": float, "summary": "string"}}}}}}
+        Include every symbol exactly as written in its header.
+        """
+
+        messages = [
+            {"role": "system", "content": "You are a financial sentiment analyzer. Return JSON only."},
+            {"role": "user", "content": prompt}
+        ]
+
+        try:
+            content = llm_gateway.chat(
+                messages,
+                call_type="sentiment",
+                model="gpt-4o",
+                response_format={"type": "json_object"}
+            )
+            data = json.loads(content).get("scores", {})
+        except Exception as e:
+            print(f"Error in batch sentiment analysis: {e}")
+            return {}
+
+        valid = {}
+        for symbol in symbol_articles:
+            entry = data.get(symbol) if isinstance(data, dict) else None
+            if not isinstance(entry, dict):
+                continue
+            try:
+                score = float(entry.get("score"))
+            except (TypeError, ValueError):
+                continue
+            if score != score: # NaN
+                continue
+            summary = entry.get("summary")
+            valid[symbol] = {
+                "score": max(-1.0, min(1.0, score)),
+                "summary": summary if isinstance(summary, str) and summary else "Neutral"
+            }
+            print(f"[NEWS AGENT] {symbol} -> Score: {valid[symbol]['score']} ({valid[symbol]['summary']})")
+        return valid
+
 news_agent = NewsAgent()
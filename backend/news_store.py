@@ -0,0 +1,219 @@
+import re
+import hashlib
+import pytz
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from sqlalchemy.orm import Session
+
+from models import NewsArticle, AIAlert, insert_ignore
+from market_calendar import PKT
+
+SIMHASH_BITS = 64
+NEAR_DUPLICATE_DISTANCE = 3  # Max differing bits for two articles to count as the same story
+CLUSTER_WINDOW_DAYS = 7      # News is fetched with timelimit='w', so older clusters can't recur
+BANDS = 4                    # 4 x 16-bit bands: distance <= 3 guarantees at least one equal band
+
+_TRACKING_PARAMS = ("utm_", "fbclid", "gclid", "ref", "cmpid")
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def normalize_url(url: str) -> str:
+    """Drops scheme/host case, fragments, tracking params and trailing slashes so syndicated links match."""
+    parts = urlsplit((url or "").strip())
+    query = [(k, v) for k, v in parse_qsl(parts.query) if not k.lower().startswith(_TRACKING_PARAMS)]
+    path = parts.path.rstrip("/") or "/"
+    return urlunsplit(("https", parts.netloc.lower().removeprefix("www."), path, urlencode(sorted(query)), ""))
+
+
+def url_hash(url: str) -> str:
+    return hashlib.sha1(normalize_url(url).encode("utf-8")).hexdigest()
+
+
+def alert_dedup_key(symbol: Optional[str], signal: Optional[str], url: Optional[str], trading_day: date) -> str:
+    """Same symbol + signal from the same story on the same trading day is one alert."""
+    parts = [
+        (symbol or "").strip().upper(),
+        (signal or "").strip().upper(),
+        normalize_url(url) if url else "",
+        trading_day.isoformat()
+    ]
+    return hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()
+
+
+def simhash(text: str) -> int:
+    """64-bit SimHash over word unigrams and bigrams of the lower-cased text."""
+    tokens = _TOKEN_RE.findall((text or "").lower())
+    features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+    if not features:
+        return 0
+
+    weights = [0] * SIMHASH_BITS
+    for feature in features:
+        h = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "big")
+        for bit in range(SIMHASH_BITS):
+            weights[bit] += 1 if (h >> bit) & 1 else -1
+
+    value = 0
+    for bit in range(SIMHASH_BITS):
+        if weights[bit] > 0:
+            value |= 1 << bit
+    return value
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def _bands(value: int) -> List[tuple]:
+    width = SIMHASH_BITS // BANDS
+    mask = (1 << width) - 1
+    return [(i, (value >> (i * width)) & mask) for i in range(BANDS)]
+
+
+class NewsStore:
+    """
+    Persistent article store. Every fetched article is recorded once (keyed by URL hash),
+    and grouped into story clusters by SimHash of title + body, so only stories that have
+    never been seen before are sent to the LLM.
+    """
+
+    def ingest(self, db: Session, articles: List[Dict]) -> List[Dict]:
+        """
+        Stores new articles and returns those that should be analyzed:
+        heads of genuinely new story clusters, plus any earlier heads left unanalyzed.
+        """
+        now = datetime.now(pytz.utc)
+        since = now - timedelta(days=CLUSTER_WINDOW_DAYS)
+        self.prune(db, since)
+
+        # 1. Exact URL dedup against the store (one query)
+        by_hash = {}
+        for article in articles:
+            if article.get("href"):
+                by_hash.setdefault(url_hash(article["href"]), article)
+        known = {
+            h for (h,) in db.query(NewsArticle.url_hash).filter(NewsArticle.url_hash.in_(list(by_hash))).all()
+        } if by_hash else set()
+
+        # 2. Band index over recent cluster heads for near-duplicate lookup
+        heads = db.query(NewsArticle.url_hash, NewsArticle.simhash).filter(
+            NewsArticle.cluster_id == NewsArticle.url_hash,
+            NewsArticle.first_seen >= since
+        ).all()
+        index: Dict[tuple, List[tuple]] = {}
+        for head_hash, head_simhash in heads:
+            value = int(head_simhash, 16)
+            for band in _bands(value):
+                index.setdefault(band, []).append((head_hash, value))
+
+        fresh = []
+        duplicates = 0
+        for h, article in by_hash.items():
+            if h in known:
+                continue
+            value = simhash(f"{article.get('title', '')} {article.get('body', '')}")
+
+            cluster_id = None
+            for band in _bands(value):
+                for head_hash, head_value in index.get(band, []):
+                    if hamming(value, head_value) <= NEAR_DUPLICATE_DISTANCE:
+                        cluster_id = head_hash
+                        break
+                if cluster_id:
+                    break
+
+            if cluster_id is None:
+                # New story: becomes its own cluster head and is visible to later articles in this batch
+                cluster_id = h
+                for band in _bands(value):
+                    index.setdefault(band, []).append((h, value))
+                fresh.append(article)
+            else:
+                duplicates += 1
+
+            db.add(NewsArticle(
+                url_hash=h,
+                url=article.get("href"),
+                title=article.get("title"),
+                body=article.get("body"),
+                simhash=f"{value:016x}",
+                cluster_id=cluster_id,
+                first_seen=now
+            ))
+
+        # 3. Heads stored by an earlier run that never got analyzed (e.g. the LLM call crashed)
+        fresh_hashes = {url_hash(a["href"]) for a in fresh}
+        pending = db.query(NewsArticle).filter(
+            NewsArticle.cluster_id == NewsArticle.url_hash,
+            NewsArticle.analyzed_at.is_(None),
+            NewsArticle.first_seen >= now - timedelta(days=1)
+        ).all()
+        for row in pending:
+            if row.url_hash not in fresh_hashes:
+                fresh.append({"title": row.title, "body": row.body, "href": row.url})
+
+        db.commit()
+        print(f"[NEWS STORE] {len(articles)} fetched, {len(known)} already seen, "
+              f"{duplicates} near-duplicates, {len(fresh)} new stories to analyze.")
+        return fresh
+
+    def prune(self, db: Session, before: datetime) -> int:
+        """
+        Deletes articles first seen before `before`. Past the SimHash window they can no longer
+        match a new story (and searches only go back a week), so they would only grow the table.
+        Caller commits.
+        """
+        removed = db.query(NewsArticle).filter(NewsArticle.first_seen < before).delete(synchronize_session=False)
+        if removed:
+            print(f"[NEWS STORE] Pruned {removed} articles older than {CLUSTER_WINDOW_DAYS} days")
+        return removed
+
+    def mark_analyzed(self, db: Session, articles: List[Dict]):
+        """Marks cluster heads as analyzed. Caller commits (together with the generated alerts)."""
+        hashes = [url_hash(a["href"]) for a in articles if a.get("href")]
+        if not hashes:
+            return
+        db.query(NewsArticle).filter(NewsArticle.url_hash.in_(hashes)).update(
+            {NewsArticle.analyzed_at: datetime.now(pytz.utc)}, synchronize_session=False
+        )
+
+
+    def save_alerts(self, db: Session, alerts: List[Dict], now: Optional[datetime] = None) -> int:
+        """
+        Bulk insert-or-ignore of LLM alerts keyed by (symbol, signal, url, trading day).
+        Re-running analysis over the same stories adds nothing. Caller commits. Returns rows inserted.
+        """
+        now = now or datetime.now(PKT)
+        trading_day = now.astimezone(PKT).date()
+
+        rows = {}
+        for alert in alerts:
+            if not alert.get("symbol"):
+                continue
+            key = alert_dedup_key(alert.get("symbol"), alert.get("signal"), alert.get("url"), trading_day)
+            rows.setdefault(key, {
+                "symbol": alert.get("symbol"),
+                "signal": alert.get("signal"),
+                "reason": alert.get("reason"),
+                "url": alert.get("url"),
+                "timestamp": datetime.now(),
+                "is_read": False,
+                "trading_day": trading_day,
+                "dedup_key": key
+            })
+        if not rows:
+            return 0
+
+        # Keys already stored, only for reporting; the unique index is what enforces dedup under races
+        existing = {
+            k for (k,) in db.query(AIAlert.dedup_key).filter(AIAlert.dedup_key.in_(list(rows))).all()
+        }
+        stmt = insert_ignore(db, AIAlert)
+        db.execute(stmt, list(rows.values()))
+        inserted = len(rows) - len(existing)
+        print(f"[NEWS STORE] {len(alerts)} alerts, {inserted} new, {len(alerts) - inserted} duplicates ignored.")
+        return inserted
+
+
+news_store = NewsStore()
@@ -0,0 +1,162 @@
+import os
+import time
+import random
+import hashlib
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+
+import pytz
+
+# Simulated upstream latency, so benchmarks see realistic waits without network access
+MARKET_OFFLINE_LATENCY_MS = int(os.getenv("MARKET_OFFLINE_LATENCY_MS", "0"))
+SEARCH_OFFLINE_LATENCY_MS = int(os.getenv("SEARCH_OFFLINE_LATENCY_MS", "0"))
+OFFLINE_BOARD_SIZE = int(os.getenv("OFFLINE_BOARD_SIZE", "500")) # Symbols listed on the stand-in REG board
+OFFLINE_KLINE_DAYS = 300
+
+OFFLINE_SECTORS = ["Banks", "Cement", "Fertilizer", "Oil & Gas Exploration", "Power", "Technology", "Textile", "Automobile"]
+_WORDS = ("profit results dividend board meeting expansion quarter revenue margin growth plant capacity export order "
+          "rupee inflation rate policy budget tax demand supply earnings outlook guidance contract approval merger "
+          "shares index investors record decline surge pressure recovery").split()
+
+_epoch = 0 # Bumped by advance(): the next market tick / news cycle
+
+
+def _seed(*parts) -> int:
+    return int.from_bytes(hashlib.sha256("\x00".join(str(p) for p in parts).encode("utf-8")).digest()[:8], "big")
+
+
+def advance():
+    """Moves the stand-ins to the next cycle: prices tick, and searches return a fresh set of stories."""
+    global _epoch
+    _epoch += 1
+
+
+def offline_symbols(n: int = OFFLINE_BOARD_SIZE) -> List[str]:
+    """Letter-only tickers ("QAAA", "QAAB", ...), so the offline LLM picks them out of news text."""
+    letters = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+    return ["Q" + letters[i // 676 % 26] + letters[i // 26 % 26] + letters[i % 26] for i in range(n)]
+
+
+def offline_sector(symbol: str) -> str:
+    return OFFLINE_SECTORS[_seed(symbol, "sector") % len(OFFLINE_SECTORS)]
+
+
+def offline_price(symbol: str, epoch: Optional[int] = None) -> float:
+    base = 20 + _seed(symbol) % 480
+    move = (_seed(symbol, "tick", _epoch if epoch is None else epoch) % 401 - 200) / 10000 # +-2%
+    return round(base * (1 + move), 2)
+
+
+class OfflineResponse:
+    def __init__(self, payload: Optional[Dict], status_code: int = 200):
+        self.status_code = status_code
+        self._payload = payload
+
+    def json(self):
+        return self._payload
+
+
+class OfflineMarketHTTP:
+    """
+    Stand-in for `requests` against psxterminal.com (only `get` is used). Serves the board,
+    single ticks, stats, klines and company pages from deterministic synthetic data in the
+    API's own response shape, so market_data's parsing runs unchanged.
+    """
+
+    def __init__(self, board_size: int = OFFLINE_BOARD_SIZE):
+        self.board = offline_symbols(board_size)
+
+    def get(self, url: str, headers: Optional[Dict] = None, timeout: Optional[float] = None) -> OfflineResponse:
+        if MARKET_OFFLINE_LATENCY_MS:
+            time.sleep(MARKET_OFFLINE_LATENCY_MS / 1000)
+        parts = urlparse(url).path.split("/api/", 1)[-1].strip("/").split("/")
+
+        if parts[:2] == ["ticks", "REG"]:
+            if len(parts) == 2:
+                return OfflineResponse({"success": True, "data": [self._tick(s) for s in self.board]})
+            return OfflineResponse({"success": True, "data": self._tick(parts[2])})
+        if parts[:2] == ["stats", "REG"]:
+            return OfflineResponse({"success": True, "data": self._stats()})
+        if parts[0] == "klines" and len(parts) == 3:
+            return OfflineResponse({"success": True, "data": self._klines(parts[1])})
+        if parts[0] == "companies" and len(parts) == 2:
+            return OfflineResponse({"success": True, "data": self._company(parts[1])})
+        return OfflineResponse({"success": False}, 404)
+
+    def _tick(self, symbol: str) -> Dict:
+        price = offline_price(symbol)
+        previous = offline_price(symbol, _epoch - 1)
+        return {
+            "symbol": symbol,
+            "price": price,
+            "changePercent": round((price - previous) / previous * 100, 2) if previous else 0.0,
+            "volume": 1000 * (_seed(symbol, "volume") % 5000)
+        }
+
+    def _stats(self) -> Dict:
+        ticks = sorted((self._tick(s) for s in self.board), key=lambda t: t["changePercent"])
+        return {
+            "totalVolume": sum(t["volume"] for t in ticks),
+            "totalValue": round(sum(t["volume"] * t["price"] for t in ticks), 2),
+            "gainers": sum(1 for t in ticks if t["changePercent"] > 0),
+            "losers": sum(1 for t in ticks if t["changePercent"] < 0),
+            "topGainers": ticks[::-1][:5],
+            "topLosers": ticks[:5]
+        }
+
+    def _klines(self, symbol: str) -> List[Dict]:
+        """Daily candles ending yesterday (UTC): a random walk with a board-wide factor, so returns correlate."""
+        rng = random.Random(_seed(symbol, "klines"))
+        market = random.Random(_seed("market", "klines"))
+        close = offline_price(symbol, 0)
+        end = datetime.now(pytz.utc).replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=1)
+        candles = []
+        for day in range(OFFLINE_KLINE_DAYS, 0, -1):
+            ret = 0.6 * market.gauss(0, 0.01) + rng.gauss(0.0003, 0.015)
+            open_ = close
+            close = max(1.0, round(close * (1 + ret), 2))
+            candles.append({
+                "timestamp": int((end - timedelta(days=day - 1)).timestamp() * 1000),
+                "open": open_, "high": max(open_, close), "low": min(open_, close), "close": close,
+                "volume": 1000 * (rng.randrange(100, 5000))
+            })
+        return candles
+
+    def _company(self, symbol: str) -> Dict:
+        seed = _seed(symbol, "company")
+        return {
+            "symbol": symbol,
+            "name": f"{symbol} Industries Limited",
+            "sector": offline_sector(symbol),
+            "peRatio": round(3 + seed % 200 / 10, 1),
+            "eps": round(1 + seed % 500 / 10, 2),
+            "dividendYield": round(seed % 150 / 10, 1),
+            "marketCap": 1e9 * (1 + seed % 300)
+        }
+
+
+class OfflineSearch:
+    """
+    Stand-in for DuckDuckGo text search: `max_results` articles per query in DDGS's shape
+    ({"title", "href", "body"}). Stories mention board tickers and change on every advance().
+    """
+
+    def __init__(self, board_size: int = OFFLINE_BOARD_SIZE):
+        self.board = offline_symbols(board_size)
+
+    def text(self, query: str, max_results: int = 10, timelimit: Optional[str] = None) -> List[Dict]:
+        if SEARCH_OFFLINE_LATENCY_MS:
+            time.sleep(SEARCH_OFFLINE_LATENCY_MS / 1000)
+        mentioned = [w for w in query.upper().split() if w in self.board]
+        results = []
+        for i in range(max_results):
+            rng = random.Random(_seed(query, _epoch, i))
+            symbol = mentioned[0] if mentioned else rng.choice(self.board)
+            words = " ".join(rng.choice(_WORDS) for _ in range(40))
+            results.append({
+                "title": f"{symbol} {' '.join(rng.choice(_WORDS) for _ in range(6))}",
+                "href": f"https://news.offline/{_epoch}/{_seed(query, i) % 10**8}",
+                "body": f"{symbol} {words}"
+            })
+        return results
@@ -1,5 +1,6 @@
 from sqlalchemy.orm import Session
-from models import PortfolioItem, UserSettings
+from models import PortfolioItem
+from accounts import accounts
 from market_data import market_data
 
 class PortfolioEngine:
@@ -8,12 +9,8 @@ class PortfolioEngine:
 
     def get_portfolio_summary(self):
         items = self.db.query(PortfolioItem).all()
-        settings = self.db.query(UserSettings).first()
-        
-        if not settings:
-            settings = UserSettings()
-            self.db.add(settings)
-            self.db.commit()
+        # Manual portfolio cash lives on the default account's settings row
+        settings = accounts.settings(self.db)
 
         total_value = settings.cash_balance
         holdings_value = 0.0
@@ -50,6 +47,9 @@ class PortfolioEngine:
             }
         }
 
-    def check_risk_exposure(self):
-        # Implement risk checks (e.g., sector allocation, single stock concentration)
-        pass
+    def check_risk_exposure(self, confidence: float = 0.95, horizon_days: int = 1):
+        """VaR, volatility and marginal contributions of the manual portfolio, plus stock/sector limit breaches."""
+        from risk_analytics import risk_analytics
+        items = self.db.query(PortfolioItem).all()
+        settings = accounts.settings(self.db)
+        return risk_analytics.exposure_report(self.db, items, settings.cash_balance, confidence, horizon_days)
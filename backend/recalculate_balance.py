@@ -1,60 +1,59 @@
+import sys
 from sqlalchemy.orm import Session
-from models import UserSettings, AITradeHistory, SessionLocal, init_db
+from models import SessionLocal, init_db, DEFAULT_ACCOUNT
+from ledger import cash_ledger
+from accounts import accounts
 
-def recalculate_ai_balance():
+def recalculate_ai_balance(full: bool = False, account: str = DEFAULT_ACCOUNT):
+    """
+    Rebuilds ai_cash_balance from the trade ledger.
+    Replays only the events after the latest checkpoint unless `full` (use after editing old history).
+    """
     db: Session = SessionLocal()
     try:
-        # Get Settings
-        settings = db.query(UserSettings).first()
+        # Get Settings (the default account is created if missing)
+        settings = accounts.settings(db, account)
         if not settings:
-            print("No UserSettings found. Creating default...")
-            settings = UserSettings()
-            db.add(settings)
-            db.commit()
-            db.refresh(settings)
+            print(f"Account '{account}' not found.")
+            return
         
-        initial_capital = settings.initial_ai_capital
-        print(f"Initial Capital: {initial_capital}")
-        
-        # Get all trades
-        trades = db.query(AITradeHistory).all()
-        
-        calculated_balance = initial_capital
+        checkpoint = None if full else cash_ledger.latest_checkpoint(db, account=account)
+        if checkpoint:
+            print(f"Starting from checkpoint at ledger id {checkpoint.ledger_id}: Cash {checkpoint.cash:.2f}")
+        else:
+            print(f"Initial Capital: {settings.initial_ai_capital}")
         
-        print("\n--- Trade History ---")
-        for trade in trades:
-            total_value = trade.quantity * trade.price
-            if trade.action == "BUY":
-                calculated_balance -= total_value
-                print(f"BUY  {trade.quantity} {trade.symbol} @ {trade.price:.2f} | -{total_value:.2f}")
-            elif trade.action == "SELL":
-                calculated_balance += total_value
-                print(f"SELL {trade.quantity} {trade.symbol} @ {trade.price:.2f} | +{total_value:.2f}")
-            elif trade.action == "DEPOSIT":
-                calculated_balance += trade.price # Using price field for amount
-                print(f"DEPOSIT | +{trade.price:.2f}")
-            elif trade.action == "WITHDRAW":
-                calculated_balance -= trade.price
-                print(f"WITHDRAW | -{trade.price:.2f}")
-                
-        print("---------------------")
+        state = cash_ledger.replay(db, full=full, account=account)
+        audit = cash_ledger.audit(db, account=account, state=state)
+        calculated_balance = audit["cash"]
         
-        print(f"\nCurrent DB Balance: {settings.ai_cash_balance:.2f}")
+        print(f"\nReplayed {audit['events_replayed']} ledger events (up to id {audit['ledger_id']}).")
+        print(f"Current DB Balance: {settings.ai_cash_balance:.2f}")
         print(f"Calculated Balance: {calculated_balance:.2f}")
+        print(f"Realized PnL: {audit['realized_pnl']:.2f}")
+        
+        for symbol, drift in audit["position_drift"].items():
+            print(f"Position drift {symbol}: ledger {drift['ledger']} vs stored {drift['stored']}")
         
         # Update DB
-        if abs(settings.ai_cash_balance - calculated_balance) > 0.01:
+        if abs(audit["cash_drift"]) > 0.01:
             print("\nUpdating database with calculated balance...")
             settings.ai_cash_balance = calculated_balance
-            db.commit()
             print("Database updated successfully.")
         else:
             print("\nBalance is already correct.")
+        
+        # Next audit starts from the state the balance was just fixed from
+        if cash_ledger.checkpoint(db, state, account):
+            print(f"Checkpoint stored at ledger id {state.ledger_id}.")
+        db.commit()
             
     except Exception as e:
         print(f"Error: {e}")
+        db.rollback()
     finally:
         db.close()
 
 if __name__ == "__main__":
-    recalculate_ai_balance()
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    recalculate_ai_balance(full="--full" in sys.argv, account=args[0] if args else DEFAULT_ACCOUNT)
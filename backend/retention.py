@@ -0,0 +1,218 @@
+import os
+import time
+import pytz
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from models import SessionLocal, AINotification, AIAlert, AIRecommendation, CycleMetric, DailyRollup
+from market_calendar import PKT
+
+RETENTION_BATCH_ROWS = 500    # Rows rolled up and deleted per transaction
+RETENTION_BATCH_PAUSE = 0.05  # Seconds between batches so readers (and SQLite's single writer) get a turn
+
+# Rows older than `days` are rolled up into daily_rollups and deleted; `max_rows` bounds the hot table
+# regardless of age (per AI fund where the table has an `account` column). `timestamp` is the row's
+# time column; `category`/`symbol`/`sample` name the columns kept in the summary.
+RETENTION_POLICIES = {
+    "ai_notifications": {
+        "model": AINotification,
+        "days": int(os.getenv("RETENTION_NOTIFICATIONS_DAYS", "30")),
+        "max_rows": int(os.getenv("RETENTION_NOTIFICATIONS_MAX_ROWS", "5000")),
+        "timestamp": "timestamp", "account": "account", "category": "type", "symbol": None, "sample": "title",
+    },
+    "ai_alerts": {
+        "model": AIAlert,
+        "days": int(os.getenv("RETENTION_ALERTS_DAYS", "30")),
+        "max_rows": int(os.getenv("RETENTION_ALERTS_MAX_ROWS", "5000")),
+        "timestamp": "timestamp", "account": None, "category": "signal", "symbol": "symbol", "sample": "reason",
+    },
+    "ai_recommendations": {
+        # Only resolved recommendations; PENDING ones wait for the user however old they are
+        "model": AIRecommendation,
+        "days": int(os.getenv("RETENTION_RECOMMENDATIONS_DAYS", "14")),
+        "max_rows": int(os.getenv("RETENTION_RECOMMENDATIONS_MAX_ROWS", "2000")),
+        "timestamp": "timestamp", "account": "account", "category": "status", "symbol": "symbol", "sample": "reason",
+        "keep": lambda model: model.status == "PENDING",
+    },
+    "cycle_metrics": {
+        # One row per account per polling interval; /autonomous/cycle-metrics reads the last day or so
+        "model": CycleMetric,
+        "days": int(os.getenv("RETENTION_CYCLE_METRICS_DAYS", "14")),
+        "max_rows": int(os.getenv("RETENTION_CYCLE_METRICS_MAX_ROWS", "20000")),
+        "timestamp": "started_at", "account": "account", "category": "status", "symbol": None, "sample": "name",
+    },
+}
+
+
+def _pkt_day(value: Optional[datetime]):
+    if value is None:
+        return datetime.now(PKT).date()
+    aware = value if value.tzinfo else pytz.utc.localize(value)
+    return aware.astimezone(PKT).date()
+
+
+def _naive(value: Optional[datetime]) -> Optional[datetime]:
+    return value.replace(tzinfo=None) if value and value.tzinfo else value
+
+
+class RetentionService:
+    """
+    Keeps the hot notification/alert/recommendation/cycle-metric tables small. Old rows (and anything past
+    the row cap, oldest first) are folded into per-day counts in daily_rollups, then deleted
+    in short batches, each its own transaction, so dashboard reads never wait long.
+    """
+
+    def _rows(self, db: Session, policy: Dict, account: Optional[str]):
+        model = policy["model"]
+        query = db.query(model)
+        if policy["account"]:
+            query = query.filter(getattr(model, policy["account"]) == account)
+        return query
+
+    def _prunable(self, db: Session, policy: Dict, account: Optional[str] = None):
+        query = self._rows(db, policy, account)
+        if "keep" in policy:
+            query = query.filter(~policy["keep"](policy["model"]))
+        return query
+
+    def _accounts(self, db: Session, policy: Dict) -> List[Optional[str]]:
+        """Each AI fund is pruned on its own, so one busy fund can't push out another's history."""
+        if not policy["account"]:
+            return [None]
+        column = getattr(policy["model"], policy["account"])
+        return [a for (a,) in db.query(column).distinct().order_by(column).all()]
+
+    def _due(self, db: Session, policy: Dict, now: datetime, account: Optional[str] = None) -> Dict:
+        """How many of the oldest prunable rows have to go: everything past `days`, or past `max_rows`."""
+        column = getattr(policy["model"], policy["timestamp"])
+        cutoff = now - timedelta(days=policy["days"])
+        prunable = self._prunable(db, policy, account)
+        total = prunable.count()
+        expired = prunable.filter((column < cutoff) | (column.is_(None))).count()
+        return {"rows": self._rows(db, policy, account).count(), "prunable": total, "expired": expired,
+                "due": max(expired, total - policy["max_rows"])}
+
+    def _rollup(self, db: Session, table: str, policy: Dict, rows):
+        """Adds the batch to the per-(day, account, category, symbol) summaries. Caller commits."""
+        groups = {}
+        for row in rows:
+            timestamp = getattr(row, policy["timestamp"])
+            key = (
+                _pkt_day(timestamp),
+                (getattr(row, policy["account"]) or "") if policy["account"] else "",
+                str(getattr(row, policy["category"]) or "UNKNOWN"),
+                (getattr(row, policy["symbol"]) or "") if policy["symbol"] else ""
+            )
+            group = groups.setdefault(key, {"count": 0, "first_at": None, "last_at": None, "sample": None})
+            ts = _naive(timestamp)
+            group["count"] += 1
+            if ts and (group["first_at"] is None or ts < group["first_at"]):
+                group["first_at"] = ts
+            if ts and (group["last_at"] is None or ts >= group["last_at"]):
+                group["last_at"] = ts
+                group["sample"] = (getattr(row, policy["sample"]) or "")[:200]
+
+        existing = {
+            (r.day, r.account, r.category, r.symbol): r for r in db.query(DailyRollup).filter(
+                DailyRollup.table_name == table,
+                DailyRollup.day.in_({k[0] for k in groups})
+            ).all()
+        }
+        for key, group in groups.items():
+            rollup = existing.get(key)
+            if not rollup:
+                db.add(DailyRollup(table_name=table, day=key[0], account=key[1], category=key[2], symbol=key[3], **group))
+                continue
+            rollup.count = (rollup.count or 0) + group["count"]
+            first_at, last_at = _naive(rollup.first_at), _naive(rollup.last_at)
+            if group["first_at"] and (first_at is None or group["first_at"] < first_at):
+                rollup.first_at = group["first_at"]
+            if group["last_at"] and (last_at is None or group["last_at"] >= last_at):
+                rollup.last_at = group["last_at"]
+                rollup.sample = group["sample"]
+
+    def prune_table(self, db: Session, table: str, now: Optional[datetime] = None, dry_run: bool = False) -> Dict:
+        policy = RETENTION_POLICIES[table]
+        now = now or datetime.now(pytz.utc)
+        totals = {"rows": 0, "prunable": 0, "expired": 0, "due": 0, "removed": 0}
+        by_account = {}
+        for account in self._accounts(db, policy):
+            result = self._prune(db, table, policy, now, dry_run, account)
+            for key in totals:
+                totals[key] += result[key]
+            if account is not None:
+                by_account[account] = result
+        if totals["removed"]:
+            print(f"[RETENTION] {table}: rolled up and removed {totals['removed']} rows")
+        return {**totals, "by_account": by_account} if policy["account"] else totals
+
+    def _prune(self, db: Session, table: str, policy: Dict, now: datetime, dry_run: bool, account: Optional[str]) -> Dict:
+        model = policy["model"]
+        column = getattr(model, policy["timestamp"])
+        due = self._due(db, policy, now, account)
+        if dry_run or not due["due"]:
+            return {**due, "removed": 0}
+
+        removed = 0
+        while removed < due["due"]:
+            batch = self._prunable(db, policy, account).order_by(column.asc(), model.id.asc()).limit(
+                min(RETENTION_BATCH_ROWS, due["due"] - removed)
+            ).all()
+            if not batch:
+                break
+            try:
+                self._rollup(db, table, policy, batch)
+                db.query(model).filter(model.id.in_([r.id for r in batch])).delete(synchronize_session=False)
+                db.commit()
+            except Exception:
+                db.rollback()
+                raise
+            db.expunge_all()
+            removed += len(batch)
+            time.sleep(RETENTION_BATCH_PAUSE)
+        return {**due, "removed": removed}
+
+    def run(self, db: Session, dry_run: bool = False) -> Dict:
+        now = datetime.now(pytz.utc)
+        results = {}
+        for table in RETENTION_POLICIES:
+            try:
+                results[table] = self.prune_table(db, table, now, dry_run)
+            except Exception as e:
+                print(f"[RETENTION] {table} failed: {e}")
+                results[table] = {"error": str(e)}
+        return results
+
+    def policies(self) -> Dict:
+        return {t: {"days": p["days"], "max_rows": p["max_rows"]} for t, p in RETENTION_POLICIES.items()}
+
+    def rollups(self, db: Session, table: Optional[str] = None, days: int = 90, account: Optional[str] = None):
+        """Daily counts per table, account ("" for market-wide alerts) and category."""
+        since = datetime.now(PKT).date() - timedelta(days=days)
+        query = db.query(
+            DailyRollup.table_name, DailyRollup.day, DailyRollup.account, DailyRollup.category,
+            func.sum(DailyRollup.count).label("count")
+        ).filter(DailyRollup.day >= since)
+        if table:
+            query = query.filter(DailyRollup.table_name == table)
+        if account is not None:
+            query = query.filter(DailyRollup.account == account)
+        rows = query.group_by(
+            DailyRollup.table_name, DailyRollup.day, DailyRollup.account, DailyRollup.category
+        ).order_by(DailyRollup.day.desc()).all()
+        return [{"table": r.table_name, "day": r.day.isoformat(), "account": r.account, "category": r.category,
+                 "count": r.count} for r in rows]
+
+
+retention_service = RetentionService()
+
+
+def run_retention_job():
+    """Scheduled entry point (own session)."""
+    db = SessionLocal()
+    try:
+        retention_service.run(db)
+    finally:
+        db.close()
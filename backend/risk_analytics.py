@@ -0,0 +1,336 @@
+import os
+import time
+import threading
+import numpy as np
+from datetime import timedelta
+from statistics import NormalDist
+from typing import Dict, List, Optional
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from models import SessionLocal, Kline, StockUniverse, AIPortfolioItem, PortfolioItem
+from market_data import market_data
+from fundamentals_store import fundamentals_store
+from risk_engine import RiskEngine
+
+RISK_TIMEFRAME = "1d"
+RISK_WINDOW_DAYS = int(os.getenv("RISK_WINDOW_DAYS", "250")) # Daily returns in the rolling window
+RISK_MIN_OBSERVATIONS = 30      # Symbols with fewer returns in the window are reported as missing history
+RISK_REFRESH_SECONDS = 60       # New bars are looked for at most this often
+RISK_REBUILD_UPDATES = 50       # Incremental updates before a full rebuild (keeps float drift away)
+TRADING_DAYS = 252
+
+KLINE_SYNC_BATCH = 10           # /klines calls per batch
+KLINE_SYNC_PAUSE = 2.0          # Seconds between batches, on top of market_data's per-request spacing
+
+
+def risk_symbols(db: Session) -> List[str]:
+    """Active universe plus everything held in the manual or any AI portfolio."""
+    symbols = {s for (s,) in db.query(StockUniverse.symbol).filter(StockUniverse.active == True).all()}
+    symbols |= {s for (s,) in db.query(AIPortfolioItem.symbol).all()}
+    symbols |= {s for (s,) in db.query(PortfolioItem.symbol).all()}
+    return sorted(symbols)
+
+
+def _sums(returns: np.ndarray):
+    """Pairwise-complete moment sums: X'X, X'M (sum of x_i where j is present) and M'M."""
+    present = ~np.isnan(returns)
+    x = np.where(present, returns, 0.0)
+    m = present.astype(float)
+    return x.T @ x, x.T @ m, m.T @ m
+
+
+class CovarianceCache:
+    """
+    Rolling daily-return covariance for the risk universe, built from stored 1d klines.
+    Keeps the last RISK_WINDOW_DAYS returns and their pairwise moment sums; new bars are folded
+    in (and bars leaving the window taken out) as rank-k updates of the sums instead of a full
+    recompute. Missing closes stay NaN and are skipped pairwise, so newly listed or thinly
+    traded symbols don't bias the others.
+    """
+
+    def __init__(self, window: int = RISK_WINDOW_DAYS):
+        self.window = window
+        self.lock = threading.RLock() # Guards every read too: _append updates the sums in place
+        self.symbols: List[str] = []
+        self.index: Dict[str, int] = {}
+        self.dates: List = []
+        self.closes = np.empty((0, 0))
+        self.returns = np.empty((0, 0))
+        self.sxy = self.sx = self.n = np.empty((0, 0))
+        self.last_id = 0
+        self.updates = 0
+        self.checked_at = 0.0
+        self._cov: Optional[np.ndarray] = None
+
+    # --- Building ---
+
+    def _panel(self, rows, dates: List) -> np.ndarray:
+        closes = np.full((len(dates), len(self.symbols)), np.nan)
+        date_index = {d: i for i, d in enumerate(dates)}
+        for symbol, ts, close in rows:
+            i = date_index.get(ts.date())
+            if i is not None and symbol in self.index:
+                closes[i, self.index[symbol]] = close
+        return closes
+
+    def rebuild(self, db: Session, symbols: List[str]):
+        self.symbols = list(symbols)
+        self.index = {s: i for i, s in enumerate(self.symbols)}
+        self.last_id = db.query(func.max(Kline.id)).scalar() or 0
+
+        latest = db.query(func.max(Kline.ts)).filter(Kline.timeframe == RISK_TIMEFRAME).scalar()
+        rows = []
+        if latest and self.symbols:
+            # Calendar days comfortably covering the window (weekends, holidays)
+            since = latest - timedelta(days=int(self.window * 1.6) + 10)
+            rows = db.query(Kline.symbol, Kline.ts, Kline.close).filter(
+                Kline.timeframe == RISK_TIMEFRAME,
+                Kline.symbol.in_(self.symbols),
+                Kline.ts >= since,
+                Kline.close > 0
+            ).all()
+
+        self.dates = sorted({ts.date() for _, ts, _ in rows})[-(self.window + 1):]
+        self.closes = self._panel(rows, self.dates)
+        self.returns = self.closes[1:] / self.closes[:-1] - 1.0 if len(self.dates) > 1 else np.empty((0, len(self.symbols)))
+        self.sxy, self.sx, self.n = _sums(self.returns)
+        self.updates = 0
+        self._cov = None
+        print(f"[RISK] Covariance rebuilt: {len(self.symbols)} symbols, {len(self.returns)} daily returns")
+
+    def _append(self, new_rows) -> bool:
+        """Folds bars for dates after the window's last date into the sums. False if a rebuild is needed."""
+        if not self.dates:
+            return False
+        new_dates = sorted({ts.date() for _, ts, _ in new_rows})
+        if not new_dates or new_dates[0] <= self.dates[-1] or len(new_dates) > self.window:
+            return False # Late/corrected bars for dates already in the window
+
+        added = self._panel(new_rows, new_dates)
+        closes = np.vstack([self.closes[-1:], added])
+        new_returns = closes[1:] / closes[:-1] - 1.0
+
+        returns = np.vstack([self.returns, new_returns])
+        leaving = returns[:max(0, len(returns) - self.window)]
+        for sign, block in ((1.0, new_returns), (-1.0, leaving)):
+            if len(block):
+                sxy, sx, n = _sums(block)
+                self.sxy += sign * sxy
+                self.sx += sign * sx
+                self.n += sign * n
+
+        self.returns = returns[len(leaving):]
+        self.closes = np.vstack([self.closes, added])[-(self.window + 1):]
+        self.dates = (self.dates + new_dates)[-(self.window + 1):]
+        self.updates += 1
+        self._cov = None
+        return True
+
+    def refresh(self, db: Session, force: bool = False, rebuild: bool = False):
+        """
+        Picks up new bars (and universe/holding changes), at most every RISK_REFRESH_SECONDS.
+        Incremental updates only see new rows; `rebuild` also re-reads candles updated in place
+        (a partial daily candle stored mid-session and corrected by the kline sync).
+        """
+        with self.lock:
+            if not force and time.monotonic() - self.checked_at < RISK_REFRESH_SECONDS:
+                return
+            symbols = risk_symbols(db)
+            self.checked_at = time.monotonic()
+
+            if rebuild or symbols != self.symbols or self.updates >= RISK_REBUILD_UPDATES:
+                self.rebuild(db, symbols)
+                return
+
+            new_rows = db.query(Kline.id, Kline.symbol, Kline.ts, Kline.close).filter(
+                Kline.id > self.last_id,
+                Kline.timeframe == RISK_TIMEFRAME,
+                Kline.close > 0
+            ).all()
+            if not new_rows:
+                return
+            last_id = max(r[0] for r in new_rows)
+            relevant = [(s, ts, c) for _, s, ts, c in new_rows if s in self.index]
+            if not relevant or self._append(relevant):
+                self.last_id = last_id
+            else:
+                self.rebuild(db, symbols)
+
+    # --- Queries ---
+
+    def covariance(self) -> np.ndarray:
+        """Pairwise-complete sample covariance of daily returns (NaN where a pair has < 2 common days)."""
+        with self.lock:
+            if self._cov is None:
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    cov = (self.sxy - self.sx * self.sx.T / self.n) / (self.n - 1)
+                cov[self.n < 2] = np.nan
+                self._cov = cov
+            return self._cov
+
+    def observations(self) -> np.ndarray:
+        with self.lock:
+            return np.diag(self.n).copy() if self.n.size else np.zeros(0)
+
+    def means(self) -> np.ndarray:
+        with self.lock, np.errstate(divide="ignore", invalid="ignore"):
+            return np.nan_to_num(np.diag(self.sx) / np.diag(self.n)) if self.n.size else np.zeros(0)
+
+    def last_closes(self) -> Dict[str, float]:
+        """Latest stored close per symbol in the window."""
+        with self.lock:
+            if not self.dates:
+                return {}
+            filled = np.where(np.isnan(self.closes), -1.0, self.closes)
+            latest_row = np.where(~np.isnan(self.closes), np.arange(len(self.dates))[:, None], -1).max(axis=0)
+            return {s: float(filled[latest_row[i], i]) for s, i in self.index.items() if latest_row[i] >= 0}
+
+    def snapshot(self) -> Dict:
+        """
+        Everything a risk calculation reads, taken together under the lock, so a concurrent
+        refresh can't mix one universe's index with another's matrices. Arrays in the snapshot
+        are never mutated afterwards (refreshes replace them or work on the sums).
+        """
+        with self.lock:
+            return {
+                "index": dict(self.index),
+                "dates": list(self.dates),
+                "returns": self.returns,
+                "covariance": self.covariance(),
+                "observations": self.observations(),
+                "means": self.means(),
+                "last_closes": self.last_closes()
+            }
+
+
+class RiskAnalytics:
+    """
+    Portfolio volatility, VaR (parametric and historical) and per-holding marginal/component
+    contributions from the cached covariance. Positions are valued at the latest stored close.
+    """
+
+    def __init__(self):
+        self.cache = CovarianceCache()
+
+    def portfolio_risk(self, db: Session, positions: Dict[str, float], confidence: float = 0.95,
+                       horizon_days: int = 1, total_value: Optional[float] = None, snapshot: Optional[Dict] = None) -> Dict:
+        """
+        `positions` is {symbol: market value in Rs}. VaR is a positive loss in Rs over `horizon_days`
+        (square-root-of-time scaling); percentages are of `total_value` (holdings + cash) when given.
+        `snapshot` is a CovarianceCache.snapshot() the positions were valued from, if any.
+        """
+        if snapshot is None:
+            self.cache.refresh(db)
+            snapshot = self.cache.snapshot()
+        index = snapshot["index"]
+
+        obs = snapshot["observations"]
+        covered = [s for s, v in positions.items()
+                   if v > 0 and s in index and obs[index[s]] >= RISK_MIN_OBSERVATIONS]
+        missing = sorted(s for s, v in positions.items() if v > 0 and s not in covered)
+        holdings_value = float(sum(v for v in positions.values() if v > 0))
+        total_value = total_value if total_value else holdings_value
+
+        result = {
+            "confidence": confidence,
+            "horizon_days": horizon_days,
+            "as_of": snapshot["dates"][-1].isoformat() if snapshot["dates"] else None,
+            "window_days": len(snapshot["returns"]),
+            "holdings_value": round(holdings_value, 2),
+            "total_value": round(total_value, 2),
+            "covered_value": 0.0,
+            "missing_history": missing,
+            "volatility": {"daily": 0.0, "annualized": 0.0, "daily_pct": 0.0},
+            "var": {"parametric": 0.0, "historical": 0.0, "parametric_pct": 0.0, "historical_pct": 0.0},
+            "expected_shortfall": 0.0,
+            "contributions": []
+        }
+        if not covered:
+            return result
+
+        idx = np.array([index[s] for s in covered])
+        v = np.array([positions[s] for s in covered], dtype=float)
+        cov = np.nan_to_num(snapshot["covariance"][np.ix_(idx, idx)])
+        sqrt_h = horizon_days ** 0.5
+        z = NormalDist().inv_cdf(confidence)
+
+        cov_v = cov @ v
+        sigma = float(np.sqrt(max(v @ cov_v, 0.0)))
+        mu = float(snapshot["means"][idx] @ v)
+        parametric = max(0.0, z * sigma * sqrt_h - mu * horizon_days)
+
+        # Historical: the window's daily P&L of today's positions (a missing return counts as flat)
+        pnl = np.nan_to_num(snapshot["returns"][:, idx]) @ v
+        var_1d = max(0.0, -float(np.quantile(pnl, 1 - confidence)))
+        tail = pnl[pnl <= -var_1d]
+        historical = var_1d * sqrt_h
+        shortfall = max(0.0, -float(tail.mean())) * sqrt_h if len(tail) else historical
+
+        # Euler allocation: component VaRs add up to the parametric (zero-mean) VaR
+        marginal = cov_v / sigma if sigma > 0 else np.zeros(len(v))
+        component = v * marginal
+        vols = np.sqrt(np.clip(np.diag(cov), 0.0, None)) * np.sqrt(TRADING_DAYS)
+        covered_value = float(v.sum())
+
+        result.update({
+            "covered_value": round(covered_value, 2),
+            "volatility": {
+                "daily": round(sigma, 2),
+                "annualized": round(sigma * TRADING_DAYS ** 0.5, 2),
+                "daily_pct": round(sigma / covered_value * 100, 3)
+            },
+            "var": {
+                "parametric": round(parametric, 2),
+                "historical": round(historical, 2),
+                "parametric_pct": round(parametric / total_value * 100, 3),
+                "historical_pct": round(historical / total_value * 100, 3)
+            },
+            "expected_shortfall": round(shortfall, 2),
+            "contributions": sorted([{
+                "symbol": s,
+                "value": round(float(v[i]), 2),
+                "weight": round(float(v[i]) / covered_value, 4),
+                "volatility_annualized": round(float(vols[i]), 4),
+                "marginal_var": round(float(z * marginal[i] * sqrt_h), 4),
+                "component_var": round(float(z * component[i] * sqrt_h), 2),
+                "contribution_pct": round(float(component[i] / sigma * 100), 2) if sigma > 0 else 0.0
+            } for i, s in enumerate(covered)], key=lambda c: c["component_var"], reverse=True)
+        })
+        return result
+
+    def exposure_report(self, db: Session, items: List, cash: float, confidence: float = 0.95, horizon_days: int = 1) -> Dict:
+        """VaR/volatility plus stock and sector limit breaches for a list of holdings (manual or AI)."""
+        self.cache.refresh(db)
+        snapshot = self.cache.snapshot()
+        prices = snapshot["last_closes"]
+        positions: Dict[str, float] = {}
+        for item in items:
+            price = prices.get(item.symbol) or getattr(item, "current_price", None) or item.avg_cost or 0.0
+            positions[item.symbol] = positions.get(item.symbol, 0.0) + (item.quantity or 0) * price
+        total_value = (cash or 0.0) + sum(positions.values())
+
+        report = self.portfolio_risk(db, positions, confidence, horizon_days, total_value, snapshot)
+        engine = RiskEngine(items, total_value, sector_of=lambda s: (fundamentals_store.get(s) or {}).get("sector"), prices=prices)
+        report["limit_breaches"] = engine.breaches()
+        return report
+
+
+risk_analytics = RiskAnalytics()
+
+
+def run_kline_sync_job():
+    """Scheduled entry point (own session): pulls daily klines for the risk universe, then refreshes the cache."""
+    db = SessionLocal()
+    try:
+        symbols = risk_symbols(db)
+        stored = 0
+        for start in range(0, len(symbols), KLINE_SYNC_BATCH):
+            if start:
+                time.sleep(KLINE_SYNC_PAUSE)
+            for symbol in symbols[start:start + KLINE_SYNC_BATCH]:
+                stored += len(market_data.get_klines(symbol, RISK_TIMEFRAME)) # Written through to kline_store
+        print(f"[RISK] Synced daily klines for {len(symbols)} symbols ({stored} bars)")
+        risk_analytics.cache.refresh(db, force=True, rebuild=True)
+    finally:
+        db.close()
@@ -1,51 +1,169 @@
-from typing import List, Dict
-from models import PortfolioItem
+import numpy as np
+from typing import Callable, List, Dict, Optional
+
+UNKNOWN_SECTOR = "Unknown"
+
+
+def _group_fill(values: np.ndarray, groups: np.ndarray, headroom: np.ndarray) -> np.ndarray:
+    """
+    Greedy fill in plan order: each trade gets what is left of its group's headroom after the
+    earlier trades of the same group. Cumulative allowed = min(cumsum(values), headroom) per group,
+    so the per-trade amounts are its first difference; no Python loop over trades.
+    """
+    order = np.argsort(groups, kind="stable") # Plan order kept inside each group
+    v, g = values[order], groups[order]
+    cum = np.cumsum(v)
+    starts = np.r_[0, np.flatnonzero(g[1:] != g[:-1]) + 1]
+    offsets = np.repeat(cum[starts] - v[starts], np.diff(np.r_[starts, len(v)]))
+    capped = np.minimum(cum - offsets, np.maximum(headroom[order], 0.0))
+    # First trade of every group starts from zero instead of the previous group's total
+    first = np.zeros(len(g), dtype=bool)
+    first[starts] = True
+    filled = np.empty_like(values)
+    filled[order] = np.where(first, capped, np.diff(np.r_[0.0, capped]))
+    return filled
+
 
 class RiskEngine:
-    def __init__(self, portfolio_items: List[PortfolioItem], total_portfolio_value: float):
+    """
+    Hard position limits for a portfolio: per stock, per sector and per single trade, all as a
+    fraction of total portfolio value. Holdings are indexed by symbol and sector once, so a
+    whole allocation plan is checked in one vectorized pass (check_plan) and each trade comes
+    back with a verdict and the largest quantity that still fits.
+    Exposure is market value: `prices` if given, else current_price, else avg_cost.
+    """
+
+    def __init__(self, portfolio_items: List, total_portfolio_value: float,
+                 sector_of: Optional[Callable[[str], Optional[str]]] = None, prices: Optional[Dict[str, float]] = None):
         self.items = portfolio_items
         self.total_value = total_portfolio_value
-        
+        self.sector_of = sector_of or (lambda symbol: None)
+
         # Hard Constraints
         self.MAX_STOCK_ALLOCATION = 0.15 # 15%
         self.MAX_SECTOR_ALLOCATION = 0.40 # 40%
+        self.MAX_TRADE_SIZE = 0.10 # Single trade, proxy for volatility risk
         self.MAX_LOSS_PER_TRADE = 0.02 # 2% of total portfolio
 
-    def check_trade(self, symbol: str, quantity: int, price: float, sector: str = "Unknown") -> Dict:
+        # Indexes: symbol -> exposure, sector -> exposure
+        self.sectors: Dict[str, str] = {}
+        self.stock_exposure: Dict[str, float] = {}
+        self.sector_exposure: Dict[str, float] = {}
+        prices = prices or {}
+        for item in portfolio_items:
+            price = prices.get(item.symbol) or getattr(item, "current_price", None) or item.avg_cost or 0.0
+            value = (item.quantity or 0) * price
+            sector = self._sector(item.symbol)
+            self.stock_exposure[item.symbol] = self.stock_exposure.get(item.symbol, 0.0) + value
+            self.sector_exposure[sector] = self.sector_exposure.get(sector, 0.0) + value
+
+    def _sector(self, symbol: str) -> str:
+        if symbol not in self.sectors:
+            self.sectors[symbol] = self.sector_of(symbol) or UNKNOWN_SECTOR
+        return self.sectors[symbol]
+
+    def check_plan(self, trades: List[Dict]) -> List[Dict]:
         """
-        Evaluates if a proposed trade violates any risk controls.
-        Returns: {"allowed": bool, "reason": str}
+        Checks a plan ([{"symbol", "quantity", "price", "action"?}, ...], in execution order) against
+        the stock, sector and single-trade caps. Earlier trades use up headroom first.
+        Sells only reduce exposure and always pass. Stocks without a known sector are not
+        sector-capped (the stock and trade caps still apply).
+        Returns per trade: {"symbol", "requested_quantity", "quantity", "allowed", "clipped", "reason"}.
         """
-        trade_value = quantity * price
-        
-        # 1. Check Stock Allocation
-        current_holding = next((item for item in self.items if item.symbol == symbol), None)
-        current_val = (current_holding.quantity * current_holding.avg_cost) if current_holding else 0
-        current_val = (current_holding.quantity * current_holding.avg_cost) if current_holding else 0
-        new_total_stock_val = current_val + trade_value
-        
+        if not trades:
+            return []
+        n = len(trades)
+        symbols = [t["symbol"] for t in trades]
+        qty = np.array([t.get("quantity") or 0 for t in trades], dtype=np.int64)
+        price = np.array([t.get("price") or 0.0 for t in trades], dtype=float)
+        is_buy = np.array([t.get("action", "BUY") == "BUY" for t in trades])
+
         if self.total_value <= 0:
-            return {
-                "allowed": False,
-                "reason": "Total portfolio value is zero. Cannot calculate risk metrics."
-            }
-
-        if new_total_stock_val / self.total_value > self.MAX_STOCK_ALLOCATION:
-            return {
-                "allowed": False, 
-                "reason": f"Exceeds max allocation (15%) for {symbol}. Current: {((new_total_stock_val/self.total_value)*100):.1f}%"
-            }
-
-        # 2. Check Sector Allocation (Mocking sector for now as we don't have it in DB yet)
-        # In a real app, we'd sum up all stocks in the same sector.
-        # For now, we'll skip or assume safe.
-        
-        # 3. Check Max Trade Size (Proxy for volatility risk)
-        # If a single trade is > 10% of portfolio, flag it.
-        if trade_value / self.total_value > 0.10:
-             return {
-                "allowed": False, 
-                "reason": f"Trade size too large ({((trade_value/self.total_value)*100):.1f}%). Max single trade 10% recommended."
-            }
-
-        return {"allowed": True, "reason": "Trade within risk limits"}
+            return [self._verdict(t, 0 if is_buy[i] else int(qty[i]),
+                                  "Total portfolio value is zero. Cannot calculate risk metrics." if is_buy[i] else "Sell reduces exposure")
+                    for i, t in enumerate(trades)]
+
+        requested = np.where(is_buy, qty * price, 0.0)
+
+        # 1. Single trade cap
+        trade_cap = self.MAX_TRADE_SIZE * self.total_value
+        after_trade = np.minimum(requested, trade_cap)
+
+        # 2. Stock cap (headroom over what is already held)
+        stock_ids = {s: i for i, s in enumerate(dict.fromkeys(symbols))}
+        stock_group = np.array([stock_ids[s] for s in symbols])
+        stock_room = np.array([
+            self.MAX_STOCK_ALLOCATION * self.total_value - self.stock_exposure.get(s, 0.0) for s in stock_ids
+        ])[stock_group]
+        after_stock = _group_fill(after_trade, stock_group, stock_room)
+
+        # 3. Sector cap
+        sectors = [self._sector(s) for s in symbols]
+        sector_ids = {s: i for i, s in enumerate(dict.fromkeys(sectors))}
+        sector_group = np.array([sector_ids[s] for s in sectors])
+        sector_room = np.array([
+            np.inf if s == UNKNOWN_SECTOR else self.MAX_SECTOR_ALLOCATION * self.total_value - self.sector_exposure.get(s, 0.0)
+            for s in sector_ids
+        ])[sector_group]
+        after_sector = _group_fill(after_stock, sector_group, sector_room)
+
+        safe_price = np.where(price > 0, price, np.inf)
+        allowed_qty = np.where(is_buy, np.minimum(np.floor(after_sector / safe_price + 1e-9), qty), qty).astype(np.int64)
+
+        verdicts = []
+        for i, trade in enumerate(trades):
+            if not is_buy[i]:
+                verdicts.append(self._verdict(trade, int(qty[i]), "Sell reduces exposure"))
+                continue
+            if allowed_qty[i] >= qty[i]:
+                reason = "Trade within risk limits"
+            elif after_sector[i] < after_stock[i] - 1e-6:
+                held = self.sector_exposure.get(sectors[i], 0.0) / self.total_value * 100
+                reason = f"Exceeds max sector allocation ({self.MAX_SECTOR_ALLOCATION:.0%}) for {sectors[i]}. Held: {held:.1f}%"
+            elif after_stock[i] < after_trade[i] - 1e-6:
+                held = self.stock_exposure.get(symbols[i], 0.0) / self.total_value * 100
+                reason = f"Exceeds max allocation ({self.MAX_STOCK_ALLOCATION:.0%}) for {symbols[i]}. Held: {held:.1f}%"
+            elif after_trade[i] < requested[i] - 1e-6:
+                reason = (f"Trade size too large ({requested[i] / self.total_value * 100:.1f}%). "
+                          f"Max single trade {self.MAX_TRADE_SIZE:.0%}.")
+            else:
+                reason = "Rounded down to whole shares"
+            verdicts.append(self._verdict(trade, int(allowed_qty[i]), reason))
+        return verdicts
+
+    def breaches(self) -> List[Dict]:
+        """Holdings and sectors already above their caps (e.g. after price moves), largest first."""
+        if self.total_value <= 0:
+            return []
+        found = [
+            {"type": "stock", "name": s, "weight_pct": round(v / self.total_value * 100, 2),
+             "limit_pct": self.MAX_STOCK_ALLOCATION * 100}
+            for s, v in self.stock_exposure.items() if v / self.total_value > self.MAX_STOCK_ALLOCATION
+        ] + [
+            {"type": "sector", "name": s, "weight_pct": round(v / self.total_value * 100, 2),
+             "limit_pct": self.MAX_SECTOR_ALLOCATION * 100}
+            for s, v in self.sector_exposure.items()
+            if s != UNKNOWN_SECTOR and v / self.total_value > self.MAX_SECTOR_ALLOCATION
+        ]
+        return sorted(found, key=lambda b: b["weight_pct"], reverse=True)
+
+    def _verdict(self, trade: Dict, quantity: int, reason: str) -> Dict:
+        requested = int(trade.get("quantity") or 0)
+        return {
+            "symbol": trade["symbol"],
+            "requested_quantity": requested,
+            "quantity": quantity,
+            "allowed": quantity >= requested,
+            "clipped": 0 < quantity < requested,
+            "reason": reason
+        }
+
+    def check_trade(self, symbol: str, quantity: int, price: float, sector: Optional[str] = None) -> Dict:
+        """
+        Evaluates if a proposed trade violates any risk controls.
+        Returns: {"allowed": bool, "reason": str, "suggested_quantity": int}
+        """
+        if sector:
+            self.sectors[symbol] = sector
+        verdict = self.check_plan([{"symbol": symbol, "quantity": quantity, "price": price}])[0]
+        return {"allowed": verdict["allowed"], "reason": verdict["reason"], "suggested_quantity": verdict["quantity"]}
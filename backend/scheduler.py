@@ -0,0 +1,402 @@
+import os
+import math
+import socket
+import zlib
+import uuid
+import pytz
+from datetime import datetime, timedelta
+from typing import Callable, List, Optional, Set
+from apscheduler.schedulers.background import BackgroundScheduler
+from sqlalchemy.exc import IntegrityError
+
+from models import SessionLocal, SchedulerLock, UserSettings
+from market_calendar import market_calendar, PKT
+from accounts import accounts, SCHEDULER_SHARDS
+
+LOCK_NAME = "scheduler"
+LOCK_TTL_SECONDS = int(os.getenv("SCHEDULER_LOCK_TTL", "90"))
+HEARTBEAT_SECONDS = max(5, LOCK_TTL_SECONDS // 3)
+
+TRADING_JOB_ID = "trading_cycle" # One job per held shard: "trading_cycle:<shard>"
+BUDGET_JOB_ID = "daily_budget_injection"
+RETENTION_JOB_ID = "retention"
+FUNDAMENTALS_JOB_ID = "fundamentals_refresh"
+KLINES_JOB_ID = "kline_sync"
+
+
+def _as_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """DB datetimes come back naive on SQLite; treat them as UTC like the rest of the app."""
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        return pytz.utc.localize(value)
+    return value.astimezone(pytz.utc)
+
+
+def compute_next_run(settings: UserSettings, now: Optional[datetime] = None) -> Optional[datetime]:
+    """
+    Returns the next PKT time the trading cycle should fire, or None if autonomous mode is off.
+    Next run = last run + polling interval, clamped into the next PSX session
+    (skipping weekends, holidays and honouring half-day closes).
+    """
+    if not settings or not settings.autonomous_mode:
+        return None
+
+    now = (now or datetime.now(PKT)).astimezone(PKT)
+    interval = timedelta(minutes=max(1, settings.polling_interval or 5))
+    start_time = settings.trading_start_time or "09:30"
+    end_time = settings.trading_end_time or "15:30"
+
+    candidate = now
+    last_run = _as_utc(settings.last_run_date)
+    if last_run:
+        candidate = max(now, last_run.astimezone(PKT) + interval)
+
+    # Precomputed (and cached) next session open when the candidate falls outside a session
+    return market_calendar.next_open(candidate, start_time, end_time)
+
+
+class SchedulerService:
+    """
+    Runs the APScheduler jobs across the uvicorn workers. Every worker starts a heartbeat.
+    The worker holding the "scheduler" lock runs the global jobs (budget, retention, fundamentals, klines).
+    Accounts are split into SCHEDULER_SHARDS shards (crc32 of the account key); each shard has
+    its own lock, and workers take a fair share of them (shards / live workers), so trading
+    cycles of many accounts spread over the processes. With one shard this is the original
+    single-leader behaviour.
+    """
+
+    def __init__(self, name: str = LOCK_NAME, ttl_seconds: int = LOCK_TTL_SECONDS, shards: int = SCHEDULER_SHARDS):
+        self.name = name
+        self.ttl = timedelta(seconds=ttl_seconds)
+        self.shard_count = shards
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.is_leader = False
+        self.shards: Set[int] = set()
+        self.scheduler: Optional[BackgroundScheduler] = None
+        self.trading_job: Optional[Callable] = None
+        self.budget_job: Optional[Callable] = None
+        self.retention_job: Optional[Callable] = None
+        self.fundamentals_job: Optional[Callable] = None
+        self.klines_job: Optional[Callable] = None
+
+    def _shard_lock(self, shard: int) -> str:
+        return f"{self.name}:shard:{shard}"
+
+    def _worker_lock(self) -> str:
+        return f"{self.name}:worker:{self.owner}"
+
+    # --- Locks ---
+
+    def _try_acquire(self, name: Optional[str] = None) -> bool:
+        """
+        Acquires or renews a lock row using a compare-and-swap UPDATE,
+        so it is atomic on SQLite as well as PostgreSQL.
+        Returns True if this process (still) holds it.
+        """
+        name = name or self.name
+        db = SessionLocal()
+        try:
+            now = datetime.now(pytz.utc)
+            lock = db.query(SchedulerLock).filter(SchedulerLock.name == name).first()
+
+            if not lock:
+                db.add(SchedulerLock(
+                    name=name,
+                    owner=self.owner,
+                    acquired_at=now,
+                    expires_at=now + self.ttl,
+                    reschedule_requested=False
+                ))
+                try:
+                    db.commit()
+                except IntegrityError:
+                    db.rollback() # Another worker created it first
+                    return False
+                return True
+
+            expires = _as_utc(lock.expires_at)
+            held_by_other = lock.owner != self.owner and expires is not None and expires > now
+            if held_by_other:
+                return False
+
+            values = {SchedulerLock.owner: self.owner, SchedulerLock.expires_at: now + self.ttl}
+            if lock.owner != self.owner:
+                values[SchedulerLock.acquired_at] = now
+
+            updated = db.query(SchedulerLock).filter(
+                SchedulerLock.name == name,
+                SchedulerLock.owner == lock.owner,
+                SchedulerLock.expires_at == lock.expires_at
+            ).update(values, synchronize_session=False)
+            db.commit()
+            return updated == 1
+        except Exception as e:
+            print(f"[SCHEDULER] Lock error ({name}): {e}")
+            db.rollback()
+            return False
+        finally:
+            db.close()
+
+    def _expire(self, names: List[str]):
+        """Releases locks held by this process so another worker can take them immediately."""
+        if not names:
+            return
+        db = SessionLocal()
+        try:
+            db.query(SchedulerLock).filter(
+                SchedulerLock.name.in_(names),
+                SchedulerLock.owner == self.owner
+            ).update({SchedulerLock.expires_at: datetime.now(pytz.utc)}, synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    def _live_workers(self) -> int:
+        """Workers with a fresh heartbeat row (this one included); expired rows are cleaned up."""
+        db = SessionLocal()
+        try:
+            now = datetime.now(pytz.utc)
+            prefix = f"{self.name}:worker:%"
+            rows = db.query(SchedulerLock.name, SchedulerLock.expires_at).filter(SchedulerLock.name.like(prefix)).all()
+            dead = [name for name, expires in rows if not expires or _as_utc(expires) <= now]
+            if dead:
+                db.query(SchedulerLock).filter(SchedulerLock.name.in_(dead)).delete(synchronize_session=False)
+                db.commit()
+            return max(1, len(rows) - len(dead))
+        finally:
+            db.close()
+
+    def _pop_reschedule_request(self, name: str) -> bool:
+        db = SessionLocal()
+        try:
+            updated = db.query(SchedulerLock).filter(
+                SchedulerLock.name == name,
+                SchedulerLock.owner == self.owner,
+                SchedulerLock.reschedule_requested == True
+            ).update({SchedulerLock.reschedule_requested: False}, synchronize_session=False)
+            db.commit()
+            return updated == 1
+        finally:
+            db.close()
+
+    def release(self):
+        """Gives up leadership and shards so other workers can take over immediately (e.g. on shutdown)."""
+        if self.scheduler and self.scheduler.running:
+            self.scheduler.shutdown(wait=False)
+        names = [self._shard_lock(s) for s in self.shards] + [self._worker_lock()]
+        if self.is_leader:
+            names.append(self.name)
+        self._expire(names)
+        if self.is_leader or self.shards:
+            print(f"[SCHEDULER] Released leadership and shards {sorted(self.shards)} ({self.owner})")
+        self.is_leader = False
+        self.shards = set()
+
+    # --- Jobs ---
+
+    def start(self, trading_job: Callable, budget_job: Callable, retention_job: Optional[Callable] = None,
+              fundamentals_job: Optional[Callable] = None, klines_job: Optional[Callable] = None):
+        """
+        Starts the heartbeat. Real jobs are only added once this process wins the leader lock
+        or a shard lock. `trading_job` is called with the list of account keys due in a shard.
+        """
+        self.trading_job = trading_job
+        self.budget_job = budget_job
+        self.retention_job = retention_job
+        self.fundamentals_job = fundamentals_job
+        self.klines_job = klines_job
+
+        self.scheduler = BackgroundScheduler(job_defaults={
+            "max_instances": 1, # A slow cycle never overlaps the next one
+            "coalesce": True,   # Missed runs collapse into one
+            "misfire_grace_time": 60
+        })
+        self.scheduler.add_job(
+            self._heartbeat, 'interval', seconds=HEARTBEAT_SECONDS,
+            id="leader_heartbeat", next_run_time=datetime.now(pytz.utc)
+        )
+        self.scheduler.start()
+        print(f"DEBUG: Background Scheduler Started ({self.owner}, {self.shard_count} shards)")
+
+    def _heartbeat(self):
+        self._try_acquire(self._worker_lock())
+
+        was_leader = self.is_leader
+        self.is_leader = self._try_acquire()
+        if self.is_leader and not was_leader:
+            print(f"[SCHEDULER] Acquired leadership ({self.owner})")
+            self._add_leader_jobs()
+        elif was_leader and not self.is_leader:
+            print(f"[SCHEDULER] Lost leadership ({self.owner})")
+            self._remove_leader_jobs()
+
+        self._balance_shards()
+
+    def _balance_shards(self):
+        """Renews held shards, takes free ones up to a fair share, and hands back one extra per beat."""
+        fair_share = math.ceil(self.shard_count / self._live_workers())
+
+        for shard in sorted(self.shards):
+            if not self._try_acquire(self._shard_lock(shard)):
+                print(f"[SCHEDULER] Lost shard {shard} ({self.owner})")
+                self.shards.discard(shard)
+                self._remove_job(f"{TRADING_JOB_ID}:{shard}")
+            elif self._pop_reschedule_request(self._shard_lock(shard)):
+                self.reschedule_shard(shard)
+
+        if len(self.shards) > fair_share:
+            shard = max(self.shards)
+            self.shards.discard(shard)
+            self._remove_job(f"{TRADING_JOB_ID}:{shard}")
+            self._expire([self._shard_lock(shard)])
+            print(f"[SCHEDULER] Handed back shard {shard} (fair share {fair_share})")
+            return
+
+        # Start at a per-worker offset so workers don't all contend for shard 0 first
+        offset = zlib.crc32(self.owner.encode("utf-8")) % self.shard_count
+        for i in range(self.shard_count):
+            if len(self.shards) >= fair_share:
+                break
+            shard = (offset + i) % self.shard_count
+            if shard in self.shards or not self._try_acquire(self._shard_lock(shard)):
+                continue
+            self.shards.add(shard)
+            print(f"[SCHEDULER] Acquired shard {shard} ({self.owner})")
+            self.reschedule_shard(shard)
+
+    def _add_leader_jobs(self):
+        # Daily Budget Injection at 9:00 AM PKT on weekdays (holidays are skipped in the job)
+        self.scheduler.add_job(
+            self._run_budget_job, 'cron', day_of_week='mon-fri', hour=9, minute=0, timezone='Asia/Karachi',
+            id=BUDGET_JOB_ID, replace_existing=True
+        )
+        # Retention/rollups nightly, well outside trading hours
+        if self.retention_job:
+            self.scheduler.add_job(
+                self._run_retention_job, 'cron', hour=1, minute=30, timezone='Asia/Karachi',
+                id=RETENTION_JOB_ID, replace_existing=True
+            )
+        # Fundamentals for the universe before the open (stale symbols only, rate limited)
+        if self.fundamentals_job:
+            self.scheduler.add_job(
+                self._run_fundamentals_job, 'cron', day_of_week='mon-fri', hour=8, minute=0, timezone='Asia/Karachi',
+                id=FUNDAMENTALS_JOB_ID, replace_existing=True
+            )
+        # Daily bars for the risk covariance once the session has closed
+        if self.klines_job:
+            self.scheduler.add_job(
+                self._run_klines_job, 'cron', day_of_week='mon-fri', hour=16, minute=15, timezone='Asia/Karachi',
+                id=KLINES_JOB_ID, replace_existing=True
+            )
+
+    def _remove_job(self, job_id: str):
+        if self.scheduler and self.scheduler.get_job(job_id):
+            self.scheduler.remove_job(job_id)
+
+    def _remove_leader_jobs(self):
+        for job_id in (BUDGET_JOB_ID, RETENTION_JOB_ID, FUNDAMENTALS_JOB_ID, KLINES_JOB_ID):
+            self._remove_job(job_id)
+
+    def _run_budget_job(self):
+        if not self.is_leader:
+            return
+        today = datetime.now(PKT).date()
+        if not market_calendar.is_trading_day(today):
+            print(f"[SCHEDULER] Skipping budget injection: market closed ({market_calendar.holiday_name(today) or 'Weekend'})")
+            return
+        self.budget_job()
+
+    def _run_retention_job(self):
+        if not self.is_leader:
+            return
+        self.retention_job()
+
+    def _run_fundamentals_job(self):
+        if not self.is_leader:
+            return
+        self.fundamentals_job()
+
+    def _run_klines_job(self):
+        if not self.is_leader:
+            return
+        today = datetime.now(PKT).date()
+        if not market_calendar.is_trading_day(today):
+            return # No new bar on closed days
+        self.klines_job()
+
+    def _shard_settings(self, db, shard: int) -> List[UserSettings]:
+        return [s for s in accounts.list(db, autonomous_only=True) if accounts.shard_of(s.account, self.shard_count) == shard]
+
+    def _run_trading_job(self, shard: int):
+        if shard not in self.shards:
+            return
+        try:
+            now = datetime.now(PKT)
+            db = SessionLocal()
+            try:
+                # Accounts of this shard whose next run has come (each has its own interval and hours)
+                due = [s.account for s in self._shard_settings(db, shard)
+                       if (compute_next_run(s, now) or now + timedelta(days=1)) <= now + timedelta(seconds=5)]
+            finally:
+                db.close()
+            if due:
+                self.trading_job(due)
+        finally:
+            # One-shot job: always plan the next run, even if this one failed
+            self.reschedule_shard(shard)
+
+    def reschedule_shard(self, shard: int):
+        """(Re)schedules a shard's one-shot trading job at the earliest next run of its accounts."""
+        if not self.scheduler or shard not in self.shards:
+            return
+        db = SessionLocal()
+        try:
+            runs = [r for r in (compute_next_run(s) for s in self._shard_settings(db, shard)) if r]
+        finally:
+            db.close()
+
+        job_id = f"{TRADING_JOB_ID}:{shard}"
+        if not runs:
+            self._remove_job(job_id)
+            print(f"[SCHEDULER] Shard {shard}: no account in autonomous mode; trading cycle not scheduled.")
+            return
+
+        next_run = min(runs)
+        self.scheduler.add_job(
+            self._run_trading_job, 'date', run_date=next_run, args=[shard],
+            id=job_id, replace_existing=True
+        )
+        print(f"[SCHEDULER] Shard {shard}: next trading cycle at {next_run.strftime('%Y-%m-%d %H:%M')} PKT")
+
+    def reschedule_trading_cycle(self):
+        """Recomputes the next run of every shard held by this worker."""
+        for shard in sorted(self.shards):
+            self.reschedule_shard(shard)
+
+    def request_reschedule(self, settings: Optional[UserSettings] = None):
+        """
+        Called after settings change. Reschedules locally if this worker holds the account's
+        shard, otherwise flags the shard lock for its holder (all shards if no settings given).
+        """
+        shards = {accounts.shard_of(settings.account, self.shard_count)} if settings else set(range(self.shard_count))
+        remote = []
+        for shard in shards:
+            if shard in self.shards:
+                self.reschedule_shard(shard)
+            else:
+                remote.append(self._shard_lock(shard))
+        if not remote:
+            return
+
+        db = SessionLocal()
+        try:
+            db.query(SchedulerLock).filter(SchedulerLock.name.in_(remote)).update(
+                {SchedulerLock.reschedule_requested: True}, synchronize_session=False
+            )
+            db.commit()
+        finally:
+            db.close()
+
+
+scheduler_service = SchedulerService()
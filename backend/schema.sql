@@ -3,6 +3,7 @@
 
 CREATE TABLE IF NOT EXISTS user_settings (
     id SERIAL PRIMARY KEY,
+    account VARCHAR DEFAULT 'default',
     cash_balance FLOAT DEFAULT 0.0,
     monthly_investment FLOAT DEFAULT 0.0,
     daily_trade_budget FLOAT DEFAULT 5000.0,
@@ -15,9 +16,12 @@ CREATE TABLE IF NOT EXISTS user_settings (
     unused_budget_carryover FLOAT DEFAULT 0.0,
     polling_interval INTEGER DEFAULT 5,
     trading_start_time VARCHAR DEFAULT '09:30',
-    trading_end_time VARCHAR DEFAULT '15:30'
+    trading_end_time VARCHAR DEFAULT '15:30',
+    universe_mode VARCHAR DEFAULT 'HELD'
 );
 
+CREATE UNIQUE INDEX IF NOT EXISTS ix_user_settings_account ON user_settings (account);
+
 CREATE TABLE IF NOT EXISTS portfolio_items (
     id SERIAL PRIMARY KEY,
     symbol VARCHAR,
@@ -60,10 +64,15 @@ CREATE TABLE IF NOT EXISTS ai_alerts (
     reason VARCHAR,
     url VARCHAR,
     timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    is_read BOOLEAN DEFAULT FALSE
+    is_read BOOLEAN DEFAULT FALSE,
+    trading_day DATE,
+    dedup_key VARCHAR
 );
 
 CREATE INDEX IF NOT EXISTS ix_ai_alerts_symbol ON ai_alerts (symbol);
+CREATE INDEX IF NOT EXISTS ix_ai_alerts_timestamp ON ai_alerts (timestamp);
+CREATE INDEX IF NOT EXISTS ix_ai_alerts_trading_day ON ai_alerts (trading_day);
+CREATE UNIQUE INDEX IF NOT EXISTS ix_ai_alerts_dedup_key ON ai_alerts (dedup_key);
 
 CREATE TABLE IF NOT EXISTS portfolio_history (
     id SERIAL PRIMARY KEY,
@@ -77,6 +86,7 @@ CREATE TABLE IF NOT EXISTS portfolio_history (
 
 CREATE TABLE IF NOT EXISTS ai_portfolio_items (
     id SERIAL PRIMARY KEY,
+    account VARCHAR NOT NULL DEFAULT 'default',
     symbol VARCHAR,
     quantity INTEGER,
     avg_cost FLOAT,
@@ -91,9 +101,11 @@ CREATE TABLE IF NOT EXISTS ai_portfolio_items (
 );
 
 CREATE INDEX IF NOT EXISTS ix_ai_portfolio_items_symbol ON ai_portfolio_items (symbol);
+CREATE INDEX IF NOT EXISTS ix_ai_portfolio_items_account_symbol ON ai_portfolio_items (account, symbol);
 
 CREATE TABLE IF NOT EXISTS ai_recommendations (
     id SERIAL PRIMARY KEY,
+    account VARCHAR NOT NULL DEFAULT 'default',
     symbol VARCHAR,
     action VARCHAR,
     quantity INTEGER,
@@ -104,9 +116,13 @@ CREATE TABLE IF NOT EXISTS ai_recommendations (
 );
 
 CREATE INDEX IF NOT EXISTS ix_ai_recommendations_symbol ON ai_recommendations (symbol);
+CREATE INDEX IF NOT EXISTS ix_ai_recommendations_status ON ai_recommendations (status);
+CREATE INDEX IF NOT EXISTS ix_ai_recommendations_timestamp ON ai_recommendations (timestamp);
+CREATE INDEX IF NOT EXISTS ix_ai_recommendations_account_status_timestamp ON ai_recommendations (account, status, timestamp);
 
 CREATE TABLE IF NOT EXISTS ai_trade_history (
     id SERIAL PRIMARY KEY,
+    account VARCHAR NOT NULL DEFAULT 'default',
     symbol VARCHAR,
     action VARCHAR,
     quantity INTEGER,
@@ -117,12 +133,133 @@ CREATE TABLE IF NOT EXISTS ai_trade_history (
 );
 
 CREATE INDEX IF NOT EXISTS ix_ai_trade_history_symbol ON ai_trade_history (symbol);
+CREATE INDEX IF NOT EXISTS ix_ai_trade_history_account_timestamp ON ai_trade_history (account, timestamp);
+CREATE INDEX IF NOT EXISTS ix_ai_trade_history_account_id ON ai_trade_history (account, id);
 
 CREATE TABLE IF NOT EXISTS ai_notifications (
     id SERIAL PRIMARY KEY,
+    account VARCHAR NOT NULL DEFAULT 'default',
     title VARCHAR,
     message VARCHAR,
     type VARCHAR,
     timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     is_read BOOLEAN DEFAULT FALSE
 );
+
+CREATE INDEX IF NOT EXISTS ix_ai_notifications_timestamp ON ai_notifications (timestamp);
+CREATE INDEX IF NOT EXISTS ix_ai_notifications_account_timestamp ON ai_notifications (account, timestamp);
+
+CREATE TABLE IF NOT EXISTS news_articles (
+    url_hash VARCHAR PRIMARY KEY,
+    url VARCHAR,
+    title VARCHAR,
+    body VARCHAR,
+    simhash VARCHAR,
+    cluster_id VARCHAR,
+    first_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    analyzed_at TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS ix_news_articles_cluster_id ON news_articles (cluster_id);
+CREATE INDEX IF NOT EXISTS ix_news_articles_first_seen ON news_articles (first_seen);
+
+CREATE TABLE IF NOT EXISTS ledger_checkpoints (
+    id SERIAL PRIMARY KEY,
+    account VARCHAR NOT NULL DEFAULT 'default',
+    ledger_id INTEGER,
+    cash FLOAT,
+    realized_pnl FLOAT DEFAULT 0.0,
+    positions_json VARCHAR DEFAULT '{}',
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS ix_ledger_checkpoints_ledger_id ON ledger_checkpoints (ledger_id);
+CREATE INDEX IF NOT EXISTS ix_ledger_checkpoints_account_ledger_id ON ledger_checkpoints (account, ledger_id);
+
+-- Scheduler Coordination
+
+CREATE TABLE IF NOT EXISTS scheduler_locks (
+    name VARCHAR PRIMARY KEY,
+    owner VARCHAR,
+    acquired_at TIMESTAMP,
+    expires_at TIMESTAMP,
+    reschedule_requested BOOLEAN DEFAULT FALSE
+);
+
+CREATE TABLE IF NOT EXISTS cycle_metrics (
+    id SERIAL PRIMARY KEY,
+    account VARCHAR NOT NULL DEFAULT 'default',
+    name VARCHAR,
+    started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    status VARCHAR,
+    total_ms FLOAT,
+    upstream_calls INTEGER DEFAULT 0,
+    cache_hits INTEGER DEFAULT 0,
+    cache_misses INTEGER DEFAULT 0,
+    llm_tokens INTEGER DEFAULT 0,
+    stages_json VARCHAR DEFAULT '{}',
+    counters_json VARCHAR DEFAULT '{}'
+);
+
+CREATE INDEX IF NOT EXISTS ix_cycle_metrics_name ON cycle_metrics (name);
+CREATE INDEX IF NOT EXISTS ix_cycle_metrics_started_at ON cycle_metrics (started_at);
+CREATE INDEX IF NOT EXISTS ix_cycle_metrics_account_name_started_at ON cycle_metrics (account, name, started_at);
+
+-- Fundamentals
+
+CREATE TABLE IF NOT EXISTS stock_fundamentals (
+    symbol VARCHAR PRIMARY KEY,
+    name VARCHAR,
+    sector VARCHAR,
+    pe FLOAT,
+    eps FLOAT,
+    fair_value FLOAT,
+    growth FLOAT,
+    dividend_yield FLOAT,
+    market_cap FLOAT,
+    source VARCHAR DEFAULT 'MANUAL',
+    refreshed_at TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS ix_stock_fundamentals_sector ON stock_fundamentals (sector);
+CREATE INDEX IF NOT EXISTS ix_stock_fundamentals_pe ON stock_fundamentals (pe);
+CREATE INDEX IF NOT EXISTS ix_stock_fundamentals_dividend_yield ON stock_fundamentals (dividend_yield);
+CREATE INDEX IF NOT EXISTS ix_stock_fundamentals_refreshed_at ON stock_fundamentals (refreshed_at);
+
+-- Retention
+
+CREATE TABLE IF NOT EXISTS daily_rollups (
+    id SERIAL PRIMARY KEY,
+    table_name VARCHAR,
+    day DATE,
+    account VARCHAR NOT NULL DEFAULT '',
+    category VARCHAR,
+    symbol VARCHAR DEFAULT '',
+    count INTEGER DEFAULT 0,
+    first_at TIMESTAMP,
+    last_at TIMESTAMP,
+    sample VARCHAR,
+    CONSTRAINT uq_daily_rollups_key UNIQUE (table_name, day, account, category, symbol)
+);
+
+CREATE INDEX IF NOT EXISTS ix_daily_rollups_table_name ON daily_rollups (table_name);
+CREATE INDEX IF NOT EXISTS ix_daily_rollups_day ON daily_rollups (day);
+
+-- Market Data History
+
+CREATE TABLE IF NOT EXISTS klines (
+    id SERIAL PRIMARY KEY,
+    symbol VARCHAR,
+    timeframe VARCHAR,
+    ts TIMESTAMP,
+    open FLOAT,
+    high FLOAT,
+    low FLOAT,
+    close FLOAT,
+    volume FLOAT,
+    CONSTRAINT uq_klines_symbol_timeframe_ts UNIQUE (symbol, timeframe, ts)
+);
+
+CREATE INDEX IF NOT EXISTS ix_klines_symbol ON klines (symbol);
+CREATE INDEX IF NOT EXISTS ix_klines_timeframe_ts ON klines (timeframe, ts);
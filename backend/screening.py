@@ -0,0 +1,216 @@
+import json
+import time
+import threading
+import numpy as np
+from typing import Dict, List, Optional, Set
+
+from models import StockUniverse
+from market_data import market_data
+from cycle_profiler import cycle_profiler
+from fundamentals_store import fundamentals_store
+
+# Universe modes (UserSettings.universe_mode)
+MODE_HELD = "HELD"               # Only stocks already in the AI portfolio (original restricted mode)
+MODE_UNIVERSE = "UNIVERSE"       # All active StockUniverse rows
+MODE_FULL_MARKET = "FULL_MARKET" # Every symbol on the PSX REG board
+UNIVERSE_MODES = (MODE_HELD, MODE_UNIVERSE, MODE_FULL_MARKET)
+
+DEEP_ANALYSIS_LIMIT = 7       # Shortlist size for the expensive news/LLM stage
+MIN_FULL_MARKET_VOLUME = 50000 # Stage 1 liquidity floor for symbols outside the managed universe
+
+# Share of the polling interval each stage may use. The remainder is headroom for regime + DB writes.
+CYCLE_BUDGET_FRACTION = 0.8
+STAGE_BUDGET_SHARES = {
+    "snapshot": 0.10,
+    "scoring": 0.05,
+    "deep_analysis": 0.60,
+}
+
+
+class StageBudget:
+    """Wall-clock latency budget for one pipeline stage."""
+
+    def __init__(self, name: str, seconds: float):
+        self.name = name
+        self.seconds = seconds
+        self.start = time.perf_counter()
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
+
+    def remaining(self) -> float:
+        return max(0.0, self.seconds - self.elapsed())
+
+    def exceeded(self) -> bool:
+        if self.elapsed() >= self.seconds:
+            cycle_profiler.count(f"budget_exceeded_{self.name}")
+            return True
+        return False
+
+
+def stage_budgets(polling_interval_minutes: Optional[int]) -> Dict[str, float]:
+    """Seconds per stage, derived from the polling interval so a cycle fits before the next one."""
+    total = max(1, polling_interval_minutes or 5) * 60 * CYCLE_BUDGET_FRACTION
+    return {stage: total * share for stage, share in STAGE_BUDGET_SHARES.items()}
+
+
+# Parsed fundamentals_json, keyed by symbol and invalidated when the universe row changes.
+# Only used for symbols that have no typed row in stock_fundamentals yet.
+_fundamentals_cache: Dict[str, tuple] = {}
+
+
+def get_fundamentals(stock: StockUniverse) -> Dict:
+    typed = fundamentals_store.get(stock.symbol)
+    if typed is not None:
+        return typed
+    cached = _fundamentals_cache.get(stock.symbol)
+    if cached and cached[0] == stock.last_updated and cached[1] == stock.fundamentals_json:
+        return cached[2]
+    try:
+        parsed = json.loads(stock.fundamentals_json or "{}")
+    except ValueError:
+        parsed = {}
+    _fundamentals_cache[stock.symbol] = (stock.last_updated, stock.fundamentals_json, parsed)
+    return parsed
+
+
+REGIME_QUERY = "Pakistan Stock Exchange KSE100 Market Outlook"
+
+
+class CycleSnapshot:
+    """
+    Market inputs shared by every account run in one scheduler tick: the whole-board ticks,
+    the regime sentiment and per-symbol news sentiment are fetched once, on first use,
+    instead of once per account.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._board: Optional[Dict[str, Dict]] = None
+        self._regime: Optional[Dict] = None
+        self._sentiments: Dict[str, Dict] = {}
+
+    def board(self, timeout: float = 10) -> Dict[str, Dict]:
+        with self.lock:
+            if self._board is None:
+                self._board = market_data.get_ticks_snapshot(timeout=timeout)
+            else:
+                cycle_profiler.count("shared_snapshot_hits")
+            return self._board
+
+    def regime(self) -> Dict:
+        with self.lock:
+            if self._regime is None:
+                from news_agent import news_agent
+                self._regime = news_agent.get_sentiment_score(REGIME_QUERY)
+            return self._regime
+
+    def sentiments(self, symbols: List[str], timeout: float) -> Dict[str, Dict]:
+        """News sentiment for the symbols; only those no earlier account asked for are fetched."""
+        from news_agent import news_agent
+        with self.lock:
+            missing = [s for s in symbols if s not in self._sentiments]
+            if missing:
+                symbol_news = news_agent.fetch_symbol_news(missing, timeout=timeout)
+                self._sentiments.update(news_agent.get_batch_sentiment(symbol_news))
+            return {s: self._sentiments[s] for s in symbols if s in self._sentiments}
+
+
+class CandidatePipeline:
+    """
+    Staged candidate filtering for the allocation engine:
+    1. Snapshot: one bulk ticks call + cached fundamentals, cheap validity/liquidity filter.
+    2. Scoring: vectorized opportunity score over every survivor, narrowed to a shortlist.
+    3. Deep analysis (news + LLM) runs in AutonomousAgent on the shortlist only.
+    """
+
+    def load_snapshot(self, symbols: Optional[List[str]], budget: StageBudget,
+                      shared: Optional["CycleSnapshot"] = None) -> Dict[str, Dict]:
+        """
+        Prices for the requested symbols (None = whole board) from the bulk snapshot
+        (the tick's shared one when several accounts run together).
+        Falls back to per-symbol lookups for a small symbol list, within the stage budget.
+        """
+        timeout = max(1.0, budget.remaining())
+        snapshot = shared.board(timeout) if shared else market_data.get_ticks_snapshot(timeout=timeout)
+        if symbols is None:
+            return snapshot
+
+        selected = {s: snapshot[s] for s in symbols if s in snapshot}
+        for symbol in symbols:
+            if symbol in selected:
+                continue
+            if budget.exceeded():
+                print(f"[PIPELINE] Snapshot budget spent; {symbol} and later symbols skipped.")
+                break
+            price = market_data.get_live_price(symbol)
+            if price > 0:
+                selected[symbol] = {"price": price, "change_pct": 0.0, "volume": 0.0}
+        return selected
+
+    def score(self, snapshot: Dict[str, Dict], universe: List[StockUniverse], held_symbols: Set[str],
+              full_market: bool = False, limit: int = DEEP_ANALYSIS_LIMIT) -> List[Dict]:
+        """
+        Vectorized version of the opportunity score (0-100):
+        valuation (0-30) + momentum (0-30) + fundamentals (0-25) + position context (0-15).
+        Returns the top `limit` candidates, best first.
+        """
+        universe_by_symbol = {s.symbol: s for s in universe}
+        symbols = [s for s in snapshot if full_market or s in universe_by_symbol]
+        if not symbols:
+            return []
+
+        price = np.array([snapshot[s]["price"] for s in symbols], dtype=float)
+        change_pct = np.nan_to_num(np.array([snapshot[s].get("change_pct", 0.0) for s in symbols], dtype=float))
+        volume = np.array([snapshot[s].get("volume", 0.0) for s in symbols], dtype=float)
+        in_universe = np.array([s in universe_by_symbol for s in symbols])
+        held = np.array([s in held_symbols for s in symbols])
+        fair_value = np.array([
+            float(get_fundamentals(universe_by_symbol[s]).get("fair_value", 0) or 0) if s in universe_by_symbol else 0.0
+            for s in symbols
+        ])
+
+        # Stage 1 filter: valid price, and liquid unless we already track/hold it
+        keep = (price > 0) & (in_universe | held | (volume >= MIN_FULL_MARKET_VOLUME))
+
+        # A. Valuation (0-30): upside to fair value, neutral 15 when unknown
+        with np.errstate(divide="ignore", invalid="ignore"):
+            upside = np.where(price > 0, (fair_value - price) / price, 0.0)
+        val_score = np.select(
+            [fair_value <= 0, upside > 0.20, upside > 0.10, upside > 0, upside > -0.10],
+            [15, 30, 25, 20, 10],
+            default=5
+        )
+
+        # B. Momentum (0-30): neutral 15 as in the curated modes; the full-market scan also ranks
+        # on the day change from the snapshot, +-5% maps to +-15 around neutral
+        mom_score = 15 + np.clip(change_pct, -5, 5) * 3 if full_market else np.full(len(symbols), 15.0)
+
+        # C. Position Context (0-15): "Don't have it? Buy it"
+        p_score = np.where(held, 7, 15)
+
+        # D. Fundamental (0-25): assume good if curated into the Universe
+        fun_score = np.where(in_universe, 20, 10)
+
+        total = np.minimum(100, val_score + mom_score + fun_score + p_score)
+        total = np.where(keep, total, -1)
+
+        order = np.argsort(-total, kind="stable")
+        candidates = []
+        for i in order[:limit]:
+            if total[i] < 0:
+                break
+            symbol = symbols[i]
+            stock = universe_by_symbol.get(symbol)
+            candidates.append({
+                "symbol": symbol,
+                "tier": stock.tier if stock else "OPTIONAL",
+                "score": int(round(total[i])), # Base Score
+                "price": float(price[i]),
+            })
+
+        print(f"[PIPELINE] Scored {len(symbols)} symbols ({int(keep.sum())} passed filter), shortlisted {len(candidates)}.")
+        return candidates
+
+
+candidate_pipeline = CandidatePipeline()
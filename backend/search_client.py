@@ -0,0 +1,193 @@
+import os
+import time
+import random
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Dict, List, Optional
+from duckduckgo_search import DDGS
+from duckduckgo_search.exceptions import RatelimitException
+
+from cycle_profiler import cycle_profiler
+from offline_data import OfflineSearch
+
+# "duckduckgo" (default) or "offline": deterministic local stand-in for benchmarks without network access
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "duckduckgo").lower()
+SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL", "900")) # Results for the same query reused for 15 minutes
+SEARCH_EMPTY_TTL = 300        # "No news" is cached shorter than real results
+SEARCH_CACHE_MAX_ENTRIES = 1000
+SEARCH_MAX_CONCURRENCY = 4    # DuckDuckGo requests in flight
+SEARCH_MIN_INTERVAL = 0.5     # Seconds between request starts (all threads)
+THROTTLE_BASE_COOLDOWN = 5.0  # First cooldown after a rate limit, doubled on each consecutive one
+THROTTLE_MAX_COOLDOWN = 120.0
+
+
+class SearchThrottled(Exception):
+    """DuckDuckGo rate-limited us (now, or recently enough that we're still cooling down)."""
+
+
+def normalize_query(query: str) -> str:
+    return " ".join((query or "").lower().split())
+
+
+class SearchClient:
+    """
+    Shared DuckDuckGo text search for NewsAgent and chat.
+    Results are cached by (normalized query, timelimit); identical concurrent queries share
+    one request; requests are spaced and capped, and a rate limit triggers a global cooldown.
+    Throttling is reported separately from "no news" both in stats and to the caller.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.cache: "OrderedDict[tuple, tuple]" = OrderedDict() # {key: (expires_at, max_results, results)}
+        self.inflight: Dict[tuple, Future] = {}
+        self.slots = threading.BoundedSemaphore(SEARCH_MAX_CONCURRENCY)
+        self.next_start = 0.0
+        self.cooldown_until = 0.0
+        self.consecutive_throttles = 0
+        self.stats = {"requests": 0, "cache_hits": 0, "upstream": 0, "results": 0, "no_news": 0, "throttled": 0, "errors": 0}
+        self.offline = OfflineSearch() if SEARCH_BACKEND == "offline" else None
+        self.min_interval = SEARCH_MIN_INTERVAL
+        if self.offline:
+            self.min_interval = 0.0 # Spacing protects DuckDuckGo; the stand-in's latency is SEARCH_OFFLINE_LATENCY_MS
+            print("[SEARCH] Using offline stand-in backend")
+
+    def _count(self, key: str):
+        with self.lock:
+            self.stats[key] += 1
+        cycle_profiler.count(f"search_{key}")
+
+    # --- Cache ---
+
+    def _cached(self, key: tuple, max_results: int, allow_stale: bool = False) -> Optional[List[Dict]]:
+        with self.lock:
+            entry = self.cache.get(key)
+            if not entry:
+                return None
+            expires_at, cached_max, results = entry
+            # A cached answer covers this call if it asked for at least as many results, or got fewer than it asked
+            covers = cached_max >= max_results or len(results) < cached_max
+            if covers and (allow_stale or expires_at > time.monotonic()):
+                self.cache.move_to_end(key)
+                return results[:max_results]
+        return None
+
+    def _store(self, key: tuple, max_results: int, results: List[Dict]):
+        ttl = SEARCH_CACHE_TTL if results else SEARCH_EMPTY_TTL
+        with self.lock:
+            self.cache[key] = (time.monotonic() + ttl, max_results, results)
+            self.cache.move_to_end(key)
+            while len(self.cache) > SEARCH_CACHE_MAX_ENTRIES:
+                self.cache.popitem(last=False)
+
+    # --- Search ---
+
+    def text(self, query: str, max_results: int = 10, timelimit: Optional[str] = "w", timeout: float = 10) -> List[Dict]:
+        """
+        Cached DuckDuckGo text search. Returns [] when there is genuinely no news;
+        raises SearchThrottled when rate limited (after serving a stale cached answer if one exists).
+        """
+        self._count("requests")
+        key = (normalize_query(query), timelimit)
+        results = self._cached(key, max_results)
+        if results is not None:
+            self._count("cache_hits")
+            return results
+
+        with self.lock:
+            future = self.inflight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self.inflight[key] = future
+
+        if not owner:
+            # Same query already running in another thread: share its answer
+            self._count("cache_hits")
+            return future.result(timeout=timeout)[:max_results]
+
+        try:
+            results = self._fetch(query, max_results, timelimit, timeout)
+            self._store(key, max_results, results)
+            future.set_result(results)
+            return results
+        except SearchThrottled as e:
+            stale = self._cached(key, max_results, allow_stale=True)
+            if stale is not None:
+                print(f"[SEARCH] Throttled; serving stale results for '{query}'")
+                future.set_result(stale)
+                return stale
+            future.set_exception(e)
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                self.inflight.pop(key, None)
+
+    def _fetch(self, query: str, max_results: int, timelimit: Optional[str], timeout: float) -> List[Dict]:
+        deadline = time.monotonic() + timeout
+        if not self.slots.acquire(timeout=timeout):
+            raise TimeoutError(f"No search slot within {timeout}s")
+        try:
+            self._wait_turn(deadline)
+            self._count("upstream")
+            try:
+                # One DDGS client per request: instances are not safe to share across threads
+                engine = self.offline or DDGS(timeout=max(1, int(deadline - time.monotonic())))
+                results = engine.text(query, max_results=max_results, timelimit=timelimit) or []
+            except RatelimitException as e:
+                self._throttled()
+                raise SearchThrottled(str(e)) from e
+            except Exception:
+                self._count("errors")
+                raise
+        finally:
+            self.slots.release()
+
+        with self.lock:
+            self.consecutive_throttles = 0
+        self._count("results" if results else "no_news")
+        return results
+
+    def _wait_turn(self, deadline: float):
+        """Reserves the next request start time (spacing + cooldown) and sleeps until then."""
+        with self.lock:
+            now = time.monotonic()
+            if self.cooldown_until > deadline:
+                self.stats["throttled"] += 1
+                cycle_profiler.count("search_throttled")
+                raise SearchThrottled(f"Cooling down for {self.cooldown_until - now:.0f}s after rate limit")
+            start = max(now, self.next_start, self.cooldown_until)
+            self.next_start = start + self.min_interval
+        if start > deadline:
+            raise TimeoutError("Search deadline passed while waiting for a request slot")
+        if start > now:
+            time.sleep(start - now)
+
+    def _throttled(self):
+        self._count("throttled")
+        with self.lock:
+            self.consecutive_throttles += 1
+            cooldown = min(THROTTLE_MAX_COOLDOWN, THROTTLE_BASE_COOLDOWN * 2 ** (self.consecutive_throttles - 1))
+            cooldown *= random.uniform(0.8, 1.2) # Jitter so workers don't resume in lockstep
+            self.cooldown_until = max(self.cooldown_until, time.monotonic() + cooldown)
+        print(f"[SEARCH] Rate limited by DuckDuckGo; backing off {cooldown:.0f}s")
+
+    def summary(self) -> Dict:
+        with self.lock:
+            stats = dict(self.stats)
+            entries = len(self.cache)
+            cooldown = max(0.0, self.cooldown_until - time.monotonic())
+        lookups = stats["requests"]
+        return {
+            **stats,
+            "cache_entries": entries,
+            "cache_hit_rate": round(stats["cache_hits"] / lookups, 3) if lookups else None,
+            "cooldown_seconds": round(cooldown, 1)
+        }
+
+
+search_client = SearchClient()
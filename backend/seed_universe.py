@@ -1,5 +1,6 @@
 from sqlalchemy.orm import Session
 from models import StockUniverse, init_db, SessionLocal
+from fundamentals_store import fundamentals_store
 import json
 
 def seed_universe():
@@ -49,6 +50,7 @@ def seed_universe():
             )
             db.add(new_item)
             print(f"Created {item['symbol']}")
+        fundamentals_store.set_manual(db, item["symbol"], item["fundamentals"])
     
     db.commit()
     print("Seeding Complete.")
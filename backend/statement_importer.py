@@ -0,0 +1,319 @@
+import io
+import csv
+import argparse
+import pytz
+from datetime import datetime
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from models import SessionLocal, PortfolioItem, AIPortfolioItem, Transaction, AITradeHistory, AINotification, DEFAULT_ACCOUNT
+from accounts import accounts
+
+IMPORT_BATCH_ROWS = 1000 # History rows per bulk INSERT (all inside one transaction)
+IMPORT_MAX_ERRORS = 50   # Errors reported back; the import is rejected if there are any
+IMPORT_TARGETS = ("portfolio", "ai")
+
+# Accepted header spellings (lower-cased, stripped) -> field
+COLUMN_ALIASES = {
+    "date": "date", "trade date": "date", "timestamp": "date", "settlement date": "date",
+    "symbol": "symbol", "scrip": "symbol", "ticker": "symbol", "security": "symbol",
+    "action": "action", "side": "action", "type": "action", "buy/sell": "action",
+    "quantity": "quantity", "qty": "quantity", "shares": "quantity", "volume": "quantity",
+    "price": "price", "rate": "price", "avg price": "price", "unit price": "price",
+    "notes": "notes", "remarks": "notes", "description": "notes",
+}
+REQUIRED_COLUMNS = ("date", "symbol", "action", "quantity", "price")
+ACTION_ALIASES = {"BUY": "BUY", "B": "BUY", "PURCHASE": "BUY", "SELL": "SELL", "S": "SELL", "SALE": "SELL"}
+DATE_FORMATS = ("%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y", "%d-%b-%Y", "%d %b %Y", "%m/%d/%Y")
+
+
+class StatementError(ValueError):
+    """The statement can't be read at all (format, missing columns)."""
+
+
+def _parse_date(value) -> datetime:
+    if isinstance(value, datetime):
+        return value
+    text = str(value).strip()
+    try:
+        return datetime.fromisoformat(text)
+    except ValueError:
+        pass
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt)
+        except ValueError:
+            continue
+    raise ValueError(f"Unrecognized date '{text}'")
+
+
+def _number(value) -> float:
+    if isinstance(value, (int, float)):
+        return float(value)
+    return float(str(value).replace(",", "").strip())
+
+
+def _csv_rows(stream: BinaryIO) -> Iterator[List]:
+    yield from csv.reader(io.TextIOWrapper(stream, encoding="utf-8-sig", newline=""))
+
+
+def _xlsx_rows(stream: BinaryIO) -> Iterator[List]:
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise StatementError("XLSX statements need openpyxl (pip install openpyxl)")
+    # read_only streams rows from the sheet XML instead of loading the whole workbook
+    workbook = load_workbook(stream, read_only=True, data_only=True)
+    try:
+        for row in workbook.active.iter_rows(values_only=True):
+            yield list(row)
+    finally:
+        workbook.close()
+
+
+def read_statement(stream: BinaryIO, filename: str) -> Iterator[Tuple[int, Dict]]:
+    """Yields (line number, normalized row) one at a time. Bad rows yield {"error": ...} instead."""
+    rows = _xlsx_rows(stream) if filename.lower().endswith((".xlsx", ".xlsm")) else _csv_rows(stream)
+
+    header = None
+    for line, raw in enumerate(rows, start=1):
+        if not raw or all(c is None or str(c).strip() == "" for c in raw):
+            continue
+        if header is None:
+            header = [COLUMN_ALIASES.get(str(c or "").strip().lower()) for c in raw]
+            missing = [c for c in REQUIRED_COLUMNS if c not in header]
+            if missing:
+                raise StatementError(f"Missing column(s): {', '.join(missing)}")
+            continue
+
+        values = {field: raw[i] for i, field in enumerate(header) if field and i < len(raw)}
+        try:
+            action = ACTION_ALIASES.get(str(values.get("action") or "").strip().upper())
+            if not action:
+                raise ValueError(f"Unknown action '{values.get('action')}'")
+            quantity = _number(values["quantity"])
+            price = _number(values["price"])
+            if quantity <= 0 or quantity != int(quantity):
+                raise ValueError(f"Quantity must be a positive whole number, got {values['quantity']}")
+            if price < 0:
+                raise ValueError("Price must be non-negative")
+            symbol = str(values.get("symbol") or "").strip().upper()
+            if not symbol:
+                raise ValueError("Missing symbol")
+            yield line, {
+                "date": _parse_date(values["date"]),
+                "symbol": symbol,
+                "action": action,
+                "quantity": int(quantity),
+                "price": price,
+                "notes": str(values["notes"]).strip() if values.get("notes") else None,
+            }
+        except (KeyError, ValueError, TypeError) as e:
+            yield line, {"error": str(e)}
+
+
+class StatementImporter:
+    """
+    Imports a broker statement (CSV or XLSX; one trade per row) into the manual portfolio
+    (PortfolioItem + Transaction) or the AI portfolio (AIPortfolioItem + AITradeHistory).
+    Rows are parsed as a stream, then applied oldest first (broker statements are often newest
+    first) with positions kept in memory under the same weighted-average cost rules as the
+    single-entry endpoints. History rows go in with bulk INSERTs and the
+    position updates with one pass at the end, all in one transaction. Any bad row rejects the
+    whole import; dry runs only report what the positions would become.
+    """
+
+    def _positions(self, db: Session, target: str, account: str) -> Dict[str, list]:
+        """{symbol: [qty, total_cost]} as currently stored."""
+        if target == "ai":
+            items = db.query(AIPortfolioItem).filter(AIPortfolioItem.account == account).all()
+            return {i.symbol: [i.quantity or 0, i.total_cost or 0.0] for i in items}
+        return {i.symbol: [i.quantity or 0, (i.quantity or 0) * (i.avg_cost or 0.0)] for i in db.query(PortfolioItem).all()}
+
+    def _history_row(self, target: str, row: Dict, pnl: Optional[float], account: str) -> Dict:
+        notes = row["notes"] or "Statement Import"
+        if target == "ai":
+            # Bought outside the AI budget, so buys are MANUAL_BUY (no cash effect) like /autonomous/holdings/add
+            return {
+                "account": account,
+                "symbol": row["symbol"], "action": "MANUAL_BUY" if row["action"] == "BUY" else "SELL",
+                "quantity": row["quantity"], "price": row["price"], "pnl": pnl,
+                "timestamp": row["date"], "reason": f"Statement Import: {notes}"
+            }
+        return {
+            "symbol": row["symbol"], "action": row["action"], "quantity": row["quantity"],
+            "price": row["price"], "timestamp": row["date"], "notes": notes
+        }
+
+    def run(self, db: Session, stream: BinaryIO, filename: str, target: str = "portfolio", dry_run: bool = False,
+            account: str = DEFAULT_ACCOUNT) -> Dict:
+        """`account` selects the AI fund for the 'ai' target; the manual portfolio has no accounts."""
+        if target not in IMPORT_TARGETS:
+            raise StatementError(f"Unknown target '{target}' (expected one of {', '.join(IMPORT_TARGETS)})")
+        if target == "ai" and not accounts.settings(db, account):
+            raise StatementError(f"Unknown account '{account}'")
+        history_model = AITradeHistory if target == "ai" else Transaction
+
+        before = self._positions(db, target, account)
+        positions = {s: list(p) for s, p in before.items()}
+        errors, batch = [], []
+        counts = {"rows": 0, "buys": 0, "sells": 0}
+        proceeds = realized = 0.0
+
+        try:
+            parsed = []
+            for line, row in read_statement(stream, filename):
+                if "error" in row:
+                    errors.append({"line": line, "error": row["error"]})
+                    if len(errors) >= IMPORT_MAX_ERRORS:
+                        break
+                    continue
+                parsed.append((line, row))
+
+            for line, row in self._in_date_order(parsed):
+                qty_cost = positions.setdefault(row["symbol"], [0, 0.0])
+                pnl = None
+                if row["action"] == "BUY":
+                    qty_cost[0] += row["quantity"]
+                    qty_cost[1] += row["quantity"] * row["price"]
+                    counts["buys"] += 1
+                else:
+                    if qty_cost[0] < row["quantity"]:
+                        errors.append({"line": line, "error": f"Sells {row['quantity']} {row['symbol']} but only {qty_cost[0]} held"})
+                        continue
+                    avg_cost = qty_cost[1] / qty_cost[0]
+                    pnl = (row["price"] - avg_cost) * row["quantity"]
+                    qty_cost[0] -= row["quantity"]
+                    qty_cost[1] = qty_cost[1] - avg_cost * row["quantity"] if qty_cost[0] else 0.0
+                    proceeds += row["quantity"] * row["price"]
+                    realized += pnl
+                    counts["sells"] += 1
+                counts["rows"] += 1
+
+                if not dry_run and not errors:
+                    batch.append(self._history_row(target, row, pnl, account))
+                    if len(batch) >= IMPORT_BATCH_ROWS:
+                        db.execute(insert(history_model), batch)
+                        batch = []
+
+            result = {
+                "target": target,
+                "dry_run": dry_run,
+                **counts,
+                "sale_proceeds": round(proceeds, 2),
+                "realized_pnl": round(realized, 2),
+                "errors": errors,
+                "positions": self._report(before, positions),
+            }
+            if dry_run or errors:
+                db.rollback()
+                return {**result, "imported": False}
+
+            if batch:
+                db.execute(insert(history_model), batch)
+            self._write_positions(db, target, before, positions, proceeds, account)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+
+        print(f"[IMPORT] {filename} -> {target}: {counts['rows']} rows ({counts['buys']} buys, {counts['sells']} sells)")
+        return {**result, "imported": True}
+
+    def _in_date_order(self, parsed: List[Tuple[int, Dict]]) -> List[Tuple[int, Dict]]:
+        """
+        Oldest first, so sells never precede the buys they close and average costs don't depend
+        on the file's order. Rows with the same timestamp keep file order, reversed first if the
+        statement as a whole runs newest first.
+        """
+        key = lambda item: item[1]["date"].replace(tzinfo=None)
+        if len(parsed) > 1 and key(parsed[0]) > key(parsed[-1]):
+            parsed = parsed[::-1]
+        return sorted(parsed, key=key)
+
+    def _write_positions(self, db: Session, target: str, before: Dict[str, list], positions: Dict[str, list], proceeds: float,
+                         account: str = DEFAULT_ACCOUNT):
+        """One pass over the touched symbols: update, insert or delete. Sale proceeds go to the matching cash balance."""
+        model = AIPortfolioItem if target == "ai" else PortfolioItem
+        changed = {s for s, p in positions.items() if before.get(s) != p}
+        query = db.query(model).filter(model.symbol.in_(changed))
+        if target == "ai":
+            query = query.filter(AIPortfolioItem.account == account)
+        items = {i.symbol: i for i in query.all()} if changed else {}
+
+        for symbol in changed:
+            qty, cost = positions[symbol]
+            item = items.get(symbol)
+            if qty <= 0:
+                if item:
+                    db.delete(item)
+                continue
+            if not item:
+                item = model(symbol=symbol)
+                if target == "ai":
+                    item.account = account
+                    item.current_price = cost / qty
+                    item.user_reasoning = "Statement Import"
+                    item.purchased_at = datetime.now(pytz.utc)
+                db.add(item)
+            item.quantity = qty
+            item.avg_cost = cost / qty
+            if target == "ai":
+                item.total_cost = cost
+
+        settings = accounts.settings(db, account if target == "ai" else DEFAULT_ACCOUNT)
+        if proceeds:
+            if target == "ai":
+                settings.ai_cash_balance = (settings.ai_cash_balance or 0.0) + proceeds
+            else:
+                settings.cash_balance = (settings.cash_balance or 0.0) + proceeds
+
+        if target == "ai":
+            db.add(AINotification(
+                account=account,
+                title="Statement Import",
+                message=f"Imported trades for {len(changed)} symbol(s) into the AI portfolio",
+                type="INFO",
+                timestamp=datetime.now(pytz.utc)
+            ))
+
+    def _report(self, before: Dict[str, list], positions: Dict[str, list]) -> List[Dict]:
+        report = []
+        for symbol in sorted(positions):
+            qty, cost = positions[symbol]
+            old_qty = before.get(symbol, [0, 0.0])[0]
+            if qty <= 0 and old_qty <= 0:
+                continue
+            report.append({
+                "symbol": symbol,
+                "quantity": qty,
+                "avg_cost": round(cost / qty, 2) if qty else 0.0,
+                "total_cost": round(cost, 2),
+                "quantity_change": qty - old_qty,
+            })
+        return report
+
+
+statement_importer = StatementImporter()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import a broker statement (CSV/XLSX)")
+    parser.add_argument("path")
+    parser.add_argument("--target", choices=IMPORT_TARGETS, default="portfolio")
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--account", default=DEFAULT_ACCOUNT, help="AI fund for --target ai")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        with open(args.path, "rb") as f:
+            result = statement_importer.run(db, f, args.path, args.target, args.dry_run, args.account)
+        for p in result["positions"]:
+            print(f"{p['symbol']:<8} {p['quantity']:>8} @ {p['avg_cost']:>10.2f} ({p['quantity_change']:+d})")
+        for e in result["errors"]:
+            print(f"Line {e['line']}: {e['error']}")
+        print(f"{result['rows']} rows, imported: {result['imported']}")
+    finally:
+        db.close()
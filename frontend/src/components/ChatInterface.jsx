@@ -1,5 +1,4 @@
 import React, { useState, useEffect, useRef } from 'react';
-import axios from 'axios';
 import { Send, Bot, User, Sparkles } from 'lucide-react';
 import ReactMarkdown from 'react-markdown';
 import clsx from 'clsx';
@@ -38,13 +37,46 @@ const ChatInterface = () => {
                 content: msg.content
             }));
 
-            const response = await axios.post(`${API_BASE_URL}/chat`, {
-                message: input,
-                history: history
+            // Stream the answer over SSE so tokens render as they arrive
+            const response = await fetch(`${API_BASE_URL}/chat/stream`, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ message: input, history: history })
             });
+            if (!response.ok || !response.body) throw new Error(`HTTP ${response.status}`);
 
-            const botMsg = { role: 'bot', content: response.data.answer };
-            setMessages(prev => [...prev, botMsg]);
+            const updateBotMsg = (update) => setMessages(prev => {
+                const next = [...prev];
+                next[next.length - 1] = { ...next[next.length - 1], ...update(next[next.length - 1]) };
+                return next;
+            });
+
+            setMessages(prev => [...prev, { role: 'bot', content: '' }]);
+            setLoading(false); // The streaming message replaces the "Thinking..." bubble
+
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            while (true) {
+                const { done, value } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+
+                // SSE events are separated by a blank line
+                const events = buffer.split('\n\n');
+                buffer = events.pop();
+                for (const raw of events) {
+                    const eventLine = raw.split('\n').find(l => l.startsWith('event: '));
+                    const dataLine = raw.split('\n').find(l => l.startsWith('data: '));
+                    if (!eventLine || !dataLine) continue;
+                    const data = JSON.parse(dataLine.slice(6));
+                    if (eventLine.slice(7) === 'token') {
+                        updateBotMsg(msg => ({ content: msg.content + data.text }));
+                    } else if (eventLine.slice(7) === 'done') {
+                        updateBotMsg(() => ({ suggested_trades: data.suggested_trades, alerts: data.alerts }));
+                    }
+                }
+            }
         } catch (error) {
             console.error("Chat error:", error);
             setMessages(prev => [...prev, { role: 'bot', content: "Sorry, I encountered an error processing your request." }]);
@@ -11,7 +11,8 @@ const SettingsView = () => {
         rollover_percent: 0.5,
         polling_interval: 5,
         trading_start_time: "09:30",
-        trading_end_time: "15:30"
+        trading_end_time: "15:30",
+        universe_mode: "HELD"
     });
     const [loading, setLoading] = useState(true);
     const [saving, setSaving] = useState(false);
@@ -37,7 +38,7 @@ const SettingsView = () => {
         setSettings(prev => ({
             ...prev,
             [name]: type === 'checkbox' ? checked :
-                (name === 'trading_start_time' || name === 'trading_end_time') ? value :
+                (name === 'trading_start_time' || name === 'trading_end_time' || name === 'universe_mode') ? value :
                     parseFloat(value)
         }));
     };
@@ -150,6 +151,20 @@ const SettingsView = () => {
                             </select>
                             <p className="text-xs text-text-muted mt-1">How often AI scans for news & alerts.</p>
                         </div>
+                        <div>
+                            <label className="block text-sm font-medium text-text-secondary mb-2">Stock Universe</label>
+                            <select
+                                name="universe_mode"
+                                value={settings.universe_mode || "HELD"}
+                                onChange={handleChange}
+                                className="input w-full"
+                            >
+                                <option value="HELD">Held Stocks Only</option>
+                                <option value="UNIVERSE">Managed Universe</option>
+                                <option value="FULL_MARKET">Full PSX Market</option>
+                            </select>
+                            <p className="text-xs text-text-muted mt-1">Which stocks the AI screens each cycle.</p>
+                        </div>
                     </div>
                 </div>
 